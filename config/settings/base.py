@@ -49,6 +49,22 @@ MIDDLEWARE = (
     'django.middleware.security.SecurityMiddleware',
 )
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    #shared by all the app processes - culls the least recently used entries
+    'fast': {
+        'BACKEND': 'etd_app.cache_backends.LruDatabaseCache',
+        'LOCATION': 'etd_fast_cache',
+        'TIMEOUT': 60 * 60 * 24,
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+            'CULL_FREQUENCY': 10,
+        },
+    },
+}
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -81,6 +97,17 @@ MEDIA_ROOT = get_env_setting('MEDIA_ROOT')
 MEDIA_URL = '/etd/media/'
 
 FILE_UPLOAD_PERMISSIONS = 0o664
+#where the chunks of resumable uploads are kept until they're committed
+CHUNKED_UPLOAD_DIR = os.path.join(MEDIA_ROOT, 'chunked_uploads')
+CHUNKED_UPLOAD_CHUNK_SIZE = 4 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_AGE_DAYS = 7
+#identical thesis files share one stored blob - a blob that was reused this recently isn't deleted when
+#  a thesis stops using it, in case the reusing upload hasn't been committed to the db yet
+THESIS_BLOB_REUSE_GRACE_SECONDS = 60 * 60
+#how view_file sends the file: 'django' (FileResponse), 'x-sendfile' (Apache mod_xsendfile),
+#  or 'x-accel-redirect' (nginx, with an internal location for MEDIA_ROOT at THESIS_FILE_ACCEL_REDIRECT_PREFIX)
+THESIS_FILE_DELIVERY = 'django'
+THESIS_FILE_ACCEL_REDIRECT_PREFIX = '/etd/protected-media/'
 
 STATIC_ROOT = os.path.normpath(os.path.join(BASE_DIR, 'assets'))
 STATIC_URL = '/etd/static/'
@@ -150,9 +177,58 @@ BOOTSTRAP3 = {
 }
 CRISPY_TEMPLATE_PACK = 'bootstrap3'
 
+STAFF_CANDIDATES_PAGE_SIZE = 100
+KEYWORD_SEARCH_LIMIT = 50
+#serve keyword autocomplete from an in-process index, rebuilt after KEYWORD_MEMORY_INDEX_MAX_AGE seconds
+KEYWORD_MEMORY_INDEX = False
+KEYWORD_MEMORY_INDEX_MAX_AGE = 300
+
 FAST_LOOKUP_BASE_URL = 'http://fast.oclc.org/searchfast/fastsuggest'
+#outgoing http calls (see etd_app.http_client) - timeouts are (connect, read) seconds, or one number for both
+HTTP_CLIENT_DEFAULTS = {
+    'timeout': (3.05, 30),
+    'pool_maxsize': 10,
+    'retries': 2,
+    'backoff_factor': 0.2,
+    'retry_statuses': [502, 503, 504],
+    'retry_methods': ['GET', 'HEAD'],
+}
+HTTP_CLIENT_ENDPOINTS = {
+    #autocomplete - fail fast instead of retrying
+    'fast': {'timeout': 2, 'retries': 0},
+    #ingest posts can be big, and the API can take a while to answer
+    'bdr_api': {'timeout': (5, 600)},
+}
+#answer FAST suggestions from a local index (built by 'manage.py import_fast_subjects') instead of the API
+FAST_LOCAL_INDEX_PATH = None
+FAST_LOCAL_INDEX_LIMIT = 20
+#autocomplete_keywords gives up waiting for FAST after this many seconds (total), and returns the local results
+AUTOCOMPLETE_LATENCY_BUDGET = 2.5
+FAST_LOOKUP_MAX_WORKERS = 8
+#FAST results are cached for FAST_CACHE_TTL seconds (the 'fast' cache TIMEOUT is how long an
+#  entry can go unused before it's evicted); run 'manage.py createcachetable' for the db cache
+FAST_CACHE_ALIAS = 'fast'
+FAST_CACHE_TTL = 60 * 60 * 24 * 7
+#a cache hit only pushes the entry's expiration out (for the LRU) if it's been this long since the last time
+FAST_CACHE_TOUCH_INTERVAL = 60 * 60
+#each process adds up its hit/miss counts, and writes them to the db after this many lookups or seconds
+FAST_CACHE_STATS_FLUSH_COUNT = 100
+FAST_CACHE_STATS_FLUSH_SECONDS = 60
 SERVER_ROOT = get_env_setting('SERVER_ROOT')
 API_URL = get_env_setting('API_URL')
+#transient BDR API failures (couldn't connect, 429) are retried this many times, waiting a random
+#  time of up to INGEST_RETRY_BACKOFF * 2**attempt seconds (capped at INGEST_RETRY_MAX_BACKOFF)
+INGEST_RETRIES = 3
+INGEST_RETRY_BACKOFF = 2
+INGEST_RETRY_MAX_BACKOFF = 60
+#optional URL for finding an item by the ingest Idempotency-Key, checked before a retry in case the
+#  failed post actually went through - {key} is filled in, and it should return JSON with the pid (404 if not found).
+#  Read timeouts and 5xx responses are only retried if this is set - otherwise the thesis gets an ingest error.
+INGEST_LOOKUP_URL = None
+#ingest jobs are run by 'manage.py ingest_worker' - a worker holds a job for INGEST_JOB_LEASE_SECONDS (renewed
+#  between retries of the post), and a job whose worker died is picked up again, up to INGEST_JOB_MAX_ATTEMPTS times
+INGEST_JOB_LEASE_SECONDS = 60 * 60 * 2
+INGEST_JOB_MAX_ATTEMPTS = 3
 GRADSCHOOL_ETD_ADDRESS = get_env_setting('GRADSCHOOL_ETD_ADDRESS')
 OWNER_ID = get_env_setting('OWNER_ID')
 EMBARGOED_DISPLAY_IDENTITY = get_env_setting('EMBARGOED_DISPLAY_IDENTITY')
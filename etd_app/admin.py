@@ -6,7 +6,7 @@ from import_export import resources
 from import_export.admin import ImportExportModelAdmin
 from . import models
 from .forms import AdminThesisForm, AdminCandidateForm
-from .ingestion import ThesisIngester, IngestException, find_theses_to_ingest
+from .ingestion import enqueue_theses
 
 
 logger = logging.getLogger('etd')
@@ -23,10 +23,12 @@ class ReadyToIngestFilter(SimpleListFilter):
         )
 
     def queryset(self, request, queryset):
+        #plain conditions on the queryset, so they work with search and pagination
         val = self.value()
         if val == 'yes':
-            theses = find_theses_to_ingest()
-            return queryset.filter(id__in=[t.id for t in theses])
+            return queryset.filter(models.Thesis.get_ready_to_ingest_filter())
+        if val == 'no':
+            return queryset.exclude(models.Thesis.get_ready_to_ingest_filter())
         return queryset
 
 
@@ -34,20 +36,19 @@ class ThesisAdmin(admin.ModelAdmin):
 
     list_display = ['id', 'candidate', 'title', 'original_file_name', 'status', 'pid']
     list_filter = ['status', ReadyToIngestFilter]
+    #just the joins the candidate column needs (person & degree) - by default the admin joins every non-null foreign key
+    list_select_related = ['candidate__person', 'candidate__degree']
     search_fields = ['candidate__person__last_name', 'candidate__person__first_name', 'title']
     actions = ['ingest', 'open_for_reupload']
     form = AdminThesisForm
 
     def ingest(self, request, queryset):
-        for thesis in queryset:
-            ingester = ThesisIngester(thesis)
-            try:
-                ingester.ingest()
-            except IngestException as ie:
-                msg = f'Error ingesting thesis {thesis.id}'
-                msg = f'{msg}\n{ie}'
-                logger.error(msg)
-                messages.error(request, f'Error ingesting thesis {thesis.id}. Check the log and re-ingest.')
+        #just queue the jobs - "manage.py ingest_worker" does the ingesting, so this request doesn't wait on the uploads
+        jobs, not_ready = enqueue_theses(queryset)
+        for thesis in not_ready:
+            messages.error(request, f'Thesis {thesis.id} is not ready to ingest.')
+        if jobs:
+            messages.info(request, f'Queued {len(jobs)} theses for ingestion.')
     ingest.short_description = 'Ingest selected theses'
 
     def open_for_reupload(self, request, queryset):
@@ -59,6 +60,14 @@ class ThesisAdmin(admin.ModelAdmin):
     open_for_reupload.short_description = 'Open For Re-Upload'
 
 
+class IngestJobAdmin(admin.ModelAdmin):
+
+    list_display = ['id', 'thesis', 'status', 'attempts', 'claimed_by', 'pid', 'created', 'started', 'finished']
+    list_filter = ['status']
+    list_select_related = ['thesis']
+    readonly_fields = ['thesis', 'attempts', 'claimed_by', 'lease_expires', 'pid', 'last_error', 'created', 'started', 'finished']
+
+
 class PersonAdmin(admin.ModelAdmin):
 
     list_display = ['id', 'netid', 'last_name', 'first_name', 'email', 'created', 'modified']
@@ -99,3 +108,4 @@ admin.site.register(models.CommitteeMember)
 admin.site.register(models.Language)
 admin.site.register(models.Keyword, KeywordAdmin)
 admin.site.register(models.Thesis, ThesisAdmin)
+admin.site.register(models.IngestJob, IngestJobAdmin)
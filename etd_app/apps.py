@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
+
+
+class EtdAppConfig(AppConfig):
+    name = 'etd_app'
+
+    def ready(self):
+        from .keyword_index import keyword_deleted, keyword_saved
+        from .models import Keyword
+        post_save.connect(keyword_saved, sender=Keyword, dispatch_uid='etd_app.keyword_index.saved')
+        post_delete.connect(keyword_deleted, sender=Keyword, dispatch_uid='etd_app.keyword_index.deleted')
@@ -0,0 +1,27 @@
+from django.core.cache.backends.db import DatabaseCache
+from django.db import connections
+
+
+class LruDatabaseCache(DatabaseCache):
+    '''A db cache that culls the least recently used entries, instead of django's default (the
+    first ones in cache_key order, which has nothing to do with how they're used).
+
+    Every set() and touch() moves an entry's expires out to now + TIMEOUT, so as long as the
+    entries use the default TIMEOUT, the earliest expires are the ones used longest ago (to the
+    second - that's all django stores).'''
+
+    def _cull(self, db, cursor, now):
+        if self._cull_frequency == 0:
+            self.clear()
+            return
+        connection = connections[db]
+        table = connection.ops.quote_name(self._table)
+        cursor.execute('DELETE FROM %s WHERE expires < %%s' % table, [connection.ops.adapt_datetimefield_value(now)])
+        cursor.execute('SELECT COUNT(*) FROM %s' % table)
+        num = cursor.fetchone()[0]
+        if num > self._max_entries:
+            cull_num = num // self._cull_frequency
+            cursor.execute('SELECT expires FROM %s ORDER BY expires LIMIT 1 OFFSET %%s' % table, [cull_num])
+            oldest_kept = cursor.fetchone()
+            if oldest_kept:
+                cursor.execute('DELETE FROM %s WHERE expires < %%s' % table, [oldest_kept[0]])
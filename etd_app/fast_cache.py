@@ -0,0 +1,123 @@
+'''Cache of FAST suggestion results, shared by all the app processes (it's a db cache by
+default - see the 'fast' entry in settings.CACHES).
+
+Entries are evicted least-recently-used: a hit touches the entry (at most once every
+settings.FAST_CACHE_TOUCH_INTERVAL seconds per process, so most hits don't write), pushing its
+expiration out by the cache TIMEOUT, and the LruDatabaseCache backend culls the
+earliest-expiring entries once there are more than MAX_ENTRIES. Each entry also stores when it
+was fetched, so popular terms still get refreshed from FAST after settings.FAST_CACHE_TTL seconds.
+
+The hit/miss counts are added up in memory, and written to the db (FastCacheCounter) every
+settings.FAST_CACHE_STATS_FLUSH_COUNT lookups or FAST_CACHE_STATS_FLUSH_SECONDS seconds, so
+lookups don't all update the same row. The counts can lag by up to that much per process.'''
+import hashlib
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from .models import FastCacheCounter, normalize_text
+
+
+HITS = 'hits'
+MISSES = 'misses'
+#don't let the per-process touch times grow without limit
+MAX_TOUCH_TIMES = 10000
+
+_lock = threading.Lock()
+_touch_times = {}
+_pending_counts = {HITS: 0, MISSES: 0}
+_last_flush = time.monotonic()
+
+
+def _get_cache():
+    return caches[settings.FAST_CACHE_ALIAS]
+
+
+def normalize_term(term):
+    return ' '.join(normalize_text(term).lower().split())
+
+
+def get_cache_key(term, index):
+    #hash the term, so any text makes a valid key for every cache backend
+    term_hash = hashlib.sha1(normalize_term(term).encode('utf8')).hexdigest()
+    return 'fast:%s:%s' % (index, term_hash)
+
+
+def _should_touch(key):
+    now = time.monotonic()
+    with _lock:
+        touched = _touch_times.get(key)
+        if touched is not None and (now - touched) < settings.FAST_CACHE_TOUCH_INTERVAL:
+            return False
+        if len(_touch_times) >= MAX_TOUCH_TIMES:
+            _touch_times.clear()
+        _touch_times[key] = now
+        return True
+
+
+def _take_pending_counts():
+    global _last_flush
+    with _lock:
+        counts = dict(_pending_counts)
+        for name in _pending_counts:
+            _pending_counts[name] = 0
+        _last_flush = time.monotonic()
+    return counts
+
+
+def flush_stats():
+    '''Write this process's hit/miss counts to the db.'''
+    for name, count in _take_pending_counts().items():
+        if count:
+            FastCacheCounter.add(name, count)
+
+
+def _count(name):
+    with _lock:
+        _pending_counts[name] += 1
+        due = (sum(_pending_counts.values()) >= settings.FAST_CACHE_STATS_FLUSH_COUNT or
+               (time.monotonic() - _last_flush) >= settings.FAST_CACHE_STATS_FLUSH_SECONDS)
+    if due:
+        flush_stats()
+
+
+def get_results(term, index):
+    '''returns the cached results, or None'''
+    cache = _get_cache()
+    key = get_cache_key(term, index)
+    value = cache.get(key)
+    if value is not None:
+        fetched_at, results = value
+        if (time.time() - fetched_at) < settings.FAST_CACHE_TTL:
+            if _should_touch(key):
+                cache.touch(key)
+            _count(HITS)
+            return results
+    _count(MISSES)
+    return None
+
+
+def set_results(term, index, results):
+    key = get_cache_key(term, index)
+    _get_cache().set(key, (time.time(), results))
+    #setting it already pushed the expiration out
+    with _lock:
+        _touch_times[key] = time.monotonic()
+
+
+def get_stats():
+    flush_stats()
+    counts = FastCacheCounter.get_counts([HITS, MISSES])
+    hits = counts[HITS]
+    misses = counts[MISSES]
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': (hits / lookups) if lookups else 0.0,
+    }
+
+
+def reset_stats():
+    _take_pending_counts()
+    FastCacheCounter.reset([HITS, MISSES])
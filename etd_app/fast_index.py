@@ -0,0 +1,197 @@
+'''Local FAST subject index, so keyword suggestions can be answered without calling OCLC.
+
+The index is an SQLite file (settings.FAST_LOCAL_INDEX_PATH) built by the import_fast_subjects
+command from a FAST bulk download. Each heading's authorized and alternate labels go in an
+FTS5 table with prefix indexes, so "words typed so far" queries are index lookups. search()
+returns docs shaped like the FAST suggest API's, so they go through the same
+_fast_results_to_select2_list() as the API results.'''
+import csv
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+
+
+MARC_NS = '{http://www.loc.gov/MARC21/slim}'
+#FAST facet for each heading tag - the suggestNN indexes are per facet
+HEADING_TAGS = {'100': '00', '110': '10', '111': '11', '130': '30', '147': '47', '148': '48', '150': '50', '151': '51', '155': '55'}
+SUBDIVISION_CODES = 'vxyz'
+SCHEMA = [
+    'CREATE TABLE headings (id INTEGER PRIMARY KEY, idroot TEXT NOT NULL, auth TEXT NOT NULL, facet TEXT NOT NULL)',
+    '''CREATE VIRTUAL TABLE labels USING fts5(label, kind UNINDEXED, heading_id UNINDEXED,
+        tokenize='unicode61 remove_diacritics 2', prefix='1 2 3')''',
+]
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class FastIndexError(Exception):
+    pass
+
+
+class FastHeading:
+
+    def __init__(self, idroot, auth, facet='50', alt_labels=None):
+        self.idroot = idroot
+        self.auth = auth
+        self.facet = facet
+        self.alt_labels = alt_labels or []
+
+
+def _get_heading_text(datafield):
+    #FAST joins subdivisions ($v $x $y $z) with '--', and everything else with spaces
+    heading = ''
+    for subfield in datafield.iter(MARC_NS + 'subfield'):
+        text = (subfield.text or '').strip()
+        if not text or not subfield.get('code', '').isalpha():
+            continue
+        if not heading:
+            heading = text
+        elif subfield.get('code') in SUBDIVISION_CODES:
+            heading = '%s--%s' % (heading, text)
+        else:
+            heading = '%s %s' % (heading, text)
+    return heading
+
+
+def _parse_marcxml_record(record):
+    leader = record.findtext(MARC_NS + 'leader') or ''
+    if len(leader) > 5 and leader[5] == 'd': #deleted
+        return None
+    idroot = None
+    heading = None
+    for controlfield in record.iter(MARC_NS + 'controlfield'):
+        if controlfield.get('tag') == '001':
+            idroot = (controlfield.text or '').strip()
+    for datafield in record.iter(MARC_NS + 'datafield'):
+        tag = datafield.get('tag', '')
+        if tag in HEADING_TAGS and heading is None:
+            heading = FastHeading(idroot, _get_heading_text(datafield), facet=HEADING_TAGS[tag])
+        elif tag.startswith('4') and ('1' + tag[1:]) in HEADING_TAGS and heading is not None:
+            alt_label = _get_heading_text(datafield)
+            if alt_label:
+                heading.alt_labels.append(alt_label)
+    if heading is None or not idroot or not heading.auth:
+        return None
+    return heading
+
+
+def read_marcxml(path):
+    '''Stream FastHeadings from a MARCXML file, without loading the whole (huge) file.'''
+    for event, element in ET.iterparse(path, events=('end',)):
+        if element.tag == MARC_NS + 'record':
+            heading = _parse_marcxml_record(element)
+            if heading:
+                yield heading
+            element.clear()
+
+
+def read_csv(path):
+    '''CSV with a header row: idroot, auth, facet (optional, default 50 - topical),
+    alt_labels (optional, separated by |)'''
+    with open(path, newline='', encoding='utf8') as f:
+        for row in csv.DictReader(f):
+            alt_labels = [label.strip() for label in (row.get('alt_labels') or '').split('|') if label.strip()]
+            yield FastHeading(row['idroot'].strip(), row['auth'].strip(), facet=(row.get('facet') or '50').strip(),
+                    alt_labels=alt_labels)
+
+
+def build_index(headings, path, batch_size=5000):
+    '''Write the headings to a new index file, then move it into place - lookups keep using
+    the old file until it's replaced. Returns the number of headings.'''
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.sqlite3')
+    os.close(fd)
+    count = 0
+    try:
+        connection = sqlite3.connect(tmp_path)
+        try:
+            connection.execute('PRAGMA journal_mode=OFF')
+            connection.execute('PRAGMA synchronous=OFF')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            heading_rows = []
+            label_rows = []
+            for heading in headings:
+                count += 1
+                heading_rows.append((count, heading.idroot, heading.auth, heading.facet))
+                label_rows.append((heading.auth, 'auth', count))
+                label_rows.extend((alt_label, 'alt', count) for alt_label in heading.alt_labels)
+                if len(heading_rows) >= batch_size:
+                    connection.executemany('INSERT INTO headings VALUES (?, ?, ?, ?)', heading_rows)
+                    connection.executemany('INSERT INTO labels VALUES (?, ?, ?)', label_rows)
+                    heading_rows = []
+                    label_rows = []
+            connection.executemany('INSERT INTO headings VALUES (?, ?, ?, ?)', heading_rows)
+            connection.executemany('INSERT INTO labels VALUES (?, ?, ?)', label_rows)
+            connection.execute("INSERT INTO labels(labels) VALUES('optimize')")
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return count
+
+
+_local = threading.local()
+
+
+def _get_connection(path):
+    #one read-only connection per thread, reopened if the index file has been replaced
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        raise FastIndexError('no FAST index at %s: %s' % (path, e))
+    file_id = (path, stat.st_ino, stat.st_mtime_ns)
+    if getattr(_local, 'file_id', None) != file_id:
+        if getattr(_local, 'connection', None) is not None:
+            _local.connection.close()
+        _local.connection = sqlite3.connect('file:%s?mode=ro' % path, uri=True)
+        _local.file_id = file_id
+    return _local.connection
+
+
+def _get_match_query(term):
+    #every word has to match, the last one as a prefix (it's probably still being typed)
+    words = WORD_RE.findall(term)
+    if not words:
+        return None
+    quoted = ['"%s"' % word for word in words]
+    quoted[-1] = quoted[-1] + '*'
+    return ' '.join(quoted)
+
+
+def _search_labels(connection, match_query, kind, facet, limit):
+    sql = '''SELECT headings.idroot, headings.auth, labels.kind, labels.label
+        FROM labels JOIN headings ON headings.id = labels.heading_id
+        WHERE labels MATCH ? AND labels.kind = ?'''
+    params = [match_query, kind]
+    if facet:
+        sql += ' AND headings.facet = ?'
+        params.append(facet)
+    #ordered by rank alone, fts5 hands back the best matches in order - sqlite doesn't sort every match
+    sql += ' ORDER BY rank LIMIT ?'
+    params.append(limit)
+    return connection.execute(sql, params).fetchall()
+
+
+def search(path, term, index='suggestall', limit=20):
+    '''Returns FAST suggest-style docs: {'idroot', 'auth', 'type' ('auth' or 'alt'), index: [matched label]}'''
+    match_query = _get_match_query(term)
+    if not match_query:
+        return []
+    facet = index[len('suggest'):] if index != 'suggestall' else None
+    try:
+        connection = _get_connection(path)
+        #authorized headings first, then alternate labels if there's room
+        rows = _search_labels(connection, match_query, 'auth', facet, limit)
+        if len(rows) < limit:
+            rows += _search_labels(connection, match_query, 'alt', facet, limit - len(rows))
+    except sqlite3.Error as e:
+        raise FastIndexError('FAST index error: %s' % e)
+    return [{'idroot': idroot, 'auth': auth, 'type': kind, index: [label]} for idroot, auth, kind, label in rows]
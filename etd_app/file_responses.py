@@ -0,0 +1,125 @@
+'''Responses for sending stored files, with conditional GET (ETag/Last-Modified -> 304) and
+single byte-range (206) support, so browser PDF viewers and repeat downloads don't have to
+fetch the whole file every time.
+
+With settings.THESIS_FILE_DELIVERY set to 'x-sendfile' (Apache mod_xsendfile) or
+'x-accel-redirect' (nginx), the response just tells the web server which file to send, so a
+python worker isn't tied up for the whole download - the web server handles ranges then.'''
+import os
+import re
+import urllib.parse
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range_header(range_header, size):
+    '''Returns (first byte, last byte) for a single "bytes=..." range, or None if the whole
+    file should be sent (no header, or one we don't handle, like multiple ranges).
+    Raises RangeNotSatisfiable if the range is outside the file.'''
+    match = RANGE_RE.match((range_header or '').strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        #suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise RangeNotSatisfiable()
+        return max(size - length, 0), size - 1
+    first = int(first)
+    if first >= size:
+        raise RangeNotSatisfiable()
+    last = int(last) if last else size - 1
+    if first > last:
+        return None
+    return first, min(last, size - 1)
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        #only strong etags count for If-Range
+        return bool(etag) and if_range == etag
+    if_range_date = parse_http_date_safe(if_range)
+    return if_range_date is not None and if_range_date == last_modified
+
+
+def _read_range(path, first, length):
+    with open(path, 'rb') as f:
+        f.seek(first)
+        while length > 0:
+            data = f.read(min(length, STREAM_CHUNK_SIZE))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def _set_file_headers(response, etag, last_modified, filename):
+    response['Accept-Ranges'] = 'bytes'
+    if etag:
+        response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if filename:
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    #private (it needs a login), but the browser can keep a copy and revalidate it with the etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _get_web_server_response(path, content_type, delivery):
+    response = HttpResponse(content_type=content_type)
+    #headers have to be ascii - mod_xsendfile (XSendFileUnescape, on by default) and nginx both unquote the path
+    if delivery == 'x-sendfile':
+        response['X-Sendfile'] = urllib.parse.quote(path)
+    elif delivery == 'x-accel-redirect':
+        #nginx needs an internal location that serves MEDIA_ROOT
+        relative_path = os.path.relpath(path, settings.MEDIA_ROOT)
+        response['X-Accel-Redirect'] = settings.THESIS_FILE_ACCEL_REDIRECT_PREFIX + urllib.parse.quote(relative_path)
+    else:
+        raise ValueError('unknown file delivery mode: %s' % delivery)
+    return response
+
+
+def get_file_response(request, path, content_type, etag=None, filename=None, delivery=None):
+    '''etag should be a strong etag - a quoted hash of the file contents.
+    delivery defaults to settings.THESIS_FILE_DELIVERY.'''
+    delivery = delivery or settings.THESIS_FILE_DELIVERY
+    stat = os.stat(path)
+    size = stat.st_size
+    last_modified = int(stat.st_mtime)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return _set_file_headers(not_modified, etag, last_modified, filename)
+    if delivery != 'django':
+        return _set_file_headers(_get_web_server_response(path, content_type, delivery), etag, last_modified, filename)
+    byte_range = None
+    if request.method in ('GET', 'HEAD') and _if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range_header(request.META.get('HTTP_RANGE'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%s' % size
+            return _set_file_headers(response, etag, last_modified, filename)
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        first, last = byte_range
+        response = StreamingHttpResponse(_read_range(path, first, last - first + 1), status=206, content_type=content_type)
+        response['Content-Range'] = 'bytes %s-%s/%s' % (first, last, size)
+        response['Content-Length'] = str(last - first + 1)
+    return _set_file_headers(response, etag, last_modified, filename)
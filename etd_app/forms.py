@@ -141,16 +141,24 @@ class UploadForm(forms.Form):
     thesis_file = forms.FileField(validators=[pdf_validator])
 
     def save_upload(self, candidate):
+        thesis_file = self.cleaned_data['thesis_file']
+        #set by the checksum upload handlers or ChunkedUpload.assemble(), if they were used
+        checksums = getattr(thesis_file, 'checksums', None)
         if candidate.thesis:
-            candidate.thesis.update_thesis_file(self.cleaned_data['thesis_file'])
+            candidate.thesis.update_thesis_file(thesis_file, checksums=checksums)
         else:
-            thesis = Thesis.objects.create(document=self.cleaned_data['thesis_file'])
+            thesis = Thesis(document=thesis_file)
+            thesis._set_checksums(thesis_file, checksums=checksums)
+            thesis.save()
             candidate.thesis = thesis
             candidate.save()
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, chunked_upload_url=None, **kwargs):
         super().__init__(*args, **kwargs)
         self.helper = FormHelper()
+        if chunked_upload_url:
+            #chunked_upload.js sends the file in resumable chunks to this url
+            self.helper.attrs = {'data-chunked-upload-url': chunked_upload_url}
         self.helper.add_input(Submit('submit', 'Upload File'))
 
 
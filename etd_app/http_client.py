@@ -0,0 +1,67 @@
+'''Shared HTTP sessions for calls to outside services (FAST, the BDR API), so repeated calls
+reuse pooled keep-alive connections instead of making a new TCP/TLS connection every time.
+
+Calls name an endpoint, which picks its timeout, pool size, and retry settings from
+settings.HTTP_CLIENT_ENDPOINTS (falling back to settings.HTTP_CLIENT_DEFAULTS). Each
+endpoint gets its own session per host.'''
+import threading
+import urllib.parse
+from django.conf import settings
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_endpoint_settings(endpoint):
+    endpoint_settings = dict(settings.HTTP_CLIENT_DEFAULTS)
+    endpoint_settings.update(settings.HTTP_CLIENT_ENDPOINTS.get(endpoint, {}))
+    return endpoint_settings
+
+
+def _build_session(endpoint_settings):
+    retry = Retry(
+            total=endpoint_settings['retries'],
+            backoff_factor=endpoint_settings['backoff_factor'],
+            status_forcelist=endpoint_settings['retry_statuses'],
+            #connection errors are retried for any method; read errors & bad statuses only for these
+            allowed_methods=endpoint_settings['retry_methods'],
+            raise_on_status=False,
+        )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=endpoint_settings['pool_maxsize'], max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session(endpoint, url):
+    parts = urllib.parse.urlsplit(url)
+    key = (endpoint, parts.scheme, parts.netloc)
+    with _sessions_lock:
+        if key not in _sessions:
+            _sessions[key] = _build_session(get_endpoint_settings(endpoint))
+        return _sessions[key]
+
+
+def request(endpoint, method, url, **kwargs):
+    kwargs.setdefault('timeout', get_endpoint_settings(endpoint)['timeout'])
+    return get_session(endpoint, url).request(method, url, **kwargs)
+
+
+def get(endpoint, url, **kwargs):
+    return request(endpoint, 'GET', url, **kwargs)
+
+
+def post(endpoint, url, **kwargs):
+    return request(endpoint, 'POST', url, **kwargs)
+
+
+def close_sessions():
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -1,22 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import json
+import logging
 import os
-import requests
+import random
+import socket
+import time
+import urllib.parse
 from django.conf import settings
-from .models import Thesis, Degree
-from .mods_mapper import ModsMapper
+from django.db import connections
+import requests
+from urllib3.exceptions import NewConnectionError
+from . import http_client
+from .models import Degree, IngestJob, Thesis
+from .multipart import MultipartBody, MultipartFile
+from .mods_writer import get_mods_record, serialize_mods
+
+
+logger = logging.getLogger('etd')
+#the API didn't process the post, so it's safe to send again
+RETRYABLE_STATUSES = [429]
+#the post may or may not have gone through
+AMBIGUOUS_STATUSES = [500, 502, 503, 504]
 
 
 class IngestException(Exception):
     pass
 
 
+class RetryableIngestException(IngestException):
+    '''A failure that may go away if the post is tried again (couldn't connect, 429 - or a timeout/5xx,
+    when settings.INGEST_LOOKUP_URL can check whether the post went through)'''
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class IngestJobLostException(Exception):
+    '''The worker's lease on the ingest job ran out, and another worker has it now - it's not
+    an IngestException, because the thesis is still being ingested.'''
+    pass
+
+
+def _failed_to_connect(e):
+    #the request never got to the API (as opposed to eg. a read timeout, after the body was sent)
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], 'reason', None) if e.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _parse_retry_after(value):
+    #only the delay-seconds form - an HTTP date falls back to the normal backoff
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
 class ThesisIngester:
 
-    def __init__(self, thesis):
+    def __init__(self, thesis, job=None):
         if not thesis.ready_to_ingest():
             raise Exception(f'thesis {thesis.id} not ready for ingestion')
         self.thesis = thesis
+        #the IngestJob this ingest is running for, if any
+        self.job = job
 
     @property
     def embargo_end_year(self):
@@ -38,7 +88,8 @@ class ThesisIngester:
         return json.dumps({'parameters': ir_params})
 
     def get_mods_param(self):
-        MODS_XML = ModsMapper(self.thesis).get_mods().serialize().decode('utf8')
+        #same xml as ModsMapper(self.thesis).get_mods().serialize(), without building the bdrxml objects
+        MODS_XML = serialize_mods(get_mods_record(self.thesis)).decode('utf8')
         return json.dumps({'xml_data': MODS_XML})
 
     def get_rels_param(self):
@@ -72,21 +123,91 @@ class ThesisIngester:
         except Exception as e:
             raise IngestException(f'{self.thesis.id} params error: {e}')
 
+    def get_idempotency_key(self):
+        #the same thesis file always gets the same key, so the API (or find_existing_pid) can spot a repeated post
+        return f'etd-{self.thesis.id}-{self.thesis.checksum}'
+
     def post_to_api(self, params):
-        with open(os.path.join(settings.MEDIA_ROOT, self.thesis.current_file_name), 'rb') as f:
-            try:
-                r = requests.post(settings.API_URL, data=params, files={self.thesis.current_file_name: f})
-            except Exception as e:
-                raise IngestException(f'{self.thesis.id} error posting to api: {e}')
+        #stream the file instead of building the whole multipart body in memory
+        #the stored file is named by its hash - the BDR gets the uploaded file name, like the content_streams param
+        file_name = self.thesis.current_file_name
+        body = MultipartBody(fields=params, files={file_name: MultipartFile(self.thesis.document.path, filename=file_name)})
+        headers = {'Content-Type': body.content_type, 'Idempotency-Key': self.get_idempotency_key()}
+        try:
+            r = http_client.post('bdr_api', settings.API_URL, data=body, headers=headers)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if _failed_to_connect(e):
+                raise RetryableIngestException(f'{self.thesis.id} error posting to api: {e}')
+            raise self._get_ambiguous_error(f'{self.thesis.id} error posting to api: {e}')
+        except Exception as e:
+            raise IngestException(f'{self.thesis.id} error posting to api: {e}')
         if r.ok:
             return r.json()['pid']
+        retry_after = _parse_retry_after(r.headers.get('Retry-After'))
+        if r.status_code in RETRYABLE_STATUSES:
+            raise RetryableIngestException(f'{self.thesis.id} api error response: {r.status_code} {r.text}', retry_after=retry_after)
+        elif r.status_code in AMBIGUOUS_STATUSES:
+            raise self._get_ambiguous_error(f'{self.thesis.id} api error response: {r.status_code} {r.text}', retry_after=retry_after)
         else:
             raise IngestException(f'{self.thesis.id} api error response: {r.status_code} {r.text}')
 
+    def _get_ambiguous_error(self, message, retry_after=None):
+        #the post may have created the item - only send it again if find_existing_pid() can check first,
+        #  otherwise fail it (ingest error), so it doesn't end up in the BDR twice
+        if settings.INGEST_LOOKUP_URL:
+            return RetryableIngestException(message, retry_after=retry_after)
+        return IngestException(message)
+
+    def find_existing_pid(self):
+        '''If settings.INGEST_LOOKUP_URL is set, check whether this thesis file was already ingested
+        (eg. a post that timed out on our end, but went through). Returns the pid or None.'''
+        if not settings.INGEST_LOOKUP_URL:
+            return None
+        url = settings.INGEST_LOOKUP_URL.format(key=urllib.parse.quote(self.get_idempotency_key()))
+        try:
+            r = http_client.get('bdr_api', url)
+            if r.ok:
+                return r.json().get('pid')
+        except Exception:
+            #can't tell - the retry still sends the same Idempotency-Key
+            logger.exception(f'{self.thesis.id} error looking up existing ingest')
+        return None
+
+    def _get_retry_delay(self, attempt, retry_after=None):
+        #exponential backoff with full jitter, so retries from parallel workers don't all land together
+        delay = random.uniform(0, min(settings.INGEST_RETRY_MAX_BACKOFF, settings.INGEST_RETRY_BACKOFF * (2 ** attempt)))
+        if retry_after:
+            delay = max(delay, min(retry_after, settings.INGEST_RETRY_MAX_BACKOFF))
+        return delay
+
+    def post_with_retries(self, params):
+        attempt = 0
+        while True:
+            try:
+                return self.post_to_api(params)
+            except RetryableIngestException as e:
+                if attempt >= settings.INGEST_RETRIES:
+                    raise
+                logger.warning(f'{e} - retrying')
+                time.sleep(self._get_retry_delay(attempt, e.retry_after))
+                attempt += 1
+                #the timeouts and backoff can add up to more than the lease - hold on to the job before posting again
+                if self.job and not self.job.renew_lease():
+                    raise IngestJobLostException(f'{self.thesis.id} ingest job {self.job.id} was claimed by another worker')
+                #the failed post may have gone through anyway
+                pid = self.find_existing_pid()
+                if pid:
+                    return pid
+
     def ingest(self):
         try:
             params = self.get_ingest_params()
-            pid = self.post_to_api(params)
+            pid = None
+            if self.job and self.job.attempts > 1:
+                #an earlier worker's lease ran out - its post may have gone through before it died
+                pid = self.find_existing_pid()
+            if not pid:
+                pid = self.post_with_retries(params)
             self.thesis.mark_ingested(pid)
             return pid
         except IngestException as ie:
@@ -103,15 +224,86 @@ def find_theses_to_ingest(dt=None):
         date_ready = dt
     else:
         raise Exception(f'invalid date: {dt}')
-    accepted_theses = Thesis.objects.filter(status=Thesis.STATUS_CHOICES.accepted).order_by('title')
-    #need ready_to_ingest check, because a thesis being "accepted" doesn't mean it's ready to ingest
-    return [th for th in accepted_theses if th.ready_to_ingest(date_ready)]
+    #a thesis being "accepted" doesn't mean it's ready to ingest - the paperwork has to be done too
+    return Thesis.get_ingest_queryset().filter(Thesis.get_ready_to_ingest_filter(date_ready)).order_by('title')
+
+
+def enqueue_theses(theses):
+    '''Queue ingest jobs for the theses - returns (jobs, theses that aren't ready to ingest).'''
+    ready = []
+    not_ready = []
+    for thesis in theses:
+        if thesis.ready_to_ingest():
+            ready.append(thesis)
+        else:
+            not_ready.append(thesis)
+    return IngestJob.enqueue_many(ready), not_ready
 
 
 def ingest_batch_of_theses(dt=None):
-    theses_batch = find_theses_to_ingest(dt)
-    print('Found %s theses/dissertations to ingest.' % len(theses_batch))
-    for thesis in theses_batch:
-        print('  %s - %s' % (thesis.candidate, thesis))
-        ti = ThesisIngester(thesis)
-        ti.ingest()
+    '''Queue everything that's ready to ingest - "manage.py ingest_worker" does the ingesting.'''
+    jobs, _ = enqueue_theses(find_theses_to_ingest(dt))
+    print('Queued %s theses/dissertations for ingestion.' % len(jobs))
+    return jobs
+
+
+def run_ingest_job(job):
+    '''Ingest the job's thesis, and record the result on the job. Returns True if it worked.'''
+    try:
+        thesis = Thesis.get_ingest_queryset().get(id=job.thesis_id)
+        pid = ThesisIngester(thesis, job=job).ingest()
+    except IngestJobLostException as e:
+        #the worker that has the job now records the result
+        logger.warning(str(e))
+        return False
+    except Exception as e:
+        logger.error(f'ingest job {job.id} (thesis {job.thesis_id}) failed: {e}')
+        job.mark_failed(str(e))
+        return False
+    job.mark_succeeded(pid)
+    return True
+
+
+def process_ingest_jobs(worker):
+    '''Claim and run jobs until there aren't any left. Returns (succeeded, failed) lists of jobs.'''
+    succeeded = []
+    failed = []
+    while True:
+        job = IngestJob.claim_next(worker)
+        if not job:
+            return succeeded, failed
+        print('  %s - thesis %s' % (worker, job.thesis_id))
+        if run_ingest_job(job):
+            succeeded.append(job)
+        else:
+            failed.append(job)
+
+
+def _process_ingest_jobs_in_thread(worker):
+    try:
+        return process_ingest_jobs(worker)
+    finally:
+        #each thread gets its own db connection - close it, instead of leaving it for the db to time out
+        connections.close_all()
+
+
+def run_ingest_workers(workers=1, name=None):
+    '''Drain the ingest queue, running up to workers jobs at a time. A failure only stops that job.
+    Returns (succeeded, failed) lists of jobs.'''
+    name = name or f'{socket.gethostname()}-{os.getpid()}'
+    if workers <= 1:
+        succeeded, failed = process_ingest_jobs(name)
+    else:
+        succeeded = []
+        failed = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_process_ingest_jobs_in_thread, f'{name}-{i}') for i in range(workers)]
+            for future in futures:
+                worker_succeeded, worker_failed = future.result()
+                succeeded.extend(worker_succeeded)
+                failed.extend(worker_failed)
+    if succeeded or failed:
+        print('Ingested %s, failed %s.' % (len(succeeded), len(failed)))
+    for job in failed:
+        print('  FAILED thesis %s: %s' % (job.thesis_id, job.last_error))
+    return succeeded, failed
@@ -0,0 +1,166 @@
+'''Optional in-process index of Keyword.search_text, so the autocomplete "Previously Used"
+results can be found without a database query. Turned on with settings.KEYWORD_MEMORY_INDEX.
+
+Each worker process builds its own copy the first time it's searched. Keyword saves/deletes
+in this process update it through signals; changes made by other processes (or by queryset
+.update()/bulk operations, which don't send signals) show up once the index is older than
+settings.KEYWORD_MEMORY_INDEX_MAX_AGE seconds and gets rebuilt.'''
+from array import array
+import bisect
+import threading
+import time
+from django.conf import settings
+from .models import Keyword, normalize_text
+
+
+#separates the search texts in the joined string used for substring matching
+SEPARATOR = '\x00'
+#sorts after any character that could follow a prefix
+MAX_CHAR = '\U0010ffff'
+
+
+def _get_word_starts(search_text):
+    '''the parts of the search text starting at each word: 'a b c' -> ['a b c', 'b c', 'c']'''
+    word_starts = []
+    start = 0
+    for word in search_text.split(' '):
+        if word:
+            word_starts.append(search_text[start:])
+        start += len(word) + 1
+    return word_starts
+
+
+class KeywordIndex:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        self.built_at = None
+        #id -> (text, search_text)
+        self._keywords = {}
+        #sorted word starts, with the matching keyword ids, for bisecting prefix matches
+        self._word_starts = []
+        self._word_start_ids = array('q')
+        #all the search texts joined, for substring matches
+        self._joined = None
+        self._joined_offsets = array('q')
+        self._joined_ids = array('q')
+
+    def build(self):
+        with self._lock:
+            self._clear()
+            entries = []
+            for keyword_id, text, search_text in Keyword.objects.values_list('id', 'text', 'search_text').iterator():
+                self._keywords[keyword_id] = (text, search_text)
+                entries.extend((word_start, keyword_id) for word_start in _get_word_starts(search_text))
+            entries.sort()
+            self._word_starts = [word_start for word_start, _ in entries]
+            self._word_start_ids = array('q', [keyword_id for _, keyword_id in entries])
+            self.built_at = time.monotonic()
+
+    def _is_stale(self):
+        if self.built_at is None:
+            return True
+        return (time.monotonic() - self.built_at) > settings.KEYWORD_MEMORY_INDEX_MAX_AGE
+
+    def _build_joined(self):
+        offsets = array('q')
+        ids = array('q')
+        search_texts = []
+        offset = 0
+        for keyword_id, (text, search_text) in self._keywords.items():
+            offsets.append(offset)
+            ids.append(keyword_id)
+            search_texts.append(search_text)
+            offset += len(search_text) + 1
+        self._joined = SEPARATOR.join(search_texts)
+        self._joined_offsets = offsets
+        self._joined_ids = ids
+
+    def remove(self, keyword_id):
+        with self._lock:
+            if self.built_at is None or keyword_id not in self._keywords:
+                return
+            text, search_text = self._keywords.pop(keyword_id)
+            for word_start in _get_word_starts(search_text):
+                i = bisect.bisect_left(self._word_starts, word_start)
+                while self._word_start_ids[i] != keyword_id:
+                    i += 1
+                del self._word_starts[i]
+                del self._word_start_ids[i]
+            self._joined = None
+
+    def add(self, keyword_id, text, search_text):
+        with self._lock:
+            if self.built_at is None:
+                return
+            self.remove(keyword_id)
+            self._keywords[keyword_id] = (text, search_text)
+            for word_start in _get_word_starts(search_text):
+                i = bisect.bisect_right(self._word_starts, word_start)
+                self._word_starts.insert(i, word_start)
+                self._word_start_ids.insert(i, keyword_id)
+            self._joined = None
+
+    def _get_prefix_matches(self, search_term):
+        start = bisect.bisect_left(self._word_starts, search_term)
+        end = bisect.bisect_right(self._word_starts, search_term + MAX_CHAR, lo=start)
+        return set(self._word_start_ids[start:end])
+
+    def _get_substring_matches(self, search_term):
+        if self._joined is None:
+            self._build_joined()
+        matches = set()
+        position = self._joined.find(search_term)
+        while position != -1:
+            i = bisect.bisect_right(self._joined_offsets, position) - 1
+            matches.add(self._joined_ids[i])
+            #skip to the next search text - this one's already matched
+            if i + 1 >= len(self._joined_offsets):
+                break
+            position = self._joined.find(search_term, self._joined_offsets[i + 1])
+        return matches
+
+    def search(self, term, limit=None):
+        '''Same matches and order as Keyword.search(term, order='text', prefix_first=True),
+        except that text is sorted by python instead of the db collation. Returns unsaved-looking
+        Keyword instances with just id, text, and search_text loaded.'''
+        search_term = Keyword.get_search_text(normalize_text(term))
+        with self._lock:
+            if self._is_stale():
+                self.build()
+            if len(search_term) >= 3:
+                keyword_ids = self._get_substring_matches(search_term)
+            elif search_term:
+                keyword_ids = self._get_prefix_matches(search_term)
+            else:
+                keyword_ids = set(self._keywords)
+            matches = [(keyword_id, *self._keywords[keyword_id]) for keyword_id in keyword_ids]
+
+        def _sort_key(match):
+            keyword_id, text, search_text = match
+            if search_text == search_term:
+                rank = 0
+            elif search_text.startswith(search_term):
+                rank = 1
+            else:
+                rank = 2
+            return (rank, text, keyword_id)
+
+        matches.sort(key=_sort_key)
+        if limit:
+            matches = matches[:limit]
+        return [Keyword(id=keyword_id, text=text, search_text=search_text) for keyword_id, text, search_text in matches]
+
+
+keyword_index = KeywordIndex()
+
+
+def keyword_saved(sender, instance, **kwargs):
+    keyword_index.add(instance.id, instance.text, instance.search_text)
+
+
+def keyword_deleted(sender, instance, **kwargs):
+    keyword_index.remove(instance.id)
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from etd_app.models import Thesis
+
+
+class Command(BaseCommand):
+    help = 'Fill in (or re-calculate) Thesis.eligible_for_ingest_on from the gradschool checklists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        theses = Thesis.objects.select_related('candidate__degree', 'candidate__gradschool_checklist').order_by('id')
+        to_update = []
+        checked = updated = 0
+        for thesis in theses.iterator(chunk_size=batch_size):
+            checked += 1
+            eligible_for_ingest_on = Thesis._get_eligible_for_ingest_on(thesis.candidate)
+            if thesis.eligible_for_ingest_on != eligible_for_ingest_on:
+                thesis.eligible_for_ingest_on = eligible_for_ingest_on
+                to_update.append(thesis)
+            if len(to_update) >= batch_size:
+                #bulk_update doesn't call save(), so the modified dates are left alone
+                Thesis.objects.bulk_update(to_update, ['eligible_for_ingest_on'])
+                updated += len(to_update)
+                to_update = []
+        if to_update:
+            Thesis.objects.bulk_update(to_update, ['eligible_for_ingest_on'])
+            updated += len(to_update)
+        self.stdout.write(f'Checked {checked} theses, updated {updated}.')
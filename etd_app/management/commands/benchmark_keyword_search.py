@@ -0,0 +1,37 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from etd_app.keyword_index import KeywordIndex
+from etd_app.models import Keyword
+
+
+DEFAULT_TERMS = ['a', 'hi', 'his', 'history', 'ology', 'american', 'climate change', 'zzz']
+
+
+class Command(BaseCommand):
+    help = 'Time the keyword autocomplete lookup: Keyword.search (db) vs the in-memory KeywordIndex'
+
+    def add_arguments(self, parser):
+        parser.add_argument('terms', nargs='*', default=DEFAULT_TERMS)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def _time(self, func, repeat):
+        start = time.perf_counter()
+        for i in range(repeat):
+            results = func()
+        return (time.perf_counter() - start) / repeat * 1000, len(results)
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        limit = settings.KEYWORD_SEARCH_LIMIT
+        index = KeywordIndex()
+        start = time.perf_counter()
+        index.build()
+        self.stdout.write('%s keywords; index built in %.1fms' % (Keyword.objects.count(), (time.perf_counter() - start) * 1000))
+        self.stdout.write('%-20s %12s %12s %8s' % ('term', 'db ms', 'memory ms', 'results'))
+        for term in options['terms']:
+            db_ms, db_count = self._time(
+                    lambda: Keyword.search(term=term, order='text', limit=limit, prefix_first=True), repeat)
+            memory_ms, memory_count = self._time(lambda: index.search(term, limit=limit), repeat)
+            count = db_count if db_count == memory_count else '%s/%s' % (db_count, memory_count)
+            self.stdout.write('%-20s %12.3f %12.3f %8s' % (term, db_ms, memory_ms, count))
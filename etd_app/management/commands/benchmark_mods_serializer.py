@@ -0,0 +1,36 @@
+import time
+from django.core.management.base import BaseCommand
+from etd_app.models import Thesis
+from etd_app.mods_mapper import ModsMapper
+from etd_app.mods_writer import get_mods_record, serialize_mods
+
+
+class Command(BaseCommand):
+    help = 'Time building the MODS for theses: ModsMapper (bdrxml objects) vs the streaming mods_writer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=200, help='number of theses to use')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def _time(self, func, repeat):
+        start = time.perf_counter()
+        for i in range(repeat):
+            func()
+        return (time.perf_counter() - start) / repeat * 1000
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        #load the data once, so this times the serializing, not the db
+        theses = list(Thesis.get_ingest_queryset().order_by('id')[:options['limit']])
+        records = [get_mods_record(thesis) for thesis in theses]
+        if not theses:
+            self.stdout.write('no theses')
+            return
+        mismatches = sum(1 for thesis, record in zip(theses, records)
+                         if ModsMapper(thesis).get_mods().serialize() != serialize_mods(record))
+        bdrxml_ms = self._time(lambda: [ModsMapper(thesis).get_mods().serialize() for thesis in theses], repeat)
+        writer_ms = self._time(lambda: [serialize_mods(get_mods_record(thesis)) for thesis in theses], repeat)
+        self.stdout.write('%s theses; %s outputs differ' % (len(theses), mismatches))
+        self.stdout.write('%-12s %12s %12s' % ('', 'total ms', 'per record'))
+        self.stdout.write('%-12s %12.3f %12.3f' % ('bdrxml', bdrxml_ms, bdrxml_ms / len(theses)))
+        self.stdout.write('%-12s %12.3f %12.3f' % ('mods_writer', writer_ms, writer_ms / len(theses)))
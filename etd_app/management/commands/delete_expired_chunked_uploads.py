@@ -0,0 +1,20 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from etd_app.models import ChunkedUpload
+
+
+class Command(BaseCommand):
+    help = 'Delete resumable uploads (and their chunks) that were never committed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CHUNKED_UPLOAD_MAX_AGE_DAYS)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        deleted = 0
+        for upload in ChunkedUpload.objects.filter(created__lt=cutoff):
+            upload.delete()
+            deleted += 1
+        self.stdout.write(f'Deleted {deleted} expired uploads.')
@@ -0,0 +1,113 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+import json
+import zipfile
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from etd_app.models import Thesis
+from etd_app.mods_writer import get_mods_record, serialize_mods
+
+
+def _get_entry_name(thesis_id, pid):
+    if pid:
+        return '%s.xml' % pid.replace(':', '_')
+    return 'thesis-%s.xml' % thesis_id
+
+
+class ZipOutput:
+
+    def __init__(self, path):
+        self.zip_file = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED)
+
+    def write(self, thesis_id, pid, mods_xml):
+        self.zip_file.writestr(_get_entry_name(thesis_id, pid), mods_xml)
+
+    def close(self):
+        self.zip_file.close()
+
+
+class JsonLinesOutput:
+
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf8')
+
+    def write(self, thesis_id, pid, mods_xml):
+        self.file.write(json.dumps({'thesis_id': thesis_id, 'pid': pid, 'mods': mods_xml.decode('utf8')}) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+class Command(BaseCommand):
+    help = 'Export the MODS for theses (by default, all the ingested ones) to a zip file, or a JSON lines file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['zip', 'jsonl'], help='defaults to the file extension')
+        parser.add_argument('--year', type=int, help='candidate year')
+        parser.add_argument('--department', help='department id or name')
+        parser.add_argument('--status', default=Thesis.STATUS_CHOICES.ingested,
+                            choices=[status for status, label in Thesis.STATUS_CHOICES] + ['all'])
+        parser.add_argument('--chunk-size', type=int, default=500, help='theses loaded from the db at a time')
+        parser.add_argument('--processes', type=int, default=1, help='processes for building the xml')
+
+    def _get_thesis_ids(self, options):
+        queryset = Thesis.objects.all()
+        if options['status'] != 'all':
+            queryset = queryset.filter(status=options['status'])
+        if options['year']:
+            queryset = queryset.filter(candidate__year=options['year'])
+        department = options['department']
+        if department:
+            department_filter = Q(candidate__department__name=department)
+            if department.isdigit():
+                department_filter |= Q(candidate__department__id=int(department))
+            queryset = queryset.filter(department_filter)
+        return queryset.order_by('id').values_list('id', flat=True).iterator(chunk_size=options['chunk_size'])
+
+    def _get_record_chunks(self, options):
+        #iterator() can't prefetch (in this django version), so load the theses a chunk of ids at a
+        #  time - each chunk is a fixed number of queries, and only one chunk is in memory at once
+        today = date.today()
+        thesis_ids = []
+        for thesis_id in self._get_thesis_ids(options):
+            thesis_ids.append(thesis_id)
+            if len(thesis_ids) >= options['chunk_size']:
+                yield self._get_records(thesis_ids, today)
+                thesis_ids = []
+        if thesis_ids:
+            yield self._get_records(thesis_ids, today)
+
+    def _get_records(self, thesis_ids, today):
+        theses = Thesis.get_ingest_queryset().filter(id__in=thesis_ids).order_by('id')
+        return [(thesis.id, thesis.pid, get_mods_record(thesis, today=today)) for thesis in theses]
+
+    def _export(self, output, options):
+        count = 0
+        executor = ProcessPoolExecutor(max_workers=options['processes']) if options['processes'] > 1 else None
+        try:
+            for chunk in self._get_record_chunks(options):
+                records = [record for thesis_id, pid, record in chunk]
+                if executor:
+                    mods_xmls = executor.map(serialize_mods, records, chunksize=max(len(records) // options['processes'], 1))
+                else:
+                    mods_xmls = map(serialize_mods, records)
+                for (thesis_id, pid, record), mods_xml in zip(chunk, mods_xmls):
+                    output.write(thesis_id, pid, mods_xml)
+                    count += 1
+        finally:
+            if executor:
+                executor.shutdown()
+        return count
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['processes'] < 1:
+            raise CommandError('--chunk-size and --processes must be at least 1')
+        path = options['path']
+        file_format = options['format'] or ('jsonl' if path.lower().endswith('.jsonl') else 'zip')
+        output = JsonLinesOutput(path) if file_format == 'jsonl' else ZipOutput(path)
+        try:
+            count = self._export(output, options)
+        finally:
+            output.close()
+        self.stdout.write(f'Exported MODS for {count} theses to {path}.')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from etd_app import fast_cache
+
+
+class Command(BaseCommand):
+    help = 'Show the hit/miss counts for the FAST suggestion cache (the app processes write theirs every FAST_CACHE_STATS_FLUSH_SECONDS)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='set the counts back to zero, after showing them')
+
+    def handle(self, *args, **options):
+        stats = fast_cache.get_stats()
+        self.stdout.write('hits: %s\nmisses: %s\nhit ratio: %.1f%%' % (stats['hits'], stats['misses'], stats['hit_ratio'] * 100))
+        if options['reset']:
+            fast_cache.reset_stats()
+            self.stdout.write('Counts reset.')
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from etd_app import fast_index
+
+
+class Command(BaseCommand):
+    help = 'Build the local FAST subject index from a FAST bulk download (MARCXML), or a CSV file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['marcxml', 'csv'], help='defaults to the file extension')
+        parser.add_argument('--index-path', default=settings.FAST_LOCAL_INDEX_PATH)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        index_path = options['index_path']
+        if not index_path:
+            raise CommandError('set FAST_LOCAL_INDEX_PATH, or pass --index-path')
+        file_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'marcxml')
+        if file_format == 'csv':
+            headings = fast_index.read_csv(path)
+        else:
+            headings = fast_index.read_marcxml(path)
+        count = fast_index.build_index(headings, index_path)
+        self.stdout.write(f'Indexed {count} FAST headings in {index_path}.')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from etd_app.ingestion import ingest_batch_of_theses
+
+
+class Command(BaseCommand):
+    help = 'Queue the accepted theses/dissertations whose paperwork is complete for ingestion (see ingest_worker)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='queue theses ready by this date (YYYY-MM-DD); defaults to today')
+
+    def handle(self, *args, **options):
+        ingest_batch_of_theses(dt=options['date'])
@@ -0,0 +1,23 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from etd_app.ingestion import run_ingest_workers
+
+
+class Command(BaseCommand):
+    help = 'Run queued ingest jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='number of theses to ingest at once')
+        parser.add_argument('--forever', action='store_true', help='keep checking for new jobs, instead of exiting when the queue is empty')
+        parser.add_argument('--poll-interval', type=float, default=30, help='seconds between checks for new jobs, with --forever')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+        if options['forever']:
+            while True:
+                run_ingest_workers(workers=options['workers'])
+                time.sleep(options['poll_interval'])
+        succeeded, failed = run_ingest_workers(workers=options['workers'])
+        if failed:
+            raise CommandError('%s of %s ingest jobs failed' % (len(failed), len(succeeded) + len(failed)))
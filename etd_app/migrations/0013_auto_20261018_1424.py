@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etd_app', '0012_department_bdr_collection_pid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thesis',
+            name='eligible_for_ingest_on',
+            field=models.DateField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='thesis',
+            index=models.Index(fields=['status', 'eligible_for_ingest_on'], name='etd_app_the_status_4ef0c0_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def _get_trigrams(search_text):
+    #copy of Keyword.get_trigrams(), since migrations can't use model methods
+    trigrams = {search_text[i:i+3] for i in range(len(search_text) - 2)}
+    for word in search_text.split():
+        trigrams.add(('  ' + word[:1])[-3:])
+        trigrams.add(('  ' + word[:2])[-3:])
+    return trigrams
+
+
+def populate_trigrams(apps, schema_editor):
+    Keyword = apps.get_model('etd_app', 'Keyword')
+    KeywordTrigram = apps.get_model('etd_app', 'KeywordTrigram')
+    batch = []
+    for keyword_id, search_text in Keyword.objects.values_list('id', 'search_text').iterator():
+        batch.extend([KeywordTrigram(keyword_id=keyword_id, trigram=t) for t in _get_trigrams(search_text)])
+        if len(batch) >= 5000:
+            KeywordTrigram.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    KeywordTrigram.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etd_app', '0013_auto_20261018_1424'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeywordTrigram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(max_length=3)),
+                ('keyword', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trigrams', to='etd_app.keyword')),
+            ],
+            options={
+                'unique_together': {('trigram', 'keyword')},
+            },
+        ),
+        migrations.RunPython(populate_trigrams, migrations.RunPython.noop),
+    ]
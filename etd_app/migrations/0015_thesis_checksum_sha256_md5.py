@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etd_app', '0014_keywordtrigram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thesis',
+            name='checksum_md5',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='thesis',
+            name='checksum_sha256',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:33
+
+from django.db import migrations, models
+import etd_app.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etd_app', '0015_thesis_checksum_sha256_md5'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='thesis',
+            name='document',
+            field=models.FileField(storage=etd_app.storage.get_thesis_document_storage, upload_to=''),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-18 14:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etd_app', '0017_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('claimed_by', models.CharField(blank=True, max_length=190)),
+                ('lease_expires', models.DateTimeField(blank=True, null=True)),
+                ('pid', models.CharField(blank=True, max_length=50)),
+                ('last_error', models.TextField(blank=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('thesis', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingest_jobs', to='etd_app.thesis')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ingestjob',
+            index=models.Index(fields=['status', 'lease_expires'], name='etd_app_ing_status_a5259e_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 15:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('etd_app', '0018_ingestjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FastCacheCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('count', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -1,12 +1,18 @@
-from datetime import date, datetime, timezone as dt_timezone
+from datetime import date, datetime, timedelta, timezone as dt_timezone
 import hashlib
 import os
+import shutil
 import unicodedata
-from django.db import models, IntegrityError
-from django.db.models import Q
+import uuid
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import models, transaction, IntegrityError
+from django.db.models import BooleanField, Case, Count, F, IntegerField, Prefetch, Q, Value, When
 from django.utils import timezone
 from model_utils import Choices
 from . import email
+from .storage import get_thesis_document_storage
+from .utilities import DIGEST_ALGORITHMS, calculate_file_digests
 
 
 STRINGS_TO_REMOVE = ['<br />', '<br>', '<BR>', '\x0b', '\x0c', '\x0e', '\x0f', '\x00', '\x02', '\x03']
@@ -48,6 +54,12 @@ class CommitteeMemberException(Exception):
 class ThesisException(Exception):
     pass
 
+class ChunkedUploadException(Exception):
+    pass
+
+class ChunkedUploadChecksumException(ChunkedUploadException):
+    pass
+
 
 class Department(models.Model):
 
@@ -172,6 +184,36 @@ class GradschoolChecklist(models.Model):
                         return True
         return False
 
+    def get_completion_date(self):
+        '''The first date complete() returns True for, with the current checklist dates
+        (None if the paperwork isn't all in yet).'''
+        if not self.pages_submitted_to_gradschool:
+            return None
+        dates = [self.pages_submitted_to_gradschool.date()]
+        if self.candidate.degree.degree_type != Degree.TYPES.masters:
+            if not (self.gradschool_exit_survey and self.earned_docs_survey):
+                return None
+            dates.extend([self.gradschool_exit_survey.date(), self.earned_docs_survey.date()])
+        return max(dates)
+
+    def save(self, *args, **kwargs):
+        super(GradschoolChecklist, self).save(*args, **kwargs)
+        Thesis.update_eligible_for_ingest_on(self.candidate)
+
+    @staticmethod
+    def get_complete_filter(dt=None, candidate_prefix=''):
+        '''Q object with the same rules as complete(), so the check can be done in the db.
+        Lookups are relative to Candidate - pass candidate_prefix (eg. 'candidate__') to
+        filter a queryset of a related model.'''
+        if not dt:
+            dt = date.today()
+        checklist_prefix = f'{candidate_prefix}gradschool_checklist__'
+        pages_submitted = Q(**{f'{checklist_prefix}pages_submitted_to_gradschool__date__lte': dt})
+        masters = Q(**{f'{candidate_prefix}degree__degree_type': Degree.TYPES.masters})
+        surveys_submitted = Q(**{f'{checklist_prefix}gradschool_exit_survey__date__lte': dt,
+                                 f'{checklist_prefix}earned_docs_survey__date__lte': dt})
+        return pages_submitted & (masters | surveys_submitted)
+
     # def complete(self, dt=None):
     #     if not dt:
     #         dt = date.today()
@@ -233,22 +275,97 @@ class Keyword(models.Model):
             raise KeywordException('keyword %s too long' % self.text.encode('utf8'))
         self.search_text = Keyword.get_search_text(self.text)
         super(Keyword, self).save(*args, **kwargs)
+        self._update_trigrams()
+
+    def _update_trigrams(self):
+        self.trigrams.all().delete()
+        #ignore_conflicts: a case/accent-insensitive db collation can treat two trigrams as the same
+        KeywordTrigram.objects.bulk_create(
+                [KeywordTrigram(keyword=self, trigram=t) for t in sorted(Keyword.get_trigrams(self.search_text))],
+                ignore_conflicts=True,
+            )
 
     @staticmethod
     def get_search_text(nfd_normalized_text):
         return ''.join([c for c in nfd_normalized_text if unicodedata.category(c) != 'Mn']).lower()
 
     @staticmethod
-    def search(term, order=None):
+    def _get_substring_trigrams(search_text):
+        return {search_text[i:i+3] for i in range(len(search_text) - 2)}
+
+    @staticmethod
+    def _get_prefix_trigram(prefix):
+        #pad 1 & 2 character word prefixes out to a trigram: '  p', ' py'
+        return ('  ' + prefix)[-3:]
+
+    @staticmethod
+    def get_trigrams(search_text):
+        trigrams = Keyword._get_substring_trigrams(search_text)
+        for word in search_text.split():
+            trigrams.add(Keyword._get_prefix_trigram(word[:1]))
+            trigrams.add(Keyword._get_prefix_trigram(word[:2]))
+        return trigrams
+
+    @staticmethod
+    def search(term, order=None, limit=None, prefix_first=False):
+        '''Find keywords containing the term. The KeywordTrigram index narrows down the
+        keywords to check, instead of scanning the whole table. Terms shorter than a
+        trigram are matched against the start of each word, when using prefix_first
+        (for autocomplete), and by scanning the table otherwise.
+        prefix_first puts exact matches, then keywords starting with the term, first.'''
         term = normalize_text(term)
         #this is search, so we're fine with getting fuzzy results
-        #  so search the lower-case, no-accent version as well
-        queryset = Keyword.objects.filter(Q(text__icontains=term) | Q(search_text__icontains=term))
+        #  so search the lower-case, no-accent version
+        search_term = Keyword.get_search_text(term)
+        if len(search_term) >= 3:
+            trigrams = Keyword._get_substring_trigrams(search_term)
+            term_filter = Q(search_text__contains=search_term)
+        elif search_term and prefix_first:
+            trigrams = {Keyword._get_prefix_trigram(search_term)}
+            term_filter = Q(search_text__startswith=search_term) | Q(search_text__contains=' ' + search_term)
+        else:
+            trigrams = set()
+            term_filter = Q(text__icontains=term) | Q(search_text__icontains=term)
+        queryset = Keyword.objects.filter(term_filter)
+        if trigrams:
+            keyword_ids = (KeywordTrigram.objects.filter(trigram__in=trigrams)
+                    .values('keyword_id')
+                    .annotate(num_trigrams=Count('trigram'))
+                    .filter(num_trigrams=len(trigrams))
+                    .values('keyword_id'))
+            queryset = queryset.filter(id__in=keyword_ids)
+        ordering = []
+        if prefix_first:
+            queryset = queryset.annotate(match_rank=Case(
+                    When(search_text=search_term, then=Value(0)),
+                    When(search_text__startswith=search_term, then=Value(1)),
+                    default=Value(2),
+                    output_field=IntegerField(),
+                ))
+            ordering.append('match_rank')
         if order:
-            queryset = queryset.order_by(order)
+            ordering.append(order)
+        if ordering:
+            queryset = queryset.order_by(*ordering)
+        if limit:
+            queryset = queryset[:limit]
         return list(queryset)
 
 
+class KeywordTrigram(models.Model):
+    '''Index of the 3-character substrings of Keyword.search_text (plus padded trigrams
+    for the start of each word), maintained by Keyword.save().'''
+
+    keyword = models.ForeignKey(Keyword, related_name='trigrams', on_delete=models.CASCADE)
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        unique_together = [['trigram', 'keyword']]
+
+    def __str__(self):
+        return self.trigram
+
+
 class FormatChecklist(models.Model):
 
     thesis = models.OneToOneField('Thesis', related_name='format_checklist', on_delete=models.PROTECT)
@@ -292,9 +409,11 @@ class Thesis(models.Model):
         )
 
     candidate = models.OneToOneField('Candidate', on_delete=models.PROTECT)
-    document = models.FileField()
+    document = models.FileField(storage=get_thesis_document_storage)
     original_file_name = models.CharField(max_length=190)
-    checksum = models.CharField(max_length=100)
+    checksum = models.CharField(max_length=100) #sha1
+    checksum_sha256 = models.CharField(max_length=64, blank=True, editable=False)
+    checksum_md5 = models.CharField(max_length=32, blank=True, editable=False)
     title = models.CharField(max_length=255)
     abstract = models.TextField()
     keywords = models.ManyToManyField(Keyword)
@@ -306,15 +425,28 @@ class Thesis(models.Model):
     date_accepted = models.DateTimeField(null=True, blank=True)
     date_rejected = models.DateTimeField(null=True, blank=True)
     pid = models.CharField(max_length=50, null=True, unique=True, blank=True)
+    #copy of candidate.gradschool_checklist.get_completion_date(), so finding theses to ingest is a range query
+    eligible_for_ingest_on = models.DateField(null=True, blank=True, editable=False)
     created = models.DateTimeField(auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name_plural = 'Theses'
+        indexes = [
+            models.Index(fields=['status', 'eligible_for_ingest_on']),
+        ]
 
     @staticmethod
     def calculate_checksum(thesis_file):
-        return hashlib.sha1(thesis_file.read()).hexdigest()
+        return calculate_file_digests(thesis_file, algorithms=['sha1'])['sha1']
+
+    def _set_checksums(self, thesis_file, checksums=None):
+        #use the checksums from the upload handler if we have them; otherwise,
+        #  make one streaming pass over the file for all the digests
+        digests = checksums or calculate_file_digests(thesis_file)
+        self.checksum = digests['sha1']
+        self.checksum_sha256 = digests['sha256']
+        self.checksum_md5 = digests['md5']
 
     def __str__(self):
         return self.title
@@ -335,13 +467,15 @@ class Thesis(models.Model):
             if not self.original_file_name:
                 self.original_file_name = os.path.basename(self.document.name) #grabbing name from tmp file, since we haven't saved yet
             if not self.checksum:
-                self.checksum = Thesis.calculate_checksum(self.document)
+                self._set_checksums(self.document)
         if not self.language:
             self.language = self._get_default_language()
         if self.abstract:
             self.abstract = cleanup_user_text(self.abstract)
         if self.title:
             self.title = cleanup_user_text(self.title)
+        if self.candidate_id:
+            self.eligible_for_ingest_on = Thesis._get_eligible_for_ingest_on(self.candidate)
         super(Thesis, self).save(*args, **kwargs)
         if not hasattr(self, 'format_checklist'):
             self.format_checklist = FormatChecklist.objects.create(thesis=self)
@@ -362,13 +496,25 @@ class Thesis(models.Model):
 
     @property
     def current_file_name(self):
+        #content-addressed blobs are named by their hash - the uploaded name is in original_file_name
+        if self.original_file_name and self.document.storage.is_blob(self.document.name):
+            return os.path.basename(self.original_file_name)
         return os.path.basename(self.document.name)
 
-    def update_thesis_file(self, thesis_file):
+    def update_thesis_file(self, thesis_file, checksums=None):
+        old_document_name = self.document.name
         self.document = thesis_file
         self.original_file_name = thesis_file.name
-        self.checksum = Thesis.calculate_checksum(self.document)
+        self._set_checksums(self.document, checksums=checksums)
         self.save()
+        if old_document_name and old_document_name != self.document.name:
+            transaction.on_commit(lambda: Thesis.release_document(old_document_name))
+
+    @staticmethod
+    def release_document(name):
+        '''delete a stored document, if no thesis uses it any more'''
+        storage = Thesis._meta.get_field('document').storage
+        return storage.release(name, count_references=lambda: Thesis.objects.filter(document=name).count())
 
     def metadata_complete(self):
         if self.title and self.abstract and self.keywords:
@@ -413,6 +559,42 @@ class Thesis(models.Model):
         self.save()
         email.send_reject_email(self.candidate)
 
+    @staticmethod
+    def _get_eligible_for_ingest_on(candidate):
+        try:
+            return candidate.gradschool_checklist.get_completion_date()
+        except GradschoolChecklist.DoesNotExist:
+            return None
+
+    @staticmethod
+    def update_eligible_for_ingest_on(candidate):
+        '''Re-calculate the stored eligible_for_ingest_on date, after the candidate's degree
+        or checklist changes. Uses update(), so the thesis modified date doesn't change.'''
+        eligible_for_ingest_on = Thesis._get_eligible_for_ingest_on(candidate)
+        Thesis.objects.filter(candidate=candidate).update(eligible_for_ingest_on=eligible_for_ingest_on)
+        if Candidate.thesis.is_cached(candidate):
+            candidate.thesis.eligible_for_ingest_on = eligible_for_ingest_on
+
+    @staticmethod
+    def get_ready_to_ingest_filter(dt=None):
+        '''Q object with the same rules as ready_to_ingest(), using the stored eligible_for_ingest_on date.'''
+        if not dt:
+            dt = date.today()
+        return Q(status=Thesis.STATUS_CHOICES.accepted, eligible_for_ingest_on__lte=dt,
+                 candidate__year__lte=date.today().year)
+
+    @staticmethod
+    def get_ingest_queryset():
+        '''Theses with everything that ready_to_ingest(), ThesisIngester, and the MODS writer read already
+        loaded - a fixed number of queries, however many theses there are.'''
+        committee_members = CommitteeMember.objects.select_related('person')
+        return Thesis.objects.select_related(
+                'candidate__person', 'candidate__department', 'candidate__degree',
+                'candidate__gradschool_checklist', 'language', 'format_checklist',
+            ).prefetch_related(
+                'keywords', Prefetch('candidate__committee_members', queryset=committee_members),
+            )
+
     def ready_to_ingest(self, dt=None):
         current_year = date.today().year
         if self.status == Thesis.STATUS_CHOICES.accepted:
@@ -424,11 +606,12 @@ class Thesis(models.Model):
     def mark_ingested(self, pid):
         self.pid = pid
         self.status = Thesis.STATUS_CHOICES.ingested
-        self.save()
+        #only write what changed, so this can't clobber other edits to the thesis (eg. during a parallel batch ingest)
+        self.save(update_fields=['pid', 'status', 'modified'])
 
     def mark_ingest_error(self):
         self.status = Thesis.STATUS_CHOICES.ingest_error
-        self.save()
+        self.save(update_fields=['status', 'modified'])
 
     def open_for_reupload(self):
         if self.status not in [Thesis.STATUS_CHOICES.pending, Thesis.STATUS_CHOICES.accepted]:
@@ -488,6 +671,9 @@ class Candidate(models.Model):
             GradschoolChecklist.objects.create(candidate=self)
         if not hasattr(self, 'thesis'):
             Thesis.objects.create(candidate=self)
+        else:
+            #degree type affects whether the checklist is complete
+            Thesis.update_eligible_for_ingest_on(self)
 
     @staticmethod
     def _get_order_by_field(sort_by_param):
@@ -518,7 +704,252 @@ class Candidate(models.Model):
             return Candidate.objects.filter(thesis__status='pending').order_by(order_by_field)
         elif status == 'dissertation_rejected': #dissertation needs to be resubmitted
             return Candidate.objects.filter(thesis__status='rejected').order_by(order_by_field)
-        elif status == 'paperwork_incomplete': #dissertation approved, still need paperwork
-            return [c for c in Candidate.objects.filter(thesis__status='accepted').order_by(order_by_field) if not c.gradschool_checklist.complete()]
-        elif status == 'complete': #dissertation approved, paperwork complete - everything done
-            return [c for c in Candidate.objects.filter(thesis__status='accepted').order_by(order_by_field) if c.gradschool_checklist.complete()]
+        elif status in ['paperwork_incomplete', 'complete']:
+            #annotate instead of exclude(), so null checklist dates don't need any special handling
+            accepted = Candidate.objects.filter(thesis__status='accepted').annotate(
+                    paperwork_complete=Case(
+                        When(GradschoolChecklist.get_complete_filter(), then=Value(True)),
+                        default=Value(False),
+                        output_field=BooleanField(),
+                    ))
+            if status == 'paperwork_incomplete': #dissertation approved, still need paperwork
+                return accepted.filter(paperwork_complete=False).order_by(order_by_field)
+            else: #dissertation approved, paperwork complete - everything done
+                return accepted.filter(paperwork_complete=True).order_by(order_by_field)
+
+
+class ChunkedUpload(models.Model):
+    '''A resumable thesis file upload: the file is sent in numbered chunks (which can be
+    re-sent, in any order), then put back together and handed to the upload form on commit.
+    The chunks are kept in files under settings.CHUNKED_UPLOAD_DIR, so a chunk's file
+    existing means it was received.'''
+
+    upload_id = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    candidate = models.ForeignKey('Candidate', related_name='chunked_uploads', on_delete=models.CASCADE)
+    file_name = models.CharField(max_length=190)
+    size = models.PositiveBigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    sha256 = models.CharField(max_length=64, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return '%s (%s)' % (self.file_name, self.upload_id)
+
+    @property
+    def num_chunks(self):
+        return (self.size + self.chunk_size - 1) // self.chunk_size
+
+    @property
+    def directory(self):
+        return os.path.join(settings.CHUNKED_UPLOAD_DIR, str(self.upload_id))
+
+    def _get_chunk_path(self, number):
+        return os.path.join(self.directory, '%s.chunk' % number)
+
+    def get_expected_chunk_size(self, number):
+        if number < 0 or number >= self.num_chunks:
+            raise ChunkedUploadException('invalid chunk number %s' % number)
+        if number == self.num_chunks - 1:
+            return self.size - (self.chunk_size * number)
+        return self.chunk_size
+
+    def get_received_chunks(self):
+        try:
+            file_names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return sorted(int(name.split('.')[0]) for name in file_names if name.endswith('.chunk'))
+
+    def write_chunk(self, number, stream, length):
+        '''Save chunk number from a file-like stream, reading at most length bytes. Re-sending
+        a chunk replaces it.'''
+        if length != self.get_expected_chunk_size(number):
+            raise ChunkedUploadException('chunk %s should be %s bytes, not %s' % (number, self.get_expected_chunk_size(number), length))
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = '%s.%s.tmp' % (self._get_chunk_path(number), uuid.uuid4().hex)
+        received = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                while received < length:
+                    data = stream.read(min(length - received, 64 * 1024))
+                    if not data:
+                        break
+                    f.write(data)
+                    received += len(data)
+            if received != length:
+                raise ChunkedUploadException('chunk %s: only received %s of %s bytes' % (number, received, length))
+            #only a complete chunk ever has the real chunk name
+            os.replace(tmp_path, self._get_chunk_path(number))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def assemble(self, sha256):
+        '''Put the chunks together into one uploaded file, hashing it on the way, and check it
+        against the sha256 the client sent with the commit (and at the start, if it sent one then).'''
+        if not sha256:
+            raise ChunkedUploadException('no sha256 to check the file against')
+        missing = sorted(set(range(self.num_chunks)) - set(self.get_received_chunks()))
+        if missing:
+            raise ChunkedUploadException('missing chunks: %s' % ', '.join([str(m) for m in missing]))
+        hashers = {algorithm: hashlib.new(algorithm) for algorithm in DIGEST_ALGORITHMS}
+        uploaded_file = TemporaryUploadedFile(self.file_name, 'application/pdf', self.size, None)
+        try:
+            for number in range(self.num_chunks):
+                with open(self._get_chunk_path(number), 'rb') as chunk_file:
+                    for data in iter(lambda: chunk_file.read(64 * 1024), b''):
+                        for hasher in hashers.values():
+                            hasher.update(data)
+                        uploaded_file.write(data)
+            uploaded_file.flush()
+            uploaded_file.seek(0)
+            uploaded_file.checksums = {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
+            for expected in [sha256, self.sha256]:
+                if expected and expected != uploaded_file.checksums['sha256']:
+                    raise ChunkedUploadChecksumException('checksum mismatch: expected sha256 %s, got %s' % (expected, uploaded_file.checksums['sha256']))
+        except Exception:
+            uploaded_file.close()
+            raise
+        return uploaded_file
+
+    def delete(self, *args, **kwargs):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        return super().delete(*args, **kwargs)
+
+
+class IngestJob(models.Model):
+    '''A queued ingest of one thesis, run by "manage.py ingest_worker" instead of in a web request.
+    A worker claims a job with a conditional update (so two workers can't both get it), and holds
+    it until lease_expires (renewed between retries of the post) - if the worker dies, the job can be
+    claimed again after that, up to settings.INGEST_JOB_MAX_ATTEMPTS times.'''
+    STATUS_CHOICES = Choices(
+            ('queued', 'Queued'),
+            ('running', 'Running'),
+            ('succeeded', 'Succeeded'),
+            ('failed', 'Failed'),
+        )
+
+    thesis = models.ForeignKey('Thesis', related_name='ingest_jobs', on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_CHOICES.queued)
+    attempts = models.PositiveIntegerField(default=0)
+    claimed_by = models.CharField(max_length=190, blank=True)
+    lease_expires = models.DateTimeField(null=True, blank=True)
+    pid = models.CharField(max_length=50, blank=True)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'lease_expires'])]
+
+    def __str__(self):
+        return 'ingest %s (%s)' % (self.thesis_id, self.status)
+
+    @property
+    def duration(self):
+        if self.started and self.finished:
+            return self.finished - self.started
+        return None
+
+    @staticmethod
+    def enqueue(thesis):
+        '''Queue an ingest of the thesis, unless one is already queued or running.'''
+        unfinished = [IngestJob.STATUS_CHOICES.queued, IngestJob.STATUS_CHOICES.running]
+        job = IngestJob.objects.filter(thesis=thesis, status__in=unfinished).first()
+        if job:
+            return job
+        return IngestJob.objects.create(thesis=thesis)
+
+    @staticmethod
+    def enqueue_many(theses):
+        '''Queue ingests of the theses, in a fixed number of queries. Theses that already have
+        a queued or running job keep that one.'''
+        unfinished = [IngestJob.STATUS_CHOICES.queued, IngestJob.STATUS_CHOICES.running]
+        existing = {job.thesis_id: job for job in IngestJob.objects.filter(thesis__in=theses, status__in=unfinished)}
+        new_jobs = [IngestJob(thesis=thesis) for thesis in theses if thesis.id not in existing]
+        IngestJob.objects.bulk_create(new_jobs)
+        return list(existing.values()) + new_jobs
+
+    @staticmethod
+    def _get_claimable_filter(now):
+        #queued, or claimed by a worker that didn't finish before its lease ran out
+        return (Q(status=IngestJob.STATUS_CHOICES.queued) |
+                Q(status=IngestJob.STATUS_CHOICES.running, lease_expires__lt=now))
+
+    @staticmethod
+    def claim_next(worker, lease_seconds=None):
+        '''Claim the oldest claimable job for worker. Returns the job, or None if there's nothing to do.'''
+        now = timezone.now()
+        lease_expires = now + timedelta(seconds=lease_seconds or settings.INGEST_JOB_LEASE_SECONDS)
+        #jobs whose workers keep dying don't get retried forever
+        IngestJob.objects.filter(status=IngestJob.STATUS_CHOICES.running, lease_expires__lt=now,
+                attempts__gte=settings.INGEST_JOB_MAX_ATTEMPTS).update(status=IngestJob.STATUS_CHOICES.failed,
+                last_error='lease expired after %s attempts' % settings.INGEST_JOB_MAX_ATTEMPTS, finished=now, lease_expires=None)
+        claimable = IngestJob._get_claimable_filter(now)
+        while True:
+            job_ids = list(IngestJob.objects.filter(claimable).order_by('id').values_list('id', flat=True)[:10])
+            if not job_ids:
+                return None
+            for job_id in job_ids:
+                #only one worker's update can match - anyone else sees the job already claimed, and tries the next one
+                claimed = IngestJob.objects.filter(claimable, id=job_id).update(status=IngestJob.STATUS_CHOICES.running,
+                        claimed_by=worker, lease_expires=lease_expires, started=now, finished=None, attempts=F('attempts') + 1)
+                if claimed:
+                    return IngestJob.objects.get(id=job_id)
+
+    def renew_lease(self, lease_seconds=None):
+        '''Push lease_expires out again, so a long ingest isn't claimed by another worker while it's still running.
+        Returns False if this worker doesn't hold the job any more.'''
+        lease_expires = timezone.now() + timedelta(seconds=lease_seconds or settings.INGEST_JOB_LEASE_SECONDS)
+        renewed = IngestJob.objects.filter(id=self.id, status=IngestJob.STATUS_CHOICES.running,
+                claimed_by=self.claimed_by).update(lease_expires=lease_expires)
+        if renewed:
+            self.lease_expires = lease_expires
+        return bool(renewed)
+
+    def _finish(self, status, **fields):
+        now = timezone.now()
+        #if the lease ran out and another worker has the job now, leave it to that worker
+        finished = IngestJob.objects.filter(id=self.id, status=IngestJob.STATUS_CHOICES.running,
+                claimed_by=self.claimed_by).update(status=status, finished=now, lease_expires=None, **fields)
+        if finished:
+            self.status = status
+            self.finished = now
+            self.lease_expires = None
+            for field, value in fields.items():
+                setattr(self, field, value)
+        return bool(finished)
+
+    def mark_succeeded(self, pid):
+        return self._finish(IngestJob.STATUS_CHOICES.succeeded, pid=pid, last_error='')
+
+    def mark_failed(self, error):
+        return self._finish(IngestJob.STATUS_CHOICES.failed, last_error=error)
+
+
+class FastCacheCounter(models.Model):
+    '''Hit/miss counts for the FAST suggestion cache (see fast_cache.py). They're kept here, not in
+    the cache, so culling the cache doesn't throw them away.'''
+
+    name = models.CharField(max_length=50, unique=True)
+    count = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return '%s: %s' % (self.name, self.count)
+
+    @staticmethod
+    def add(name, count):
+        #atomic in the db, so counts from different processes aren't lost
+        if not FastCacheCounter.objects.filter(name=name).update(count=F('count') + count):
+            FastCacheCounter.objects.get_or_create(name=name)
+            FastCacheCounter.objects.filter(name=name).update(count=F('count') + count)
+
+    @staticmethod
+    def get_counts(names):
+        counts = dict(FastCacheCounter.objects.filter(name__in=names).values_list('name', 'count'))
+        return {name: counts.get(name, 0) for name in names}
+
+    @staticmethod
+    def reset(names):
+        FastCacheCounter.objects.filter(name__in=names).delete()
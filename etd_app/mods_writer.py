@@ -0,0 +1,110 @@
+'''Writes the same MODS document as ModsMapper(thesis).get_mods().serialize(), straight from
+the thesis data - no bdrxml/eulxml object tree, and no lxml.
+
+get_mods_record() pulls what's needed from a thesis into a plain dict (which can be pickled,
+cached, or sent to another process), and write_mods()/serialize_mods() turn that dict into XML.
+The element order and escaping match the bdrxml output exactly - tests/test_mods_writer.py
+checks them against each other.'''
+from datetime import date
+import re
+
+
+MODS_ROOT = ('<mods:mods xmlns:mods="http://www.loc.gov/mods/v3" xmlns:xlink="http://www.w3.org/1999/xlink"'
+        ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+        ' xsi:schemaLocation="http://www.loc.gov/mods/v3 http://www.loc.gov/standards/mods/v3/mods-3-7.xsd">')
+#characters XML 1.0 doesn't allow (lxml refuses them too)
+INVALID_XML_CHARS_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+TEXT_ESCAPES = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '\r': '&#13;'}
+ATTRIBUTE_ESCAPES = dict(TEXT_ESCAPES, **{'"': '&quot;', '\n': '&#10;', '\t': '&#9;'})
+TEXT_ESCAPE_RE = re.compile('[&<>\r]')
+ATTRIBUTE_ESCAPE_RE = re.compile('[&<>\r"\n\t]')
+
+
+def _check(value):
+    value = str(value)
+    if INVALID_XML_CHARS_RE.search(value):
+        raise ValueError('All strings must be XML compatible: %r' % value)
+    return value
+
+
+def _text(value):
+    return TEXT_ESCAPE_RE.sub(lambda m: TEXT_ESCAPES[m.group()], _check(value))
+
+
+def _attribute(value):
+    return ATTRIBUTE_ESCAPE_RE.sub(lambda m: ATTRIBUTE_ESCAPES[m.group()], _check(value))
+
+
+def _element(name, text, **attributes):
+    attributes = ''.join(' %s="%s"' % (key, _attribute(value)) for key, value in attributes.items())
+    return '<mods:%s%s>%s</mods:%s>' % (name, attributes, _text(text), name)
+
+
+def _name(name_type, name_part, role):
+    return '<mods:name type="%s"><mods:namePart>%s</mods:namePart><mods:role>%s</mods:role></mods:name>' % (
+            name_type, _text(name_part), _element('roleTerm', role, type='text'))
+
+
+def get_mods_record(thesis, today=None):
+    '''The data the MODS is built from, as a plain dict. Use Thesis.get_ingest_queryset() to load
+    the theses, so this doesn't run extra queries.'''
+    candidate = thesis.candidate
+    return {
+        'title': thesis.title,
+        'creator': candidate.person.get_formatted_name(),
+        'committee_members': [(cm.person.get_formatted_name(), cm.get_role_display()) for cm in candidate.committee_members.all()],
+        'department': candidate.department.name,
+        'year': candidate.year,
+        'degree': candidate.degree.abbreviation,
+        'num_prelim_pages': thesis.num_prelim_pages,
+        'num_body_pages': thesis.num_body_pages,
+        'abstract': thesis.abstract,
+        'keywords': [{'text': kw.text, 'authority': kw.authority, 'authority_uri': kw.authority_uri, 'value_uri': kw.value_uri}
+                     for kw in thesis.keywords.all()],
+        'language': thesis.language.name if thesis.language else None,
+        'record_creation_date': (today or date.today()).strftime('%Y%m%d'),
+    }
+
+
+def iter_mods(record):
+    '''The MODS document for a get_mods_record() dict, as a series of strings.'''
+    yield MODS_ROOT
+    yield '<mods:titleInfo>%s</mods:titleInfo>' % _element('title', record['title'])
+    yield _element('typeOfResource', 'dissertations', authority='primo')
+    yield _name('personal', record['creator'], 'creator')
+    for name, role in record['committee_members']:
+        yield _name('personal', name, role)
+    yield _name('corporate', 'Brown University. %s' % record['department'], 'sponsor')
+    yield '<mods:originInfo>%s</mods:originInfo>' % _element('copyrightDate', record['year'])
+    yield '<mods:physicalDescription>%s%s</mods:physicalDescription>' % (
+            _element('extent', '%s, %s p.' % (record['num_prelim_pages'], record['num_body_pages'])),
+            _element('digitalOrigin', 'born digital'))
+    yield _element('note', 'Thesis (%s)--Brown University, %s' % (record['degree'], record['year']), type='thesis')
+    yield _element('genre', 'theses', authority='aat')
+    yield _element('abstract', record['abstract'])
+    for keyword in record['keywords']:
+        attributes = {}
+        #same order as bdrxml writes them
+        for key, attribute in [('authority', 'authority'), ('authority_uri', 'authorityURI'), ('value_uri', 'valueURI')]:
+            if keyword.get(key):
+                attributes[attribute] = keyword[key]
+        yield '<mods:subject%s>%s</mods:subject>' % (
+                ''.join(' %s="%s"' % (key, _attribute(value)) for key, value in attributes.items()),
+                _element('topic', keyword['text']))
+    if record['language']:
+        yield '<mods:language>%s</mods:language>' % _element('languageTerm', record['language'], authority='iso639-2b')
+    yield '<mods:recordInfo>%s%s</mods:recordInfo>' % (
+            _element('recordContentSource', 'RPB', authority='marcorg'),
+            _element('recordCreationDate', record['record_creation_date'], encoding='iso8601'))
+    yield '</mods:mods>'
+
+
+def write_mods(record, out):
+    '''Write the MODS for record to out, a text file-like object.'''
+    for chunk in iter_mods(record):
+        out.write(chunk)
+
+
+def serialize_mods(record):
+    '''The MODS for record, as utf-8 bytes (like bdrxml's serialize()).'''
+    return ''.join(iter_mods(record)).encode('utf8')
@@ -0,0 +1,77 @@
+'''Streaming multipart/form-data bodies, for posting big files (the BDR ingest) without
+building the whole request body in memory the way requests' files= argument does.
+
+A MultipartBody is passed as the request data: requests sees that it's iterable with a known
+length, so it sends a Content-Length header and writes the body as it's iterated - the file is
+read in CHUNK_SIZE pieces. Iterating again starts over (re-opening the files), so a retried
+request sends the whole body again.'''
+import binascii
+import mimetypes
+import os
+from urllib3.fields import RequestField
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+class MultipartFile:
+
+    def __init__(self, path, filename=None, content_type=None):
+        self.path = path
+        self.filename = filename or os.path.basename(path)
+        self.content_type = content_type or mimetypes.guess_type(self.filename)[0] or 'application/octet-stream'
+
+
+class MultipartBody:
+
+    def __init__(self, fields=None, files=None, boundary=None, chunk_size=CHUNK_SIZE):
+        '''fields: {name: value or list of values}; files: {name: MultipartFile}'''
+        self.boundary = boundary or binascii.hexlify(os.urandom(16)).decode('ascii')
+        self.chunk_size = chunk_size
+        self._parts = []
+        for name, values in (fields or {}).items():
+            if isinstance(values, (str, bytes)) or not hasattr(values, '__iter__'):
+                values = [values]
+            for value in values:
+                if not isinstance(value, bytes):
+                    value = str(value).encode('utf8')
+                self._parts.append((self._get_part_headers(name), value))
+        for name, multipart_file in (files or {}).items():
+            headers = self._get_part_headers(name, filename=multipart_file.filename, content_type=multipart_file.content_type)
+            self._parts.append((headers, multipart_file))
+        self._closing = ('--%s--\r\n' % self.boundary).encode('ascii')
+
+    def _get_part_headers(self, name, filename=None, content_type=None):
+        #same part headers as requests/urllib3 would write
+        field = RequestField(name=name, data=b'', filename=filename)
+        field.make_multipart(content_type=content_type)
+        return ('--%s\r\n' % self.boundary).encode('ascii') + field.render_headers().encode('utf8')
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary=%s' % self.boundary
+
+    def __len__(self):
+        length = len(self._closing)
+        for headers, value in self._parts:
+            if isinstance(value, MultipartFile):
+                value_length = os.path.getsize(value.path)
+            else:
+                value_length = len(value)
+            length += len(headers) + value_length + 2
+        return length
+
+    def __iter__(self):
+        for headers, value in self._parts:
+            yield headers
+            if isinstance(value, MultipartFile):
+                with open(value.path, 'rb') as f:
+                    while True:
+                        chunk = f.read(self.chunk_size)
+                        if not chunk:
+                            break
+                        yield chunk
+            else:
+                yield value
+            yield b'\r\n'
+        yield self._closing
@@ -1,6 +1,5 @@
 '''One-off scripts that need to be run'''
-import requests
-from . import models
+from . import http_client, models
 
 
 def populate_department_bdr_collection_pids():
@@ -10,7 +9,7 @@ def populate_department_bdr_collection_pids():
         if not dept.bdr_collection_pid:
             if dept.bdr_collection_id:
                 url = f'https://repository.library.brown.edu/api/collections/{dept.bdr_collection_id}/'
-                r = requests.get(url)
+                r = http_client.get('bdr_api', url)
                 if r.ok:
                     collection_info = r.json()
                     pid = collection_info.get('pid')
@@ -0,0 +1,81 @@
+'''Keyset ("seek") pagination: each page is found by filtering on the sort key of the
+last row of the previous page, instead of an OFFSET that makes the db walk (and throw
+away) every earlier row.'''
+from django.core import signing
+from django.db.models import F, Q
+
+
+CURSOR_SALT = 'etd_app.pagination'
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, next_cursor, cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def is_first(self):
+        return self.cursor is None
+
+
+def _get_value(obj, order_field):
+    #follow a lookup like 'thesis__title' through the (select_related) objects
+    value = obj
+    for attr in order_field.split('__'):
+        value = getattr(value, attr, None)
+        if value is None:
+            return None
+    return value
+
+
+def encode_cursor(value, pk):
+    #dates/datetimes go in as ISO strings - the db field parses them back when filtering
+    if hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    return signing.dumps([value, pk], salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(cursor):
+    '''returns (value, pk), or None if the cursor is missing or has been tampered with'''
+    if not cursor:
+        return None
+    try:
+        value, pk = signing.loads(cursor, salt=CURSOR_SALT)
+    except (signing.BadSignature, ValueError, TypeError):
+        return None
+    return value, pk
+
+
+def _get_after_filter(order_field, value, pk):
+    #rows sort NULLs first, then by value, with the pk breaking ties
+    if value is None:
+        return Q(**{f'{order_field}__isnull': True, 'pk__gt': pk}) | Q(**{f'{order_field}__isnull': False})
+    return Q(**{f'{order_field}__gt': value}) | Q(**{order_field: value, 'pk__gt': pk})
+
+
+def get_keyset_page(queryset, order_field, cursor=None, page_size=100):
+    queryset = queryset.order_by(F(order_field).asc(nulls_first=True), 'pk')
+    decoded_cursor = decode_cursor(cursor)
+    if decoded_cursor:
+        queryset = queryset.filter(_get_after_filter(order_field, *decoded_cursor))
+    else:
+        cursor = None
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last_row = rows[-1]
+        next_cursor = encode_cursor(_get_value(last_row, order_field), last_row.pk)
+    return KeysetPage(rows, next_cursor, cursor=cursor)
@@ -0,0 +1,29 @@
+import threading
+
+
+class SingleFlight:
+    '''Coalesces identical calls that are running at the same time: while a call for a key is
+    in flight, submitting the same key again gets the same Future instead of a new call.'''
+
+    def __init__(self):
+        #reentrant, since add_done_callback runs the callback right away if the call's already done
+        self._lock = threading.RLock()
+        self._futures = {}
+
+    def submit(self, executor, key, fn, *args, **kwargs):
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None:
+                future = executor.submit(fn, *args, **kwargs)
+                self._futures[key] = future
+                future.add_done_callback(lambda done_future: self._forget(key, done_future))
+            return future
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._futures)
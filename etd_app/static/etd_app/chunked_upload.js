@@ -0,0 +1,229 @@
+/* Resumable upload of the thesis file: sends the file in numbered chunks, retrying failed
+   chunks, and remembers the upload id (in localStorage) so a page reload can pick up where
+   the last try left off. Each chunk is hashed as it's read, and the file's sha256 goes with
+   the commit, so the server can check the assembled file. Falls back to the regular form post
+   if the browser can't slice or read files. */
+(function () {
+    "use strict";
+
+    var MAX_RETRIES = 5;
+
+    //SubtleCrypto can only hash a whole buffer, so this hashes the file a chunk at a time instead
+    var SHA256_K = new Int32Array([
+        0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+        0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+        0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+        0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+        0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+        0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+        0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+        0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
+    ]);
+
+    function Sha256() {
+        this.h = new Int32Array([0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19]);
+        this.w = new Int32Array(64);
+        this.buffer = new Uint8Array(64);
+        this.buffered = 0;
+        this.length = 0;
+    }
+
+    Sha256.prototype.block = function (data, offset) {
+        var w = this.w, h = this.h, i, x, y;
+        for (i = 0; i < 16; i++) {
+            x = offset + 4 * i;
+            w[i] = (data[x] << 24) | (data[x + 1] << 16) | (data[x + 2] << 8) | data[x + 3];
+        }
+        for (i = 16; i < 64; i++) {
+            x = w[i - 15];
+            y = w[i - 2];
+            w[i] = w[i - 16] + (((x >>> 7) | (x << 25)) ^ ((x >>> 18) | (x << 14)) ^ (x >>> 3)) +
+                    w[i - 7] + (((y >>> 17) | (y << 15)) ^ ((y >>> 19) | (y << 13)) ^ (y >>> 10));
+        }
+        var a = h[0], b = h[1], c = h[2], d = h[3], e = h[4], f = h[5], g = h[6], k = h[7], t1, t2;
+        for (i = 0; i < 64; i++) {
+            t1 = (k + (((e >>> 6) | (e << 26)) ^ ((e >>> 11) | (e << 21)) ^ ((e >>> 25) | (e << 7))) +
+                    ((e & f) ^ (~e & g)) + SHA256_K[i] + w[i]) | 0;
+            t2 = ((((a >>> 2) | (a << 30)) ^ ((a >>> 13) | (a << 19)) ^ ((a >>> 22) | (a << 10))) +
+                    ((a & b) ^ (a & c) ^ (b & c))) | 0;
+            k = g;
+            g = f;
+            f = e;
+            e = (d + t1) | 0;
+            d = c;
+            c = b;
+            b = a;
+            a = (t1 + t2) | 0;
+        }
+        h[0] = (h[0] + a) | 0;
+        h[1] = (h[1] + b) | 0;
+        h[2] = (h[2] + c) | 0;
+        h[3] = (h[3] + d) | 0;
+        h[4] = (h[4] + e) | 0;
+        h[5] = (h[5] + f) | 0;
+        h[6] = (h[6] + g) | 0;
+        h[7] = (h[7] + k) | 0;
+    };
+
+    Sha256.prototype.update = function (bytes) {
+        var i = 0;
+        this.length += bytes.length;
+        if (this.buffered) {
+            while (this.buffered < 64 && i < bytes.length) {
+                this.buffer[this.buffered++] = bytes[i++];
+            }
+            if (this.buffered < 64) {
+                return;
+            }
+            this.block(this.buffer, 0);
+            this.buffered = 0;
+        }
+        for (; i + 64 <= bytes.length; i += 64) {
+            this.block(bytes, i);
+        }
+        while (i < bytes.length) {
+            this.buffer[this.buffered++] = bytes[i++];
+        }
+    };
+
+    Sha256.prototype.hexdigest = function () {
+        //pad with 0x80, zeros, and the length in bits (64-bit big-endian)
+        var padding = new Uint8Array((this.buffered < 56 ? 64 : 128) - this.buffered);
+        var n = padding.length;
+        var high = Math.floor(this.length / 0x20000000), low = (this.length * 8) >>> 0;
+        padding[0] = 0x80;
+        padding[n - 8] = high >>> 24;
+        padding[n - 7] = high >>> 16;
+        padding[n - 6] = high >>> 8;
+        padding[n - 5] = high;
+        padding[n - 4] = low >>> 24;
+        padding[n - 3] = low >>> 16;
+        padding[n - 2] = low >>> 8;
+        padding[n - 1] = low;
+        this.update(padding);
+        return Array.prototype.map.call(this.h, function (word) {
+            return ("0000000" + (word >>> 0).toString(16)).slice(-8);
+        }).join("");
+    };
+
+    function getCookie(name) {
+        var match = document.cookie.match(new RegExp("(^|;\\s*)" + name + "=([^;]*)"));
+        return match ? decodeURIComponent(match[2]) : null;
+    }
+
+    function request(method, url, body) {
+        return fetch(url, {
+            method: method,
+            body: body,
+            credentials: "same-origin",
+            headers: {"X-CSRFToken": getCookie("csrftoken")}
+        }).then(function (response) {
+            return response.json().then(function (data) {
+                if (!response.ok) {
+                    throw new Error(data.error || response.statusText);
+                }
+                return data;
+            });
+        });
+    }
+
+    function sendChunk(url, blob, retriesLeft) {
+        return request("PUT", url, blob).catch(function (error) {
+            if (retriesLeft <= 0) {
+                throw error;
+            }
+            return new Promise(function (resolve) {
+                setTimeout(resolve, 1000 * (MAX_RETRIES - retriesLeft + 1));
+            }).then(function () {
+                return sendChunk(url, blob, retriesLeft - 1);
+            });
+        });
+    }
+
+    function readFile(blob) {
+        return new Promise(function (resolve, reject) {
+            var reader = new FileReader();
+            reader.onload = function () { resolve(new Uint8Array(reader.result)); };
+            reader.onerror = function () { reject(reader.error); };
+            reader.readAsArrayBuffer(blob);
+        });
+    }
+
+    function startOrResume(baseUrl, file, storageKey) {
+        var uploadId = window.localStorage.getItem(storageKey);
+        if (uploadId) {
+            return request("GET", baseUrl + uploadId + "/").catch(function () {
+                window.localStorage.removeItem(storageKey);
+                return startOrResume(baseUrl, file, storageKey);
+            });
+        }
+        var data = new FormData();
+        data.append("file_name", file.name);
+        data.append("size", file.size);
+        return request("POST", baseUrl, data).then(function (status) {
+            window.localStorage.setItem(storageKey, status.upload_id);
+            return status;
+        });
+    }
+
+    function upload(form, file, progress) {
+        var baseUrl = form.getAttribute("data-chunked-upload-url");
+        var storageKey = "etd-upload:" + baseUrl + ":" + file.name + ":" + file.size + ":" + file.lastModified;
+        return startOrResume(baseUrl, file, storageKey).then(function (status) {
+            var uploadUrl = baseUrl + status.upload_id + "/";
+            var received = {};
+            status.received_chunks.forEach(function (n) { received[n] = true; });
+            var done = status.received_chunks.length;
+            var sha256 = new Sha256();
+            var next = Promise.resolve();
+            for (var n = 0; n < status.num_chunks; n++) {
+                next = next.then(function (n) {
+                    var blob = file.slice(n * status.chunk_size, (n + 1) * status.chunk_size);
+                    //chunks sent before a resume are read & hashed too, but not sent again
+                    return readFile(blob).then(function (data) {
+                        sha256.update(data);
+                        if (received[n]) {
+                            return;
+                        }
+                        return sendChunk(uploadUrl + n + "/", blob, MAX_RETRIES).then(function () {
+                            done += 1;
+                            progress(done, status.num_chunks);
+                        });
+                    });
+                }.bind(null, n));
+            }
+            return next.then(function () {
+                var data = new FormData();
+                data.append("sha256", sha256.hexdigest());
+                return request("POST", uploadUrl + "commit/", data);
+            }).then(function (result) {
+                window.localStorage.removeItem(storageKey);
+                return result;
+            });
+        });
+    }
+
+    document.addEventListener("DOMContentLoaded", function () {
+        var form = document.querySelector("form[data-chunked-upload-url]");
+        if (!form || !window.fetch || !window.Blob || !Blob.prototype.slice || !window.FileReader ||
+                !window.Int32Array) {
+            return;
+        }
+        var input = form.querySelector("input[type=file]");
+        var status = document.getElementById("chunked-upload-status");
+        form.addEventListener("submit", function (event) {
+            var file = input.files[0];
+            if (!file) {
+                return;
+            }
+            event.preventDefault();
+            upload(form, file, function (done, total) {
+                status.textContent = "Uploaded " + Math.round(100 * done / total) + "%";
+            }).then(function (result) {
+                window.location = result.redirect;
+            }).catch(function (error) {
+                status.textContent = "Upload failed: " + error.message + ". Submit again to resume.";
+            });
+        });
+    });
+}());
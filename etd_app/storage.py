@@ -0,0 +1,123 @@
+from contextlib import contextmanager
+import fcntl
+import os
+import re
+import tempfile
+import time
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from .utilities import calculate_file_digests
+
+
+#ab/cd/abcd...(64 hex chars).pdf
+BLOB_NAME_RE = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.[a-z0-9]{1,10})?$')
+EXTENSION_RE = re.compile(r'^\.[a-z0-9]{1,10}$')
+LOCK_FILE_NAME = '.lock'
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    '''Stores each file as ab/cd/<sha256>.<extension>, so identical uploads share one blob on
+    disk, and the two levels of shard directories keep any one directory from getting huge.
+    Names are a fixed length, and only depend on the content - the uploaded file name is kept
+    in Thesis.original_file_name. Files saved before this storage was used keep their old
+    names, and are still opened from the same location.
+
+    Blobs are shared, so callers should use release() instead of delete() when a file stops
+    being used.'''
+
+    def _get_sha256(self, content):
+        #the checksum upload handlers already hashed uploaded files
+        checksums = getattr(content, 'checksums', None) or {}
+        if 'sha256' in checksums:
+            return checksums['sha256']
+        return calculate_file_digests(content, algorithms=['sha256'])['sha256']
+
+    def _get_blob_name(self, sha256, name):
+        extension = os.path.splitext(name)[1].lower()
+        if not EXTENSION_RE.match(extension):
+            extension = ''
+        return '/'.join([sha256[:2], sha256[2:4], sha256 + extension])
+
+    def _get_reused_marker_path(self, name):
+        directory, file_name = os.path.split(self.path(name))
+        return os.path.join(directory, '.%s.reused' % file_name)
+
+    @contextmanager
+    def _lock(self, name):
+        #one lock per shard directory, held while a blob is created, reused, or released
+        directory = os.path.dirname(self.path(name))
+        os.makedirs(directory, exist_ok=True)
+        if self.directory_permissions_mode is not None:
+            os.chmod(directory, self.directory_permissions_mode)
+        with open(os.path.join(directory, LOCK_FILE_NAME), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_available_name(self, name, max_length=None):
+        #_save() picks the real name from the content
+        return name
+
+    def _save(self, name, content):
+        name = self._get_blob_name(self._get_sha256(content), name)
+        full_path = self.path(name)
+        with self._lock(name):
+            if os.path.exists(full_path):
+                #the thesis pointing at this blob isn't committed yet - mark the blob as just reused,
+                #  so a release that runs before the commit doesn't delete it
+                with open(self._get_reused_marker_path(name), 'a'):
+                    os.utime(self._get_reused_marker_path(name))
+                return name
+            #write to a temp file next to the blob, then rename it into place, so a blob is never
+            #  seen half-written
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(full_path), prefix='.upload-')
+            try:
+                if hasattr(content, 'temporary_file_path'):
+                    os.close(fd)
+                    file_move_safe(content.temporary_file_path(), tmp_path, allow_overwrite=True)
+                else:
+                    with os.fdopen(fd, 'wb') as f:
+                        for chunk in content.chunks():
+                            f.write(chunk)
+                if self.file_permissions_mode is not None:
+                    os.chmod(tmp_path, self.file_permissions_mode)
+                os.replace(tmp_path, full_path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        return name
+
+    def is_blob(self, name):
+        return bool(name) and bool(BLOB_NAME_RE.match(name))
+
+    def _reused_recently(self, name):
+        try:
+            reused_at = os.path.getmtime(self._get_reused_marker_path(name))
+        except FileNotFoundError:
+            return False
+        return (time.time() - reused_at) < settings.THESIS_BLOB_REUSE_GRACE_SECONDS
+
+    def release(self, name, count_references):
+        '''Delete a blob once nothing references it. count_references is called with the blob
+        locked, so an upload of the same content can't reuse the blob in between. A blob reused
+        in the last settings.THESIS_BLOB_REUSE_GRACE_SECONDS is kept (the new reference may not
+        be committed yet). Files with the old names are left alone.'''
+        if not self.is_blob(name):
+            return False
+        with self._lock(name):
+            if count_references() > 0 or self._reused_recently(name):
+                return False
+            self.delete(name)
+            try:
+                os.remove(self._get_reused_marker_path(name))
+            except FileNotFoundError:
+                pass
+        return True
+
+
+def get_thesis_document_storage():
+    return ContentAddressedStorage()
@@ -0,0 +1,41 @@
+'''Upload handlers that hash each file as its chunks arrive, so the checksums don't need
+another read of the file after it's been uploaded. The digests end up on the uploaded file,
+as uploaded_file.checksums ({algorithm: hexdigest}).'''
+import hashlib
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from .utilities import DIGEST_ALGORITHMS
+
+
+class ChecksumUploadHandlerMixin:
+
+    def new_file(self, *args, **kwargs):
+        #before super(), since the memory handler raises StopFutureHandlers when it takes the file
+        self.hashers = {algorithm: hashlib.new(algorithm) for algorithm in DIGEST_ALGORITHMS}
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        remaining_data = super().receive_data_chunk(raw_data, start)
+        #only hash the chunks this handler keeps - the memory handler passes big files on to the next handler
+        if remaining_data is None:
+            for hasher in self.hashers.values():
+                hasher.update(raw_data)
+        return remaining_data
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.checksums = {algorithm: hasher.hexdigest() for algorithm, hasher in self.hashers.items()}
+        return uploaded_file
+
+
+class ChecksumMemoryFileUploadHandler(ChecksumUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class ChecksumTemporaryFileUploadHandler(ChecksumUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def get_checksum_upload_handlers(request):
+    '''the default memory/temp file handlers, with hashing'''
+    return [ChecksumMemoryFileUploadHandler(request), ChecksumTemporaryFileUploadHandler(request)]
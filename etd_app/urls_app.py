@@ -14,6 +14,10 @@ urlpatterns = [
         re_path(r'^candidate/$', view=views.candidate_home, name='candidate_home'),
         re_path(r'^candidate/(?P<candidate_id>\d+)/profile/$', view=views.candidate_profile, name='candidate_profile'),
         re_path(r'^candidate/(?P<candidate_id>\d+)/upload/$', view=views.candidate_upload, name='candidate_upload'),
+        re_path(r'^candidate/(?P<candidate_id>\d+)/upload/chunked/$', view=views.candidate_upload_chunked_start, name='candidate_upload_chunked_start'),
+        re_path(r'^candidate/(?P<candidate_id>\d+)/upload/chunked/(?P<upload_id>[0-9a-f-]{36})/$', view=views.candidate_upload_chunked_status, name='candidate_upload_chunked_status'),
+        re_path(r'^candidate/(?P<candidate_id>\d+)/upload/chunked/(?P<upload_id>[0-9a-f-]{36})/(?P<chunk_number>\d+)/$', view=views.candidate_upload_chunk, name='candidate_upload_chunk'),
+        re_path(r'^candidate/(?P<candidate_id>\d+)/upload/chunked/(?P<upload_id>[0-9a-f-]{36})/commit/$', view=views.candidate_upload_chunked_commit, name='candidate_upload_chunked_commit'),
         re_path(r'^candidate/(?P<candidate_id>\d+)/metadata/$', view=views.candidate_metadata, name='candidate_metadata'),
         re_path(r'^candidate/(?P<candidate_id>\d+)/committee/$', view=views.candidate_committee, name='candidate_committee'),
         re_path(r'^candidate/(?P<candidate_id>\d+)/committee/(?P<cm_id>\d+)/remove/$', view=views.candidate_committee_remove, name='candidate_committee_remove'),
@@ -1,5 +1,11 @@
+import hashlib
 import ipaddress
-from typing import List
+from typing import Dict, Iterable, List
+from django.core.files import File
+
+
+#sha1 is Thesis.checksum - the others are stored alongside it
+DIGEST_ALGORITHMS = ('sha1', 'sha256', 'md5')
 
 
 def is_campus_ip(ip_str: str, campus_ips: List[str]) -> bool:
@@ -19,3 +25,22 @@ def is_campus_ip(ip_str: str, campus_ips: List[str]) -> bool:
         elif ip_str == campus_ip:
             return True
     return False
+
+
+def calculate_file_digests(django_file: File, algorithms: Iterable[str] = DIGEST_ALGORITHMS,
+        chunk_size: int = File.DEFAULT_CHUNK_SIZE) -> Dict[str, str]:
+    """
+    Computes several hex digests of a file in one pass, reading it in chunks so
+    only chunk_size bytes of the file are in memory at a time.
+    Args:
+        django_file: A django File (uploaded file, FieldFile, ...). It's rewound afterwards, so it can be saved.
+        algorithms: hashlib algorithm names.
+        chunk_size: The most bytes to read at once.
+    """
+    hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+    for chunk in django_file.chunks(chunk_size=chunk_size):
+        for hasher in hashers.values():
+            hasher.update(chunk)
+    if django_file.seekable():
+        django_file.seek(0)
+    return {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
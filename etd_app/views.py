@@ -1,5 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import logging
-import os
+import re
+import threading
+import time
 import urllib
 import requests
 from django.contrib.auth.decorators import login_required, permission_required
@@ -7,15 +10,23 @@ from django.contrib import messages
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
 from django.urls import reverse
-from django.http import HttpResponse, HttpResponseRedirect, HttpResponsePermanentRedirect, HttpResponseForbidden, JsonResponse, FileResponse, HttpResponseServerError
+from django.http import HttpResponse, HttpResponseRedirect, HttpResponsePermanentRedirect, HttpResponseForbidden, JsonResponse, HttpResponseServerError
 from django.shortcuts import render, get_object_or_404
 from django.utils.http import url_has_allowed_host_and_scheme
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.views.decorators.http import require_http_methods
-from .models import Person, Candidate, Keyword, CommitteeMember
+from . import fast_cache, fast_index, http_client
+from .file_responses import get_file_response
+from .keyword_index import keyword_index
+from .models import Person, Candidate, ChunkedUpload, ChunkedUploadChecksumException, ChunkedUploadException, Keyword, CommitteeMember
+from .pagination import get_keyset_page
+from .single_flight import SingleFlight
+from .upload_handlers import get_checksum_upload_handlers
 from .widgets import ID_VAL_SEPARATOR
 from .utilities import is_campus_ip
 
 BDR_EMAIL = 'bdr@brown.edu'
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
 logger = logging.getLogger('etd')
 
 
@@ -164,8 +175,17 @@ def candidate_home(request, candidate_id=None):
     return render(request, 'etd_app/candidate.html', context_data)
 
 
+@csrf_exempt
 @login_required
 def candidate_upload(request, candidate_id):
+    #the upload handlers have to be swapped in before anything reads request.POST/FILES -
+    #  including the csrf middleware, so csrf is checked on the inner view instead
+    request.upload_handlers = get_checksum_upload_handlers(request)
+    return _candidate_upload(request, candidate_id)
+
+
+@csrf_protect
+def _candidate_upload(request, candidate_id):
     from .forms import UploadForm
     try:
         candidate = _get_candidate(candidate_id=candidate_id, request=request)
@@ -173,16 +193,110 @@ def candidate_upload(request, candidate_id):
         return HttpResponseRedirect(reverse('register'))
     if candidate.thesis.is_locked():
         return HttpResponseForbidden('Thesis has already been submitted and is locked.')
+    chunked_upload_url = reverse('candidate_upload_chunked_start', kwargs={'candidate_id': candidate.id})
     if request.method == 'POST':
-        form = UploadForm(request.POST, request.FILES)
+        form = UploadForm(request.POST, request.FILES, chunked_upload_url=chunked_upload_url)
         if form.is_valid():
             form.save_upload(candidate)
             return HttpResponseRedirect(reverse('candidate_home', kwargs={'candidate_id': candidate.id}))
     else:
-        form = UploadForm()
+        form = UploadForm(chunked_upload_url=chunked_upload_url)
     return render(request, 'etd_app/candidate_upload.html', {'candidate': candidate, 'form': form})
 
 
+def _get_chunked_upload_candidate(request, candidate_id):
+    candidate = get_object_or_404(Candidate, id=candidate_id)
+    if candidate.person.netid != request.user.username:
+        raise PermissionDenied
+    if candidate.thesis.is_locked():
+        raise PermissionDenied('Thesis has already been submitted and is locked.')
+    return candidate
+
+
+def _chunked_upload_status(upload):
+    received_chunks = upload.get_received_chunks()
+    return {
+        'upload_id': str(upload.upload_id),
+        'chunk_size': upload.chunk_size,
+        'num_chunks': upload.num_chunks,
+        'received_chunks': received_chunks,
+        'complete': len(received_chunks) == upload.num_chunks,
+    }
+
+
+@login_required
+@require_http_methods(['POST'])
+def candidate_upload_chunked_start(request, candidate_id):
+    candidate = _get_chunked_upload_candidate(request, candidate_id)
+    file_name = request.POST.get('file_name', '')
+    sha256 = request.POST.get('sha256', '').lower()
+    try:
+        size = int(request.POST.get('size', ''))
+    except ValueError:
+        size = 0
+    if not file_name.endswith('.pdf'):
+        return JsonResponse({'error': 'file must be a PDF'}, status=400)
+    if size <= 0:
+        return JsonResponse({'error': 'invalid file size'}, status=400)
+    if sha256 and not SHA256_RE.match(sha256):
+        return JsonResponse({'error': 'invalid sha256'}, status=400)
+    upload = ChunkedUpload.objects.create(candidate=candidate, file_name=file_name, size=size,
+            chunk_size=settings.CHUNKED_UPLOAD_CHUNK_SIZE, sha256=sha256)
+    return JsonResponse(_chunked_upload_status(upload), status=201)
+
+
+@login_required
+@require_http_methods(['GET'])
+def candidate_upload_chunked_status(request, candidate_id, upload_id):
+    candidate = _get_chunked_upload_candidate(request, candidate_id)
+    upload = get_object_or_404(ChunkedUpload, upload_id=upload_id, candidate=candidate)
+    return JsonResponse(_chunked_upload_status(upload))
+
+
+@login_required
+@require_http_methods(['PUT'])
+def candidate_upload_chunk(request, candidate_id, upload_id, chunk_number):
+    candidate = _get_chunked_upload_candidate(request, candidate_id)
+    upload = get_object_or_404(ChunkedUpload, upload_id=upload_id, candidate=candidate)
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        #read the body as a stream, so a chunk is never all in memory
+        upload.write_chunk(int(chunk_number), request, length)
+    except ChunkedUploadException as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(_chunked_upload_status(upload))
+
+
+@login_required
+@require_http_methods(['POST'])
+def candidate_upload_chunked_commit(request, candidate_id, upload_id):
+    from .forms import UploadForm
+    candidate = _get_chunked_upload_candidate(request, candidate_id)
+    upload = get_object_or_404(ChunkedUpload, upload_id=upload_id, candidate=candidate)
+    #the client hashes the file as it sends the chunks, so the sha256 comes with the commit
+    sha256 = request.POST.get('sha256', '').lower()
+    if not SHA256_RE.match(sha256):
+        return JsonResponse({'error': 'missing or invalid sha256'}, status=400)
+    try:
+        thesis_file = upload.assemble(sha256)
+    except ChunkedUploadChecksumException as e:
+        #some chunk is wrong - start the upload over
+        upload.delete()
+        return JsonResponse({'error': str(e)}, status=400)
+    except ChunkedUploadException as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    #the assembled file goes through the same form & update_thesis_file() as a regular upload
+    form = UploadForm(data={}, files={'thesis_file': thesis_file})
+    if not form.is_valid():
+        thesis_file.close()
+        return JsonResponse({'error': ' '.join(form.errors.get('thesis_file', []))}, status=400)
+    form.save_upload(candidate)
+    #the temp file's been moved into storage - this just tidies up (request.close() does it for regular uploads)
+    thesis_file.close()
+    upload.delete()
+    return JsonResponse({'redirect': reverse('candidate_home', kwargs={'candidate_id': candidate.id})})
+
+
 def _user_keywords_changed(thesis, user_request_keywords):
     db_keywords_info = {}
     for kw in thesis.keywords.all():
@@ -296,11 +410,14 @@ def staff_home(request):
 @login_required
 @permission_required('etd_app.change_candidate', raise_exception=True)
 def staff_view_candidates(request, status):
-    if 'sort_by' in request.GET:
-        candidates = Candidate.get_candidates_by_status(status, sort_param=request.GET['sort_by'])
-    else:
-        candidates = Candidate.get_candidates_by_status(status)
-    return render(request, 'etd_app/staff_view_candidates.html', {'candidates': candidates, 'status': status})
+    sort_by = request.GET.get('sort_by', '')
+    candidates = Candidate.get_candidates_by_status(status, sort_param=sort_by)
+    #the template shows person, department & thesis info for each candidate
+    candidates = candidates.select_related('person', 'department', 'thesis')
+    page = get_keyset_page(candidates, Candidate._get_order_by_field(sort_by),
+            cursor=request.GET.get('after'), page_size=settings.STAFF_CANDIDATES_PAGE_SIZE)
+    context = {'candidates': page, 'page': page, 'status': status, 'sort_by': sort_by}
+    return render(request, 'etd_app/staff_view_candidates.html', context)
 
 
 @login_required
@@ -346,10 +463,10 @@ def view_file(request, candidate_id):
             return HttpResponseForbidden('You don\'t have permission to view this candidate\'s thesis.')
     if not candidate.thesis.current_file_name:
         return HttpResponse('Couldn\'t find a file: please email %s if there should be one.' % BDR_EMAIL)
-    file_path = os.path.join(settings.MEDIA_ROOT, candidate.thesis.current_file_name)
-    response = FileResponse(open(file_path, 'rb'), content_type='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename="%s"' % candidate.thesis.original_file_name
-    return response
+    thesis = candidate.thesis
+    etag = '"%s"' % thesis.checksum if thesis.checksum else None
+    return get_file_response(request, thesis.document.path, content_type='application/pdf', etag=etag,
+            filename=thesis.original_file_name)
 
 
 def _select2_list(search_results):
@@ -360,7 +477,10 @@ def _select2_list(search_results):
 
 
 def _get_previously_used(model, term):
-    keywords = Keyword.search(term=term, order='text')
+    if settings.KEYWORD_MEMORY_INDEX:
+        keywords = keyword_index.search(term, limit=settings.KEYWORD_SEARCH_LIMIT)
+    else:
+        keywords = Keyword.search(term=term, order='text', limit=settings.KEYWORD_SEARCH_LIMIT, prefix_first=True)
     if len(keywords) > 0:
         return [{'text': 'Previously Used', 'children': _select2_list(keywords)}]
     else:
@@ -391,18 +511,38 @@ def _fast_results_to_select2_list(fast_results, index):
     return results
 
 
-def _get_fast_results(term, index='suggestall'):
-    error_response = [{'text': 'FAST results', 'children': [{'id': '', 'text': 'Error retrieving FAST results.'}]}]
+def _get_fast_error_response():
+    return [{'text': 'FAST results', 'children': [{'id': '', 'text': 'Error retrieving FAST results.'}]}]
+
+
+def _search_local_fast_index(term, index='suggestall'):
+    '''FAST results from the local index, or None if there isn't one (or it's broken). These
+    don't go in the FAST cache - the index is already local, and rebuilding it should show up
+    right away.'''
+    if not settings.FAST_LOCAL_INDEX_PATH:
+        return None
+    try:
+        docs = fast_index.search(settings.FAST_LOCAL_INDEX_PATH, term, index, limit=settings.FAST_LOCAL_INDEX_LIMIT)
+    except fast_index.FastIndexError as e:
+        logger.error('local fast index - falling back to the api: %s' % e)
+        return None
+    select2_results = _fast_results_to_select2_list(docs, index)
+    return [{'text': 'FAST results', 'children': select2_results}] if select2_results else []
+
+
+def _fetch_fast_results(term, index='suggestall'):
+    '''Just the FAST http lookup - returns None on errors. It doesn't touch the db (or the
+    db-backed cache), so it can run in a worker thread.'''
     url = _build_fast_url(term, index)
     try:
-        r = requests.get(url, timeout=2)
+        r = http_client.get('fast', url)
     except requests.exceptions.Timeout:
         logger.error('fast lookup timed out')
-        return error_response
+        return None
     except Exception:
         import traceback
         logger.error('fast lookup exception: %s' % traceback.format_exc())
-        return error_response
+        return None
     try:
         select2_results = _fast_results_to_select2_list(r.json()['response']['docs'], index)
         if select2_results:
@@ -412,12 +552,71 @@ def _get_fast_results(term, index='suggestall'):
     except Exception as e:
         logger.error('fast data exception: %s' % e)
         logger.error('fast response: %s - %s' % (r.status_code, r.text))
-        return error_response
+        return None
+
+
+def _get_fast_results(term, index='suggestall'):
+    local_results = _search_local_fast_index(term, index)
+    if local_results is not None:
+        return local_results
+    cached_results = fast_cache.get_results(term, index)
+    if cached_results is not None:
+        return cached_results
+    results = _submit_fast_lookup(term, index).result()
+    if results is None:
+        #errors aren't cached, so the next request tries again
+        return _get_fast_error_response()
+    fast_cache.set_results(term, index, results)
+    return results
+
+
+_fast_executor = None
+_fast_executor_lock = threading.Lock()
+
+
+def _get_fast_executor():
+    global _fast_executor
+    with _fast_executor_lock:
+        if _fast_executor is None:
+            _fast_executor = ThreadPoolExecutor(max_workers=settings.FAST_LOOKUP_MAX_WORKERS, thread_name_prefix='fast-lookup')
+        return _fast_executor
+
+
+_fast_lookups = SingleFlight()
+
+
+def _submit_fast_lookup(term, index):
+    '''Look up the term in FAST on the worker threads - if the same lookup is already running
+    (for another request), share its result instead of sending another request.'''
+    key = (fast_cache.normalize_term(term), index)
+    return _fast_lookups.submit(_get_fast_executor(), key, _fetch_fast_results, term, index)
 
 
 @login_required
 def autocomplete_keywords(request):
+    #the FAST http request runs in a worker thread while we search our own keywords; the
+    #  cache lookups stay in this thread, since they use the db
+    started = time.monotonic()
     term = request.GET['term']
+    index = 'suggestall'
+    #a local FAST index answers right away, and skips the cache
+    fast_results = _search_local_fast_index(term, index)
+    if fast_results is None:
+        fast_results = fast_cache.get_results(term, index)
+    fast_future = None
+    if fast_results is None:
+        fast_future = _submit_fast_lookup(term, index)
     results = _get_previously_used(Keyword, term)
-    results.extend(_get_fast_results(term))
+    if fast_future:
+        time_left = settings.AUTOCOMPLETE_LATENCY_BUDGET - (time.monotonic() - started)
+        try:
+            fast_results = fast_future.result(timeout=max(time_left, 0))
+        except FutureTimeoutError:
+            logger.warning('fast lookup over the autocomplete latency budget')
+            fast_results = None
+        if fast_results is None:
+            fast_results = _get_fast_error_response()
+        else:
+            fast_cache.set_results(term, index, fast_results)
+    results.extend(fast_results)
     return JsonResponse({'err': 'nil', 'results': results})
@@ -1,7 +1,10 @@
+from unittest.mock import patch
 from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from etd_app.models import Thesis
+from etd_app.models import IngestJob, Thesis
 from tests.test_views import CandidateCreator
 from tests.test_models import LAST_NAME, complete_gradschool_checklist, CURRENT_YEAR
 
@@ -50,6 +53,34 @@ class TestThesisAdmin(CandidateCreator, TestCase):
         thesis = Thesis.objects.all()[0]
         self.assertEqual(thesis.status, Thesis.STATUS_CHOICES.not_submitted)
 
+    def test_ingest_action(self):
+        setup_user()
+        setup_thesis(self, status=Thesis.STATUS_CHOICES.accepted)
+        complete_gradschool_checklist(self.candidate)
+        url = reverse('admin:etd_app_thesis_changelist')
+        post_data = {'_selected_action': [str(self.candidate.thesis.id)], 'action': 'ingest'}
+        with patch('etd_app.ingestion.ThesisIngester.post_to_api') as post_to_api:
+            r = self.client.post(url, post_data, follow=True, **{
+                            'Shibboleth-eppn': 'staff@brown.edu',
+                            'REMOTE_USER': 'staff@brown.edu'})
+        #the request only queues the ingest
+        post_to_api.assert_not_called()
+        self.assertContains(r, 'Queued 1 theses for ingestion.')
+        job = IngestJob.objects.get()
+        self.assertEqual((job.thesis_id, job.status), (self.candidate.thesis.id, IngestJob.STATUS_CHOICES.queued))
+        self.assertEqual(Thesis.objects.get(id=self.candidate.thesis.id).status, Thesis.STATUS_CHOICES.accepted)
+
+    def test_ingest_action_not_ready(self):
+        setup_user()
+        setup_thesis(self, status=Thesis.STATUS_CHOICES.pending)
+        url = reverse('admin:etd_app_thesis_changelist')
+        post_data = {'_selected_action': [str(self.candidate.thesis.id)], 'action': 'ingest'}
+        r = self.client.post(url, post_data, follow=True, **{
+                        'Shibboleth-eppn': 'staff@brown.edu',
+                        'REMOTE_USER': 'staff@brown.edu'})
+        self.assertContains(r, f'Thesis {self.candidate.thesis.id} is not ready to ingest.')
+        self.assertEqual(IngestJob.objects.count(), 0)
+
     def test_changelist_search(self):
         setup_user()
         setup_thesis(self)
@@ -106,6 +137,61 @@ class TestThesisAdmin(CandidateCreator, TestCase):
         self.assertContains(r, THESIS_TITLE)
         self.assertNotContains(r, second_title)
 
+    def test_ready_to_ingest_filter_no(self):
+        setup_user()
+        setup_thesis(self, status=Thesis.STATUS_CHOICES.accepted)
+        complete_gradschool_checklist(self.candidate)
+        #accepted, but the paperwork isn't done (so eligible_for_ingest_on is null)
+        second_title = 'another title'
+        candidate2 = self._create_additional_candidate(thesis_title=second_title)
+        candidate2.thesis.status = Thesis.STATUS_CHOICES.accepted
+        candidate2.thesis.save()
+        #paperwork done, but not accepted
+        third_title = 'third title'
+        person = self._create_person(netid='third@brown.edu', email='third@brown.edu')
+        candidate3 = self._create_additional_candidate(person=person, thesis_title=third_title)
+        complete_gradschool_checklist(candidate3)
+        url = reverse('admin:etd_app_thesis_changelist')
+        r = self.client.get(f'{url}?ready_to_ingest=no', follow=True, **{
+                        'Shibboleth-eppn': 'staff@brown.edu',
+                        'REMOTE_USER': 'staff@brown.edu'})
+        self.assertNotContains(r, THESIS_TITLE)
+        self.assertContains(r, second_title)
+        self.assertContains(r, third_title)
+        #combined with search
+        r = self.client.get(f'{url}?ready_to_ingest=no&q=third', follow=True, **{
+                        'Shibboleth-eppn': 'staff@brown.edu',
+                        'REMOTE_USER': 'staff@brown.edu'})
+        self.assertNotContains(r, second_title)
+        self.assertContains(r, third_title)
+
+    def _get_changelist_query_count(self, query_string):
+        url = reverse('admin:etd_app_thesis_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            r = self.client.get(f'{url}?{query_string}', **{
+                            'Shibboleth-eppn': 'staff@brown.edu',
+                            'REMOTE_USER': 'staff@brown.edu'})
+        self.assertEqual(r.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries(self):
+        #the number of queries doesn't grow with the number of theses on the page
+        setup_user()
+        setup_thesis(self, status=Thesis.STATUS_CHOICES.accepted)
+        complete_gradschool_checklist(self.candidate)
+        #the first request logs the user in
+        self._get_changelist_query_count('')
+        query_strings = ['', 'ready_to_ingest=yes', 'ready_to_ingest=no', 'ready_to_ingest=no&q=user']
+        query_counts = [self._get_changelist_query_count(query_string) for query_string in query_strings]
+        for i in range(10):
+            person = self._create_person(netid=f'user{i}@school.edu', email=f'user{i}@school.edu')
+            candidate = self._create_additional_candidate(person=person, thesis_title=f'title {i}')
+            if i % 2:
+                candidate.thesis.status = Thesis.STATUS_CHOICES.accepted
+                candidate.thesis.save()
+                complete_gradschool_checklist(candidate)
+        self.assertEqual([self._get_changelist_query_count(query_string) for query_string in query_strings], query_counts)
+
     def test_ready_to_ingest_filter_large_list(self):
         setup_user()
         setup_thesis(self, status=Thesis.STATUS_CHOICES.accepted)
@@ -0,0 +1,29 @@
+from django.test import TestCase
+from etd_app import fast_cache
+from etd_app.cache_backends import LruDatabaseCache
+
+
+class TestLruDatabaseCache(TestCase):
+
+    def test_cull_least_recently_used(self):
+        cache = LruDatabaseCache('etd_fast_cache', {'TIMEOUT': 100, 'OPTIONS': {'MAX_ENTRIES': 3, 'CULL_FREQUENCY': 3}})
+        #(expires is stored to the second - a longer timeout stands in for a later set/touch)
+        cache.set('a', 'a', 100)
+        cache.set('b', 'b', 110)
+        cache.set('c', 'c', 120)
+        cache.touch('a', 130)
+        cache.set('d', 'd', 140)
+        #over MAX_ENTRIES - 'b' was used longest ago, where the default db cache would cull 'a' (the first cache_key)
+        cache.set('e', 'e', 150)
+        self.assertEqual(cache.get_many(['a', 'b', 'c', 'd', 'e']), {'a': 'a', 'c': 'c', 'd': 'd', 'e': 'e'})
+
+    def test_cull_keeps_fast_cache_stats(self):
+        fast_cache.reset_stats()
+        fast_cache.set_results('python', 'suggestall', [])
+        fast_cache.get_results('python', 'suggestall')
+        #CULL_FREQUENCY 0 clears the whole table - the hit/miss counts aren't in it
+        cache = LruDatabaseCache('etd_fast_cache', {'TIMEOUT': 100, 'OPTIONS': {'MAX_ENTRIES': 1, 'CULL_FREQUENCY': 0}})
+        cache.set('a', 'a')
+        cache.set('b', 'b')
+        self.assertIsNone(fast_cache.get_results('python', 'suggestall'))
+        self.assertEqual(fast_cache.get_stats(), {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
@@ -0,0 +1,84 @@
+import os
+import tempfile
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase
+import responses
+from etd_app import fast_cache, fast_index
+from etd_app.views import _get_fast_results, _fast_results_to_select2_list
+from etd_app.widgets import ID_VAL_SEPARATOR
+from tests.test_models import CUR_DIR
+
+
+SAMPLE_PATH = os.path.join(CUR_DIR, 'test_files', 'fast_sample.xml')
+
+
+class TestFastIndex(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.index_path = os.path.join(self.tmp_dir.name, 'fast.sqlite3')
+        out = StringIO()
+        call_command('import_fast_subjects', SAMPLE_PATH, '--index-path', self.index_path, stdout=out)
+        self.assertIn('Indexed 5 FAST headings', out.getvalue())
+
+    def _select2(self, term, index='suggestall'):
+        return _fast_results_to_select2_list(fast_index.search(self.index_path, term, index), index)
+
+    def test_marcxml_headings(self):
+        headings = {h.idroot: h for h in fast_index.read_marcxml(SAMPLE_PATH)}
+        self.assertEqual(sorted(headings), ['fst00530439', 'fst01026727', 'fst01084736', 'fst01084738', 'fst01204155'])
+        self.assertEqual(headings['fst00530439'].auth, 'Monty Python (Comedy troupe)')
+        self.assertEqual(headings['fst00530439'].facet, '10')
+        self.assertEqual(headings['fst00530439'].alt_labels, ['Pythons (Comedy troupe)'])
+        self.assertEqual(headings['fst01204155'].auth, 'Brazil--Pará (State)')
+        self.assertEqual(headings['fst01084738'].alt_labels, ['Pythonidae', 'Pythoninae'])
+
+    def test_search(self):
+        results = self._select2('python')
+        self.assertIn({'id': 'fst01084736%sPython (Computer program language)' % ID_VAL_SEPARATOR,
+                'text': 'Python (Computer program language)'}, results)
+        #authorized headings come before alternate label matches
+        self.assertEqual(results[-1]['text'], 'Mosasauridae (Pythonomorpha)')
+        texts = [r['text'] for r in results]
+        #one result per heading, with the alternate label that matched for alt-only matches
+        self.assertEqual(sorted(texts), ['Monty Python (Comedy troupe)', 'Mosasauridae (Pythonomorpha)',
+                'Python (Computer program language)', 'Pythons'])
+        self.assertEqual(self._select2('monty pyth')[0]['text'], 'Monty Python (Comedy troupe)')
+        self.assertEqual(self._select2('para state')[0]['text'], 'Brazil--Pará (State)')
+        self.assertEqual(self._select2('"'), [])
+        self.assertEqual(self._select2('nothing'), [])
+
+    def test_search_limit(self):
+        #alternate labels only fill in after the authorized headings
+        self.assertEqual([doc['type'] for doc in fast_index.search(self.index_path, 'python', limit=3)], ['auth', 'auth', 'auth'])
+        self.assertEqual([doc['type'] for doc in fast_index.search(self.index_path, 'python', limit=4)], ['auth', 'auth', 'auth', 'alt'])
+        self.assertEqual(len(fast_index.search(self.index_path, 'python', limit=1)), 1)
+
+    def test_search_facet(self):
+        self.assertEqual([r['text'] for r in self._select2('python', index='suggest10')], ['Monty Python (Comedy troupe)'])
+
+    def test_csv(self):
+        csv_path = os.path.join(self.tmp_dir.name, 'fast.csv')
+        with open(csv_path, 'w', encoding='utf8') as f:
+            f.write('idroot,auth,facet,alt_labels\nfst01084738,Pythons,50,Pythonidae|Pythoninae\n')
+        call_command('import_fast_subjects', csv_path, '--index-path', self.index_path, stdout=StringIO())
+        self.assertEqual([r['text'] for r in self._select2('pythoni')], ['Pythons (Pythonidae)'])
+
+    @responses.activate
+    def test_get_fast_results_local(self):
+        #no responses registered, so any call to the FAST api would fail
+        with self.settings(FAST_LOCAL_INDEX_PATH=self.index_path):
+            results = _get_fast_results('mosasaur')
+        self.assertEqual(results, [{'text': 'FAST results', 'children': [
+                {'id': 'fst01026727%sMosasauridae' % ID_VAL_SEPARATOR, 'text': 'Mosasauridae'}]}])
+        self.assertEqual(len(responses.calls), 0)
+        #nothing went through the FAST cache, so a rebuilt index shows up right away
+        self.assertIsNone(fast_cache.get_results('mosasaur', 'suggestall'))
+        csv_path = os.path.join(self.tmp_dir.name, 'fast.csv')
+        with open(csv_path, 'w', encoding='utf8') as f:
+            f.write('idroot,auth\nfst01026728,Mosasaurs\n')
+        call_command('import_fast_subjects', csv_path, '--index-path', self.index_path, stdout=StringIO())
+        with self.settings(FAST_LOCAL_INDEX_PATH=self.index_path):
+            self.assertEqual(_get_fast_results('mosasaur')[0]['children'][0]['text'], 'Mosasaurs')
@@ -0,0 +1,44 @@
+from unittest.mock import patch
+from django.test import SimpleTestCase
+import requests
+import responses
+from etd_app import http_client
+
+
+class TestHttpClient(SimpleTestCase):
+
+    def setUp(self):
+        http_client.close_sessions()
+        self.addCleanup(http_client.close_sessions)
+
+    def test_sessions_per_endpoint_and_host(self):
+        session = http_client.get_session('fast', 'http://fast.oclc.org/searchfast/fastsuggest?query=a')
+        self.assertIs(http_client.get_session('fast', 'http://fast.oclc.org/other'), session)
+        self.assertIsNot(http_client.get_session('fast', 'https://fast.oclc.org/other'), session)
+        self.assertIsNot(http_client.get_session('fast', 'http://example.org/'), session)
+        self.assertIsNot(http_client.get_session('bdr_api', 'http://fast.oclc.org/'), session)
+
+    def test_adapter_settings(self):
+        endpoints = {'test': {'pool_maxsize': 3, 'retries': 4}}
+        with self.settings(HTTP_CLIENT_ENDPOINTS=endpoints):
+            adapter = http_client.get_session('test', 'https://example.org/').get_adapter('https://example.org/')
+        self.assertEqual(adapter._pool_maxsize, 3)
+        self.assertEqual(adapter.max_retries.total, 4)
+        self.assertEqual(adapter.max_retries.allowed_methods, ['GET', 'HEAD'])
+
+    def test_timeouts(self):
+        endpoints = {'test': {'timeout': 7}}
+        with self.settings(HTTP_CLIENT_ENDPOINTS=endpoints):
+            with patch.object(requests.Session, 'request') as mock_request:
+                http_client.get('test', 'http://example.org/')
+                self.assertEqual(mock_request.call_args.kwargs['timeout'], 7)
+                http_client.post('test', 'http://example.org/', timeout=1)
+                self.assertEqual(mock_request.call_args.kwargs['timeout'], 1)
+                http_client.get('other', 'http://example.org/')
+                self.assertEqual(mock_request.call_args.kwargs['timeout'], (3.05, 30))
+
+    @responses.activate
+    def test_request(self):
+        responses.add(responses.GET, 'http://example.org/', json={'ok': True})
+        r = http_client.get('test', 'http://example.org/')
+        self.assertEqual(r.json(), {'ok': True})
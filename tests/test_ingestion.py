@@ -1,12 +1,25 @@
+from contextlib import contextmanager, redirect_stdout
 import datetime
+from io import StringIO
 import json
-from django.test import TestCase
+import os
+import threading
+from unittest.mock import patch
+from django.core.files import File
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.utils import timezone
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError
 
+from etd_app import ingestion
 from etd_app.mods_mapper import ModsMapper
-from etd_app.ingestion import ThesisIngester, find_theses_to_ingest
-from etd_app.models import Keyword, Degree, Person, Candidate, Thesis
-from tests.test_models import LAST_NAME, FIRST_NAME, CURRENT_YEAR, add_metadata_to_thesis, complete_gradschool_checklist
+from etd_app.ingestion import (IngestException, RetryableIngestException, ThesisIngester, enqueue_theses,
+        find_theses_to_ingest, ingest_batch_of_theses, run_ingest_job, run_ingest_workers)
+from etd_app.models import Keyword, Degree, Person, Candidate, Thesis, IngestJob
+from tests.test_models import (LAST_NAME, FIRST_NAME, CURRENT_YEAR, CUR_DIR, TEST_PDF_FILENAME, add_metadata_to_thesis,
+        complete_gradschool_checklist)
 from tests.test_views import CandidateCreator
 
 
@@ -102,6 +115,45 @@ class TestIngestion(TestCase, CandidateCreator):
         self.assertEqual(len(theses), 2)
         self.assertEqual(theses[0].title, 'Another title')
 
+    def _add_ready_thesis(self, i):
+        person = Person.objects.create(netid=f'p{i}@brown.edu', last_name=f'p{i}', email=f'p{i}@brown.edu')
+        candidate = Candidate.objects.create(person=person, year=CURRENT_YEAR, department=self.dept, degree=self.degree)
+        candidate.committee_members.add(self.committee_member)
+        candidate.committee_members.add(self.committee_member2)
+        candidate.thesis.abstract = 'test abstract'
+        candidate.thesis.keywords.add(Keyword.objects.get_or_create(text='keyword')[0])
+        candidate.thesis.keywords.add(Keyword.objects.create(text=f'keyword {i}'))
+        self._complete_thesis(candidate.thesis, title=f'title {i}')
+
+    def _get_params_for_batch(self):
+        return [ThesisIngester(thesis).get_ingest_params() for thesis in find_theses_to_ingest() if thesis.ready_to_ingest()]
+
+    def test_find_theses_to_ingest_queries(self):
+        #everything the ingest reads comes with the theses - the query count doesn't depend on the batch size
+        self._create_candidate()
+        self._add_ready_thesis(1)
+        with self.assertNumQueries(3):
+            params = self._get_params_for_batch()
+        self.assertEqual(len(params), 1)
+        for i in range(2, 6):
+            self._add_ready_thesis(i)
+        with self.assertNumQueries(3):
+            params = self._get_params_for_batch()
+        self.assertEqual(len(params), 5)
+        mods = json.loads(params[0]['mods'])['xml_data']
+        self.assertIn('Brown University. Department of Engineering', mods)
+        self.assertIn('<mods:topic>keyword</mods:topic>', mods)
+        #queueing them is constant too
+        theses = list(find_theses_to_ingest())
+        with self.assertNumQueries(2):
+            jobs, not_ready = enqueue_theses(theses)
+        self.assertEqual((len(jobs), not_ready), (5, []))
+        #already queued - nothing to insert
+        with self.assertNumQueries(1):
+            jobs, not_ready = enqueue_theses(theses)
+        self.assertEqual(len(jobs), 5)
+        self.assertEqual(IngestJob.objects.count(), 5)
+
     def test_status(self):
         self._create_candidate()
         with self.assertRaises(Exception) as cm:
@@ -166,3 +218,350 @@ class TestIngestion(TestCase, CandidateCreator):
         self.assertEqual(list(rights_parameters['parameters'].keys()), ['owner_id'])
         rels_param = json.loads(params['rels'])
         self.assertTrue('%s-06-01' % (CURRENT_YEAR+1) in rels_param['embargo_end'])
+
+
+class FakeResponse:
+
+    def __init__(self, status_code, json_data=None, headers=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self._json_data = json_data
+        self.headers = headers or {}
+        self.text = json.dumps(json_data)
+
+    def json(self):
+        return self._json_data
+
+
+@override_settings(INGEST_RETRIES=2, INGEST_RETRY_BACKOFF=1, INGEST_RETRY_MAX_BACKOFF=10, INGEST_LOOKUP_URL=None)
+class TestIngestRetries(TestCase, CandidateCreator):
+
+    def setUp(self):
+        self._create_candidate()
+        thesis = self.candidate.thesis
+        with open(os.path.join(CUR_DIR, 'test_files', TEST_PDF_FILENAME), 'rb') as f:
+            thesis.document = File(f, name=TEST_PDF_FILENAME)
+            thesis.title = 'Some title'
+            thesis.status = 'accepted'
+            thesis.save()
+        complete_gradschool_checklist(self.candidate)
+        self.thesis = Thesis.objects.get(id=thesis.id)
+        self.ingester = ThesisIngester(self.thesis)
+
+    def test_idempotency_key(self):
+        self.assertEqual(self.ingester.get_idempotency_key(), f'etd-{self.thesis.id}-{self.thesis.checksum}')
+
+    def test_post_to_api(self):
+        with patch('etd_app.ingestion.http_client.post', return_value=FakeResponse(200, {'pid': 'test:1'})) as post:
+            self.assertEqual(self.ingester.post_to_api({'identity': 'x'}), 'test:1')
+        self.assertEqual(post.call_args[1]['headers']['Idempotency-Key'], self.ingester.get_idempotency_key())
+        with patch('etd_app.ingestion.http_client.post', return_value=FakeResponse(429, {}, headers={'Retry-After': '7'})):
+            with self.assertRaises(RetryableIngestException) as cm:
+                self.ingester.post_to_api({})
+        self.assertEqual(cm.exception.retry_after, 7)
+        refused = MaxRetryError(None, '/api/', reason=NewConnectionError(None, 'refused'))
+        with patch('etd_app.ingestion.http_client.post', side_effect=requests.ConnectionError(refused)):
+            with self.assertRaises(RetryableIngestException):
+                self.ingester.post_to_api({})
+        with patch('etd_app.ingestion.http_client.post', side_effect=requests.ConnectTimeout('connect timeout')):
+            with self.assertRaises(RetryableIngestException):
+                self.ingester.post_to_api({})
+        with patch('etd_app.ingestion.http_client.post', return_value=FakeResponse(400, {'error': 'bad params'})):
+            with self.assertRaises(IngestException) as cm:
+                self.ingester.post_to_api({})
+        self.assertFalse(isinstance(cm.exception, RetryableIngestException))
+
+    def test_post_file_name(self):
+        #the document is stored under its hash, but it's posted with the uploaded file name
+        self.assertTrue(self.thesis.document.storage.is_blob(self.thesis.document.name))
+        with patch('etd_app.ingestion.http_client.post', return_value=FakeResponse(200, {'pid': 'test:1'})) as post:
+            self.ingester.post_to_api({})
+        body = b''.join(post.call_args[1]['data'])
+        file_name = self.thesis.current_file_name
+        self.assertEqual(file_name, TEST_PDF_FILENAME)
+        self.assertIn(('Content-Disposition: form-data; name="%s"; filename="%s"' % (file_name, file_name)).encode('utf8'), body)
+        self.assertNotIn(os.path.basename(self.thesis.document.name).encode('utf8'), body)
+
+    def test_ambiguous_failures_not_retried(self):
+        #the post may have gone through, and there's no way to check - so don't send it again
+        for side_effect in [requests.ReadTimeout('read timeout'), requests.ConnectionError('connection reset'),
+                            FakeResponse(503, {}), FakeResponse(500, {})]:
+            with patch('etd_app.ingestion.http_client.post', side_effect=[side_effect]):
+                with self.assertRaises(IngestException) as cm:
+                    self.ingester.post_to_api({})
+            self.assertFalse(isinstance(cm.exception, RetryableIngestException))
+        with patch('etd_app.ingestion.http_client.post', side_effect=requests.ReadTimeout('read timeout')) as post:
+            with patch('etd_app.ingestion.time.sleep') as sleep:
+                with self.assertRaises(IngestException):
+                    self.ingester.ingest()
+        self.assertEqual(post.call_count, 1)
+        sleep.assert_not_called()
+        self.assertEqual(Thesis.objects.get(id=self.thesis.id).status, Thesis.STATUS_CHOICES.ingest_error)
+
+    @override_settings(INGEST_LOOKUP_URL='http://localhost/api/items/?idempotency_key={key}')
+    def test_ambiguous_failures_retried_with_lookup(self):
+        with patch('etd_app.ingestion.http_client.post', side_effect=requests.ReadTimeout('read timeout')):
+            with self.assertRaises(RetryableIngestException):
+                self.ingester.post_to_api({})
+        with patch('etd_app.ingestion.http_client.post', return_value=FakeResponse(503, {}, headers={'Retry-After': '7'})):
+            with self.assertRaises(RetryableIngestException) as cm:
+                self.ingester.post_to_api({})
+        self.assertEqual(cm.exception.retry_after, 7)
+
+    def test_retry_then_succeed(self):
+        side_effect = [RetryableIngestException('503'), RetryableIngestException('timeout'), 'test:1']
+        with patch.object(ThesisIngester, 'post_to_api', side_effect=side_effect) as post_to_api:
+            with patch('etd_app.ingestion.time.sleep') as sleep:
+                self.assertEqual(self.ingester.ingest(), 'test:1')
+        self.assertEqual(post_to_api.call_count, 3)
+        #backoff with jitter - at most 1s, then at most 2s
+        delays = [c[0][0] for c in sleep.call_args_list]
+        self.assertEqual(len(delays), 2)
+        self.assertTrue(0 <= delays[0] <= 1)
+        self.assertTrue(0 <= delays[1] <= 2)
+        thesis = Thesis.objects.get(id=self.thesis.id)
+        self.assertEqual((thesis.status, thesis.pid), (Thesis.STATUS_CHOICES.ingested, 'test:1'))
+
+    def test_retry_after(self):
+        with patch.object(ThesisIngester, 'post_to_api', side_effect=[RetryableIngestException('429', retry_after=30), 'test:1']):
+            with patch('etd_app.ingestion.time.sleep') as sleep:
+                self.ingester.ingest()
+        #capped at INGEST_RETRY_MAX_BACKOFF
+        sleep.assert_called_once_with(10)
+
+    def test_retries_exhausted(self):
+        with patch.object(ThesisIngester, 'post_to_api', side_effect=RetryableIngestException('503')) as post_to_api:
+            with patch('etd_app.ingestion.time.sleep'):
+                with self.assertRaises(RetryableIngestException):
+                    self.ingester.ingest()
+        self.assertEqual(post_to_api.call_count, 3)
+        self.assertEqual(Thesis.objects.get(id=self.thesis.id).status, Thesis.STATUS_CHOICES.ingest_error)
+
+    def test_retry_renews_job_lease(self):
+        IngestJob.enqueue(self.thesis)
+        job = IngestJob.claim_next('worker 1', lease_seconds=60)
+        ingester = ThesisIngester(self.thesis, job=job)
+        with patch.object(ThesisIngester, 'post_to_api', side_effect=[RetryableIngestException('429'), 'test:1']):
+            with patch('etd_app.ingestion.time.sleep'):
+                self.assertEqual(ingester.ingest(), 'test:1')
+        self.assertTrue(IngestJob.objects.get(id=job.id).lease_expires > timezone.now() + datetime.timedelta(seconds=60 * 60))
+
+    def test_retry_stops_when_job_lost(self):
+        IngestJob.enqueue(self.thesis)
+        job = IngestJob.claim_next('worker 1')
+        #worker 1's lease ran out during the first post, and worker 2 has the job now
+        IngestJob.objects.filter(id=job.id).update(lease_expires=timezone.now() - datetime.timedelta(seconds=1))
+        IngestJob.claim_next('worker 2')
+        with patch.object(ThesisIngester, 'post_to_api', side_effect=[RetryableIngestException('429'), 'test:1']) as post_to_api:
+            with patch('etd_app.ingestion.time.sleep'):
+                self.assertFalse(run_ingest_job(job))
+        self.assertEqual(post_to_api.call_count, 1)
+        #worker 2 is still ingesting it
+        self.assertEqual(Thesis.objects.get(id=self.thesis.id).status, Thesis.STATUS_CHOICES.accepted)
+        job = IngestJob.objects.get(id=job.id)
+        self.assertEqual((job.status, job.claimed_by), (IngestJob.STATUS_CHOICES.running, 'worker 2'))
+
+    @override_settings(INGEST_LOOKUP_URL='http://localhost/api/items/?idempotency_key={key}')
+    def test_reclaimed_job_checks_for_existing_item(self):
+        IngestJob.enqueue(self.thesis)
+        IngestJob.claim_next('worker 1')
+        IngestJob.objects.update(lease_expires=timezone.now() - datetime.timedelta(seconds=1))
+        job = IngestJob.claim_next('worker 2')
+        with patch('etd_app.ingestion.http_client.get', return_value=FakeResponse(200, {'pid': 'test:1'})):
+            with patch.object(ThesisIngester, 'post_to_api') as post_to_api:
+                self.assertTrue(run_ingest_job(job))
+        post_to_api.assert_not_called()
+        self.assertEqual(IngestJob.objects.get(id=job.id).pid, 'test:1')
+        self.assertEqual(Thesis.objects.get(id=self.thesis.id).pid, 'test:1')
+
+    def test_not_retryable(self):
+        with patch.object(ThesisIngester, 'post_to_api', side_effect=IngestException('400')) as post_to_api:
+            with patch('etd_app.ingestion.time.sleep') as sleep:
+                with self.assertRaises(IngestException):
+                    self.ingester.ingest()
+        self.assertEqual(post_to_api.call_count, 1)
+        sleep.assert_not_called()
+
+    @override_settings(INGEST_LOOKUP_URL='http://localhost/api/items/?idempotency_key={key}')
+    def test_retried_post_already_succeeded(self):
+        #the first post timed out, but the item was created - don't post it again
+        with patch.object(ThesisIngester, 'post_to_api', side_effect=[RetryableIngestException('timeout'), 'test:2']) as post_to_api:
+            with patch('etd_app.ingestion.http_client.get', return_value=FakeResponse(200, {'pid': 'test:1'})) as get:
+                with patch('etd_app.ingestion.time.sleep'):
+                    self.assertEqual(self.ingester.ingest(), 'test:1')
+        self.assertEqual(post_to_api.call_count, 1)
+        self.assertEqual(get.call_args[0][1], f'http://localhost/api/items/?idempotency_key=etd-{self.thesis.id}-{self.thesis.checksum}')
+        self.assertEqual(Thesis.objects.get(id=self.thesis.id).pid, 'test:1')
+
+    @override_settings(INGEST_LOOKUP_URL='http://localhost/api/items/?idempotency_key={key}')
+    def test_retried_post_not_found(self):
+        with patch.object(ThesisIngester, 'post_to_api', side_effect=[RetryableIngestException('timeout'), 'test:2']) as post_to_api:
+            with patch('etd_app.ingestion.http_client.get', return_value=FakeResponse(404, {})):
+                with patch('etd_app.ingestion.time.sleep'):
+                    self.assertEqual(self.ingester.ingest(), 'test:2')
+        self.assertEqual(post_to_api.call_count, 2)
+
+
+class TestBatchIngestion(TransactionTestCase, CandidateCreator):
+
+    def _create_theses_to_ingest(self):
+        self._create_candidate()
+        candidates = [self.candidate]
+        for i in range(3):
+            person = Person.objects.create(netid='p%s@brown.edu' % i, last_name='p%s' % i, email='p%s@brown.edu' % i)
+            candidates.append(Candidate.objects.create(person=person, year=CURRENT_YEAR, department=self.dept, degree=self.degree))
+        for i, candidate in enumerate(candidates):
+            thesis = candidate.thesis
+            thesis.title = 'bad title' if i == 1 else 'title %s' % i
+            thesis.status = 'accepted'
+            thesis.save()
+            complete_gradschool_checklist(candidate)
+        return [c.thesis for c in candidates]
+
+    def _post_to_api(self, ingester, params):
+        if ingester.thesis.title == 'bad title':
+            raise IngestException('api error')
+        return 'test:%s' % ingester.thesis.id
+
+    @contextmanager
+    def _serialize_db_access(self):
+        #the sqlite in-memory test db locks whole tables (and doesn't wait for them), so the worker
+        #  threads take turns with the db here - on mysql they run at the same time
+        lock = threading.Lock()
+
+        def _locked(func):
+            def _wrapper(*args, **kwargs):
+                with lock:
+                    return func(*args, **kwargs)
+            return _wrapper
+
+        with patch.object(IngestJob, 'claim_next', _locked(IngestJob.claim_next)):
+            with patch('etd_app.ingestion.run_ingest_job', _locked(ingestion.run_ingest_job)):
+                yield
+
+    def _check_batch(self, workers):
+        theses = self._create_theses_to_ingest()
+        with redirect_stdout(StringIO()) as out:
+            jobs = ingest_batch_of_theses()
+        #the batch just queues the theses
+        self.assertIn('Queued 4 theses/dissertations for ingestion.', out.getvalue())
+        self.assertEqual(sorted(job.thesis_id for job in jobs), sorted(t.id for t in theses))
+        self.assertEqual(Thesis.objects.filter(status=Thesis.STATUS_CHOICES.accepted).count(), 4)
+        with patch.object(ThesisIngester, 'post_to_api', autospec=True, side_effect=self._post_to_api), self._serialize_db_access():
+            with redirect_stdout(StringIO()) as out:
+                succeeded, failed = run_ingest_workers(workers=workers, name='test')
+        #one failure doesn't stop the rest
+        self.assertEqual(sorted(job.pid for job in succeeded), sorted('test:%s' % t.id for t in theses if t.title != 'bad title'))
+        self.assertEqual([(job.thesis.title, job.last_error) for job in failed], [('bad title', 'api error')])
+        self.assertIn('Ingested 3, failed 1.', out.getvalue())
+        for thesis in Thesis.objects.all():
+            job = thesis.ingest_jobs.get()
+            self.assertEqual(job.attempts, 1)
+            self.assertTrue(job.claimed_by.startswith('test'))
+            self.assertTrue(job.started <= job.finished)
+            if thesis.title == 'bad title':
+                self.assertEqual(thesis.status, Thesis.STATUS_CHOICES.ingest_error)
+                self.assertEqual(thesis.pid, None)
+                self.assertEqual(job.status, IngestJob.STATUS_CHOICES.failed)
+            else:
+                self.assertEqual(thesis.status, Thesis.STATUS_CHOICES.ingested)
+                self.assertEqual(thesis.pid, 'test:%s' % thesis.id)
+                self.assertEqual((job.status, job.pid), (IngestJob.STATUS_CHOICES.succeeded, thesis.pid))
+        #nothing left to do
+        with redirect_stdout(StringIO()):
+            self.assertEqual(run_ingest_workers(workers=workers), ([], []))
+
+    def test_ingest_batch(self):
+        self._check_batch(workers=1)
+
+    def test_ingest_batch_parallel(self):
+        self._check_batch(workers=3)
+
+    def test_worker_command_reports_failures(self):
+        self._create_theses_to_ingest()
+        with redirect_stdout(StringIO()):
+            call_command('ingest_batch_of_theses', stdout=StringIO())
+        with patch.object(ThesisIngester, 'post_to_api', autospec=True, side_effect=self._post_to_api), self._serialize_db_access():
+            with redirect_stdout(StringIO()):
+                with self.assertRaises(CommandError) as cm:
+                    call_command('ingest_worker', '--workers', '2', stdout=StringIO())
+        self.assertEqual(str(cm.exception), '1 of 4 ingest jobs failed')
+
+    def test_mark_ingested_only_saves_ingest_fields(self):
+        thesis = self._create_theses_to_ingest()[0]
+        Thesis.objects.filter(id=thesis.id).update(title='edited elsewhere')
+        thesis.mark_ingested('test:1')
+        thesis = Thesis.objects.get(id=thesis.id)
+        self.assertEqual((thesis.title, thesis.pid, thesis.status), ('edited elsewhere', 'test:1', 'ingested'))
+
+
+class TestIngestJob(TestCase, CandidateCreator):
+
+    def setUp(self):
+        self._create_candidate()
+        self.thesis = self.candidate.thesis
+        self.thesis.title = 'Some title'
+        self.thesis.status = 'accepted'
+        self.thesis.save()
+        complete_gradschool_checklist(self.candidate)
+
+    def test_enqueue(self):
+        job = IngestJob.enqueue(self.thesis)
+        self.assertEqual((job.status, job.attempts), (IngestJob.STATUS_CHOICES.queued, 0))
+        #already queued
+        self.assertEqual(IngestJob.enqueue(self.thesis).id, job.id)
+        IngestJob.claim_next('worker')
+        self.assertEqual(IngestJob.enqueue(self.thesis).id, job.id)
+        IngestJob.objects.get(id=job.id).mark_failed('error')
+        #finished jobs don't count
+        self.assertNotEqual(IngestJob.enqueue(self.thesis).id, job.id)
+
+    def test_claim(self):
+        job = IngestJob.enqueue(self.thesis)
+        claimed = IngestJob.claim_next('worker 1')
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual((claimed.status, claimed.claimed_by, claimed.attempts), (IngestJob.STATUS_CHOICES.running, 'worker 1', 1))
+        self.assertTrue(claimed.lease_expires > timezone.now())
+        #another worker can't get it while the lease is good
+        self.assertEqual(IngestJob.claim_next('worker 2'), None)
+        self.assertTrue(claimed.mark_succeeded('test:1'))
+        job = IngestJob.objects.get(id=job.id)
+        self.assertEqual((job.status, job.pid, job.lease_expires), (IngestJob.STATUS_CHOICES.succeeded, 'test:1', None))
+        self.assertTrue(job.duration is not None)
+        self.assertEqual(IngestJob.claim_next('worker 2'), None)
+
+    @override_settings(INGEST_JOB_MAX_ATTEMPTS=2)
+    def test_expired_lease(self):
+        job = IngestJob.enqueue(self.thesis)
+        first_claim = IngestJob.claim_next('worker 1', lease_seconds=60)
+        IngestJob.objects.filter(id=job.id).update(lease_expires=timezone.now() - datetime.timedelta(seconds=1))
+        #worker 1 died (or hung) - worker 2 picks the job up
+        second_claim = IngestJob.claim_next('worker 2')
+        self.assertEqual((second_claim.claimed_by, second_claim.attempts), ('worker 2', 2))
+        #worker 1 can't finish it now
+        self.assertFalse(first_claim.mark_succeeded('test:1'))
+        self.assertEqual(IngestJob.objects.get(id=job.id).status, IngestJob.STATUS_CHOICES.running)
+        #out of attempts
+        IngestJob.objects.filter(id=job.id).update(lease_expires=timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(IngestJob.claim_next('worker 3'), None)
+        job = IngestJob.objects.get(id=job.id)
+        self.assertEqual((job.status, job.last_error), (IngestJob.STATUS_CHOICES.failed, 'lease expired after 2 attempts'))
+
+    def test_renew_lease(self):
+        IngestJob.enqueue(self.thesis)
+        job = IngestJob.claim_next('worker 1', lease_seconds=60)
+        first_expires = job.lease_expires
+        self.assertTrue(job.renew_lease())
+        self.assertTrue(job.lease_expires > first_expires)
+        self.assertEqual(IngestJob.objects.get(id=job.id).lease_expires, job.lease_expires)
+        #a renewed lease keeps other workers off the job
+        self.assertEqual(IngestJob.claim_next('worker 2'), None)
+        job.mark_succeeded('test:1')
+        self.assertFalse(job.renew_lease())
+
+    def test_not_ready(self):
+        self.thesis.status = 'pending'
+        self.thesis.save()
+        jobs, not_ready = enqueue_theses([self.thesis])
+        self.assertEqual((jobs, [t.id for t in not_ready]), ([], [self.thesis.id]))
+        self.assertEqual(IngestJob.objects.count(), 0)
@@ -0,0 +1,75 @@
+from django.test import TestCase, override_settings
+from etd_app.keyword_index import KeywordIndex, keyword_index
+from etd_app.models import Keyword
+from tests.test_models import COMPOSED_TEXT, DECOMPOSED_TEXT
+
+
+class TestKeywordIndex(TestCase):
+
+    def setUp(self):
+        for text in ['python', 'Monty Python', 'pythonic code', 'jython', 'perl', 'Python']:
+            Keyword.objects.create(text=text)
+
+    def _texts(self, keywords):
+        return [k.text for k in keywords]
+
+    def test_search_matches_db_search(self):
+        index = KeywordIndex()
+        index.build()
+        for term in ['p', 'py', 'PY', 'pyt', 'ytho', 'thon c', 'monty python', 'x', 'zzz']:
+            with self.subTest(term=term):
+                with self.assertNumQueries(0):
+                    results = index.search(term)
+                expected = Keyword.search(term=term, order='text', prefix_first=True)
+                self.assertEqual(sorted(self._texts(results)), sorted(self._texts(expected)))
+
+    def test_search_order_and_limit(self):
+        index = KeywordIndex()
+        self.assertEqual(self._texts(index.search('python')), ['Python', 'python', 'pythonic code', 'Monty Python'])
+        self.assertEqual(self._texts(index.search('ytho')), ['Monty Python', 'Python', 'jython', 'python', 'pythonic code'])
+        self.assertEqual(self._texts(index.search('py', limit=2)), ['Python', 'python'])
+
+    def test_accents(self):
+        index = KeywordIndex()
+        Keyword.objects.create(text=COMPOSED_TEXT)
+        index.build()
+        self.assertEqual(self._texts(index.search('test')), [DECOMPOSED_TEXT])
+        self.assertEqual(self._texts(index.search(COMPOSED_TEXT)), [DECOMPOSED_TEXT])
+
+    def test_incremental_updates(self):
+        keyword_index.build()
+        with self.assertNumQueries(0):
+            self.assertEqual(self._texts(keyword_index.search('ruby')), [])
+        ruby = Keyword.objects.create(text='ruby')
+        kw = Keyword.objects.get(text='perl')
+        kw.text = 'perl six'
+        kw.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self._texts(keyword_index.search('ruby')), ['ruby'])
+            self.assertEqual(self._texts(keyword_index.search('si')), ['perl six'])
+            self.assertEqual(self._texts(keyword_index.search('perl')), ['perl six'])
+        ruby.delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(self._texts(keyword_index.search('ruby')), [])
+            self.assertEqual(self._texts(keyword_index.search('r')), [])
+
+    def test_rebuilt_when_stale(self):
+        index = KeywordIndex()
+        index.search('py')
+        Keyword.objects.filter(text='perl').update(text='ruby', search_text='ruby')
+        self.assertEqual(self._texts(index.search('ruby')), [])
+        with self.settings(KEYWORD_MEMORY_INDEX_MAX_AGE=-1):
+            self.assertEqual(self._texts(index.search('ruby')), ['ruby'])
+
+
+class TestAutocompleteKeywordIndex(TestCase):
+
+    @override_settings(KEYWORD_MEMORY_INDEX=True)
+    def test_previously_used(self):
+        from etd_app.views import _get_previously_used
+        Keyword.objects.create(text='python')
+        Keyword.objects.create(text='jython')
+        keyword_index.build()
+        with self.assertNumQueries(0):
+            results = _get_previously_used(Keyword, 'ytho')
+        self.assertEqual([r['text'] for r in results[0]['children']], ['jython', 'python'])
@@ -1,6 +1,8 @@
 from datetime import date, timedelta
+from io import StringIO
 import os
 from django.core import mail
+from django.core.management import call_command
 from django.core.files import File
 from django.db import IntegrityError
 from django.test import TestCase, TransactionTestCase
@@ -23,6 +25,7 @@ from etd_app.models import (
         ThesisException,
         Thesis,
     )
+from etd_app.utilities import calculate_file_digests
 
 
 CUR_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -299,6 +302,41 @@ class TestCandidate(TransactionTestCase):
         self.assertEqual(len(complete), 1)
         self.assertEqual(complete[0].person.netid, 'bjohnson@brown.edu')
 
+    def test_get_candidates_paperwork_matches_checklist_complete(self):
+        #the db filter for paperwork_incomplete/complete has to agree with GradschoolChecklist.complete()
+        now = timezone.now()
+        tomorrow = now + timedelta(days=1)
+        checklist_dates = [
+                {},
+                {'pages_submitted_to_gradschool': now},
+                {'pages_submitted_to_gradschool': tomorrow},
+                {'pages_submitted_to_gradschool': now, 'gradschool_exit_survey': now},
+                {'pages_submitted_to_gradschool': now, 'gradschool_exit_survey': now, 'earned_docs_survey': now},
+                {'pages_submitted_to_gradschool': now, 'gradschool_exit_survey': now, 'earned_docs_survey': tomorrow},
+                {'gradschool_exit_survey': now, 'earned_docs_survey': now},
+            ]
+        for index, dates in enumerate(checklist_dates):
+            for degree in [self.degree, self.masters_degree]:
+                netid = f'{degree.degree_type}{index}@brown.edu'
+                p = Person.objects.create(netid=netid, last_name=netid, email=netid)
+                c = Candidate.objects.create(person=p, year=CURRENT_YEAR, department=self.dept, degree=degree)
+                c.thesis.status = Thesis.STATUS_CHOICES.accepted
+                c.thesis.save()
+                for field, value in dates.items():
+                    setattr(c.gradschool_checklist, field, value)
+                c.gradschool_checklist.save()
+        accepted = Candidate.objects.filter(thesis__status='accepted')
+        expected_complete = sorted([c.id for c in accepted if c.gradschool_checklist.complete()])
+        expected_incomplete = sorted([c.id for c in accepted if not c.gradschool_checklist.complete()])
+        self.assertEqual(len(expected_complete), 5)
+        complete = Candidate.get_candidates_by_status('complete', sort_param='date_registered')
+        incomplete = Candidate.get_candidates_by_status('paperwork_incomplete', sort_param='date_registered')
+        self.assertEqual(sorted(complete.values_list('id', flat=True)), expected_complete)
+        self.assertEqual(sorted(incomplete.values_list('id', flat=True)), expected_incomplete)
+        #results stay lazy querysets, so they can be sliced & counted in the db
+        self.assertEqual(incomplete.count(), len(expected_incomplete))
+        self.assertEqual(len(incomplete[:2]), 2)
+
     def test_candidates_by_status_sorted(self):
         p = Person.objects.create(netid='tjones@brown.edu', last_name=LAST_NAME, email='tom_jones@brown.edu')
         p2 = Person.objects.create(netid='rsmith@brown.edu', last_name='Smith', email='r_smith@brown.edu')
@@ -386,6 +424,43 @@ class TestKeyword(TestCase):
         self.assertEqual(len(results), 2)
         self.assertEqual(results[0].id, k2.id)
 
+    def test_keyword_trigrams(self):
+        k = Keyword.objects.create(text='Tëst Python')
+        trigrams = set(k.trigrams.values_list('trigram', flat=True))
+        self.assertEqual(trigrams, {'tes', 'est', 'st ', 't p', ' py', 'pyt', 'yth', 'tho', 'hon', '  t', ' te', '  p'})
+        k.text = 'other'
+        k.save()
+        self.assertEqual(set(k.trigrams.values_list('trigram', flat=True)), {'oth', 'the', 'her', '  o', ' ot'})
+
+    def test_search_uses_trigrams(self):
+        k1 = Keyword.objects.create(text='Python (Computer program language)')
+        k2 = Keyword.objects.create(text='Monty Python (Comedy troupe)')
+        k3 = Keyword.objects.create(text='Pythons')
+        Keyword.objects.create(text='typhoon')
+        #keywords with all the trigrams, but not the actual term, aren't returned
+        Keyword.objects.create(text='thon pyth')
+        results = Keyword.search(term='python', order='text')
+        self.assertEqual([k.id for k in results], [k2.id, k1.id, k3.id])
+        results = Keyword.search(term='PYTHÖN', order='text')
+        self.assertEqual(len(results), 3)
+
+    def test_search_prefix_first(self):
+        k1 = Keyword.objects.create(text='computer programs')
+        k2 = Keyword.objects.create(text='programming')
+        k3 = Keyword.objects.create(text='program')
+        k4 = Keyword.objects.create(text='aaa program')
+        results = Keyword.search(term='program', order='text', prefix_first=True)
+        self.assertEqual([k.id for k in results], [k3.id, k2.id, k4.id, k1.id])
+        results = Keyword.search(term='program', order='text', prefix_first=True, limit=2)
+        self.assertEqual([k.id for k in results], [k3.id, k2.id])
+        #short terms match the start of words
+        results = Keyword.search(term='p', order='text', prefix_first=True)
+        self.assertEqual([k.id for k in results], [k3.id, k2.id, k4.id, k1.id])
+        results = Keyword.search(term='Co', order='text', prefix_first=True)
+        self.assertEqual([k.id for k in results], [k1.id])
+        results = Keyword.search(term='ra', order='text', prefix_first=True)
+        self.assertEqual(results, [])
+
 
 def add_file_to_thesis(thesis):
     with open(os.path.join(CUR_DIR, 'test_files', TEST_PDF_FILENAME), 'rb') as f:
@@ -459,8 +534,23 @@ class TestThesis(TestCase):
         self.assertTrue(thesis.current_file_name.startswith(TEST_PDF_FILENAME.split(u'.')[0]))
         self.assertTrue(thesis.current_file_name.endswith('.pdf'))
         self.assertEqual(thesis.checksum, 'b1938fc5549d1b5b42c0b695baa76d5df5f81ac3')
+        self.assertEqual(thesis.checksum_sha256, '0b177d263a8ee3d6416ac251e8b208e53905e3bb4d8889ff2d49dfdb9b294c8e')
+        self.assertEqual(thesis.checksum_md5, '9c4fb1b76dbe004bfcc82c2cf9417a03')
         self.assertEqual(thesis.status, Thesis.STATUS_CHOICES.not_submitted)
 
+    def test_calculate_file_digests_chunked(self):
+        with open(os.path.join(CUR_DIR, 'test_files', TEST_PDF_FILENAME), 'rb') as f:
+            pdf_file = File(f, name=TEST_PDF_FILENAME)
+            digests = calculate_file_digests(pdf_file, chunk_size=100)
+            self.assertEqual(digests, {
+                    'sha1': 'b1938fc5549d1b5b42c0b695baa76d5df5f81ac3',
+                    'sha256': '0b177d263a8ee3d6416ac251e8b208e53905e3bb4d8889ff2d49dfdb9b294c8e',
+                    'md5': '9c4fb1b76dbe004bfcc82c2cf9417a03',
+                })
+            #rewound, so the file can still be saved
+            self.assertEqual(f.tell(), 0)
+            self.assertEqual(Thesis.calculate_checksum(pdf_file), 'b1938fc5549d1b5b42c0b695baa76d5df5f81ac3')
+
     def test_invalid_file(self):
         with open(os.path.join(CUR_DIR, 'test_files', 'test_obj'), 'rb') as f:
             bad_file = File(f, name='test_obj')
@@ -569,6 +659,40 @@ class TestThesis(TestCase):
         self.candidate.save()
         self.assertFalse(self.candidate.thesis.ready_to_ingest())
 
+    def test_eligible_for_ingest_on(self):
+        thesis = self.candidate.thesis
+        self.assertEqual(thesis.eligible_for_ingest_on, None)
+        yesterday = timezone.now() - timedelta(days=1)
+        checklist = self.candidate.gradschool_checklist
+        checklist.pages_submitted_to_gradschool = yesterday
+        checklist.save()
+        self.assertEqual(Thesis.objects.get(id=thesis.id).eligible_for_ingest_on, None)
+        complete_gradschool_checklist(self.candidate)
+        self.assertEqual(Thesis.objects.get(id=thesis.id).eligible_for_ingest_on, date.today())
+        self.assertEqual(thesis.eligible_for_ingest_on, date.today())
+        #masters candidates only need the pages submitted
+        checklist.earned_docs_survey = None
+        checklist.save()
+        self.assertEqual(Thesis.objects.get(id=thesis.id).eligible_for_ingest_on, None)
+        self.candidate.degree = Degree.objects.create(abbreviation='MS', name='Masters', degree_type=Degree.TYPES.masters)
+        self.candidate.save()
+        self.assertEqual(Thesis.objects.get(id=thesis.id).eligible_for_ingest_on, date.today())
+        checklist.pages_submitted_to_gradschool = yesterday
+        checklist.save()
+        self.assertEqual(Thesis.objects.get(id=thesis.id).eligible_for_ingest_on, yesterday.date())
+        #saving the thesis keeps the stored date
+        thesis.title = 'new title'
+        thesis.save()
+        self.assertEqual(Thesis.objects.get(id=thesis.id).eligible_for_ingest_on, yesterday.date())
+
+    def test_backfill_eligible_for_ingest_on(self):
+        complete_gradschool_checklist(self.candidate)
+        Thesis.objects.all().update(eligible_for_ingest_on=None)
+        out = StringIO()
+        call_command('backfill_eligible_for_ingest_on', stdout=out)
+        self.assertEqual(Thesis.objects.get(id=self.candidate.thesis.id).eligible_for_ingest_on, date.today())
+        self.assertIn('Checked 1 theses, updated 1.', out.getvalue())
+
     def test_open_for_reupload(self):
         with self.assertRaises(ThesisException) as cm:
             self.candidate.thesis.open_for_reupload()
@@ -0,0 +1,158 @@
+from datetime import date
+from io import StringIO
+import json
+import os
+import tempfile
+import zipfile
+from django.core.management import call_command
+from django.test import TestCase
+from etd_app.models import Candidate, Department, Keyword, Person, Thesis
+from etd_app.mods_mapper import ModsMapper
+from etd_app.mods_writer import get_mods_record, serialize_mods, write_mods
+from tests.test_models import CUR_DIR, CURRENT_YEAR
+from tests.test_views import CandidateCreator
+
+
+GOLDEN_FILE = os.path.join(CUR_DIR, 'test_files', 'mods_golden.xml')
+RECORD = {
+    'title': 'Title with “ünïcode” & <markup>',
+    'creator': 'Jones, Tom Middle',
+    'committee_members': [('Smith, Rachel', 'Reader'), ('Smith, Rachel', 'Advisor')],
+    'department': 'Department of Engineering',
+    'year': 2016,
+    'degree': 'Ph.D.',
+    'num_prelim_pages': 'x',
+    'num_body_pages': 125,
+    'abstract': 'An abstract\nwith two lines & "quotes"',
+    'keywords': [
+        {'text': 'keyword', 'authority': '', 'authority_uri': '', 'value_uri': ''},
+        {'text': 'Fast keyword', 'authority': 'fast', 'authority_uri': 'http://id.worldcat.org/fast',
+         'value_uri': 'http://id.worldcat.org/fast/1234'},
+    ],
+    'language': 'English',
+    'record_creation_date': '20160515',
+}
+
+
+class TestModsWriter(TestCase, CandidateCreator):
+
+    def test_golden_file(self):
+        with open(GOLDEN_FILE, 'rb') as f:
+            expected = f.read().rstrip(b'\n')
+        self.assertEqual(serialize_mods(RECORD), expected)
+        out = StringIO()
+        write_mods(RECORD, out)
+        self.assertEqual(out.getvalue().encode('utf8'), expected)
+
+    def _check_same_as_mods_mapper(self, thesis):
+        thesis = Thesis.get_ingest_queryset().get(id=thesis.id)
+        self.assertEqual(serialize_mods(get_mods_record(thesis)), ModsMapper(thesis).get_mods().serialize())
+
+    def test_same_as_mods_mapper(self):
+        self._create_candidate()
+        self.candidate.person.middle = 'Middle'
+        self.candidate.person.save()
+        self.candidate.committee_members.add(self.committee_member)
+        self.candidate.committee_members.add(self.committee_member2)
+        thesis = self.candidate.thesis
+        thesis.title = RECORD['title']
+        thesis.abstract = 'abstract with\r\nwindows newline, tab\t, and ]]> <!-- -->'
+        thesis.num_prelim_pages = 'xii'
+        thesis.num_body_pages = 125
+        thesis.save()
+        thesis.keywords.add(Keyword.objects.create(text='plain keyword'))
+        thesis.keywords.add(Keyword.objects.create(text='Fast & <keyword>', authority='fast', authority_uri='http://id.worldcat.org/fast',
+                                                   value_uri='http://id.worldcat.org/fast/1?a=1&b="2"'))
+        thesis.keywords.add(Keyword.objects.create(text='value only', value_uri='http://example.com/\tvalue\n'))
+        self._check_same_as_mods_mapper(thesis)
+
+    def test_same_as_mods_mapper_minimal(self):
+        #no committee, keywords, page counts, or language
+        self._create_candidate()
+        thesis = self.candidate.thesis
+        thesis.title = ''
+        thesis.save()
+        Thesis.objects.filter(id=thesis.id).update(language=None)
+        self._check_same_as_mods_mapper(thesis)
+
+    def test_record(self):
+        self._create_candidate()
+        thesis = Thesis.get_ingest_queryset().get(id=self.candidate.thesis.id)
+        record = get_mods_record(thesis, today=date(2016, 5, 15))
+        self.assertEqual(record['department'], 'Department of Engineering')
+        self.assertEqual(record['language'], 'English')
+        self.assertEqual(record['record_creation_date'], '20160515')
+
+    def test_invalid_characters(self):
+        record = dict(RECORD, abstract='bad \x0b character')
+        with self.assertRaises(ValueError):
+            serialize_mods(record)
+
+    def test_benchmark_command(self):
+        self._create_candidate()
+        out = StringIO()
+        call_command('benchmark_mods_serializer', '--repeat', '2', stdout=out)
+        self.assertIn('1 theses', out.getvalue())
+        self.assertIn('per record', out.getvalue())
+
+
+class TestExportMods(TestCase, CandidateCreator):
+
+    def setUp(self):
+        self._create_candidate()
+        self.other_dept = Department.objects.create(name='Department of History')
+        self.theses = [self.candidate.thesis]
+        for i, (year, dept) in enumerate([(CURRENT_YEAR, self.dept), (CURRENT_YEAR - 1, self.dept), (CURRENT_YEAR, self.other_dept)]):
+            person = Person.objects.create(netid=f'p{i}@brown.edu', last_name=f'Last{i}', first_name='First', email=f'p{i}@brown.edu')
+            candidate = Candidate.objects.create(person=person, year=year, department=dept, degree=self.degree)
+            candidate.committee_members.add(self.committee_member)
+            self.theses.append(candidate.thesis)
+        for i, thesis in enumerate(self.theses):
+            thesis.title = f'Title {i}'
+            thesis.keywords.add(Keyword.objects.create(text=f'keyword {i}'))
+            thesis.save()
+            if i > 0:
+                thesis.mark_ingested(f'test:{i}')
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def _export(self, file_name, *args):
+        path = os.path.join(self.tmp_dir.name, file_name)
+        out = StringIO()
+        call_command('export_mods', path, *args, stdout=out)
+        return path, out.getvalue()
+
+    def _get_expected_mods(self, thesis):
+        thesis = Thesis.get_ingest_queryset().get(id=thesis.id)
+        return serialize_mods(get_mods_record(thesis))
+
+    def test_zip(self):
+        #a small chunk size, so the theses are loaded in more than one chunk
+        path, output = self._export('mods.zip', '--chunk-size', '2')
+        self.assertEqual(output, f'Exported MODS for 3 theses to {path}.\n')
+        with zipfile.ZipFile(path) as zip_file:
+            self.assertEqual(zip_file.namelist(), ['test_1.xml', 'test_2.xml', 'test_3.xml'])
+            for thesis in self.theses[1:]:
+                self.assertEqual(zip_file.read(f'test_{thesis.pid[5:]}.xml'), self._get_expected_mods(thesis))
+
+    def test_jsonl_with_processes(self):
+        path, output = self._export('mods.jsonl', '--status', 'all', '--processes', '2', '--chunk-size', '3')
+        with open(path, encoding='utf8') as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line['thesis_id'] for line in lines], [thesis.id for thesis in self.theses])
+        self.assertEqual(lines[0]['pid'], None)
+        for line, thesis in zip(lines, self.theses):
+            self.assertEqual(line['mods'].encode('utf8'), self._get_expected_mods(thesis))
+
+    def test_filters(self):
+        path, output = self._export('mods.jsonl', '--year', str(CURRENT_YEAR))
+        with open(path, encoding='utf8') as f:
+            self.assertEqual([json.loads(line)['pid'] for line in f], ['test:1', 'test:3'])
+        path, output = self._export('mods.jsonl', '--department', 'Department of History')
+        with open(path, encoding='utf8') as f:
+            self.assertEqual([json.loads(line)['pid'] for line in f], ['test:3'])
+        path, output = self._export('mods.jsonl', '--department', str(self.dept.id), '--status', 'not_submitted')
+        with open(path, encoding='utf8') as f:
+            self.assertEqual([json.loads(line)['thesis_id'] for line in f], [self.theses[0].id])
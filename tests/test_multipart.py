@@ -0,0 +1,98 @@
+import hashlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import os
+import tempfile
+import threading
+import tracemalloc
+from django.test import SimpleTestCase
+from urllib3.filepost import encode_multipart_formdata
+from etd_app import http_client
+from etd_app.multipart import MultipartBody, MultipartFile
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    #reads the body in pieces, and answers with its length and hash
+
+    def do_POST(self):
+        remaining = int(self.headers['Content-Length'])
+        sha256 = hashlib.sha256()
+        while remaining > 0:
+            data = self.rfile.read(min(remaining, 64 * 1024))
+            if not data:
+                break
+            sha256.update(data)
+            remaining -= len(data)
+        response = json.dumps({'content_type': self.headers['Content-Type'],
+            'transfer_encoding': self.headers['Transfer-Encoding'], 'sha256': sha256.hexdigest()}).encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestMultipartBody(SimpleTestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.pdf')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'%PDF-1.4 test data\x00\xff' * 10000)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_body(self):
+        #same bytes as urllib3/requests would build in memory
+        body = MultipartBody(fields={'mods': '{"xml_data": "ünicode"}', 'list': ['a', 'b']},
+                files={'thesis.pdf': MultipartFile(self.path, filename='thesis.pdf')}, boundary='testboundary', chunk_size=1000)
+        with open(self.path, 'rb') as f:
+            expected, content_type = encode_multipart_formdata([('mods', '{"xml_data": "ünicode"}'), ('list', 'a'), ('list', 'b'),
+                ('thesis.pdf', ('thesis.pdf', f.read(), 'application/pdf'))], boundary='testboundary')
+        self.assertEqual(body.content_type, content_type)
+        self.assertEqual(b''.join(body), expected)
+        self.assertEqual(len(body), len(expected))
+        #iterating again gives the same body, so a retried request is complete
+        self.assertEqual(b''.join(body), expected)
+        self.assertTrue(all(len(chunk) <= 1000 for chunk in body))
+
+
+class TestStreamingPost(SimpleTestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), StubApiHandler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+        self.url = 'http://127.0.0.1:%s/api/items/' % self.server.server_port
+        self.file_size = 20 * 1024 * 1024
+        fd, self.path = tempfile.mkstemp(suffix='.pdf')
+        with os.fdopen(fd, 'wb') as f:
+            for _ in range(self.file_size // (1024 * 1024)):
+                f.write(os.urandom(1024 * 1024))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        http_client.close_sessions()
+        os.remove(self.path)
+
+    def test_post_memory(self):
+        body = MultipartBody(fields={'identity': 'test'}, files={'thesis.pdf': MultipartFile(self.path)})
+        expected_sha256 = hashlib.sha256(b''.join(body)).hexdigest()
+        tracemalloc.start()
+        try:
+            r = http_client.post('bdr_api', self.url, data=body, headers={'Content-Type': body.content_type})
+            current, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(r.status_code, 200)
+        result = r.json()
+        self.assertEqual(result['sha256'], expected_sha256)
+        self.assertEqual(result['content_type'], body.content_type)
+        #sent with a Content-Length, not chunked
+        self.assertEqual(result['transfer_encoding'], None)
+        #the whole 20MB file was never in memory at once
+        self.assertLess(peak, 2 * 1024 * 1024)
@@ -0,0 +1,137 @@
+import os
+import tempfile
+import threading
+from django.core.files import File
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.test import TestCase, override_settings
+from etd_app.models import Thesis
+from etd_app.storage import ContentAddressedStorage
+from tests.test_models import CUR_DIR, TEST_PDF_FILENAME, add_file_to_thesis
+from tests.test_views import CandidateCreator
+
+
+TEST_PDF_SHA256 = '0b177d263a8ee3d6416ac251e8b208e53905e3bb4d8889ff2d49dfdb9b294c8e'
+
+
+class TestContentAddressedStorage(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.storage = ContentAddressedStorage(location=self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_sharded_name(self):
+        with open(os.path.join(CUR_DIR, 'test_files', TEST_PDF_FILENAME), 'rb') as f:
+            name = self.storage.save(TEST_PDF_FILENAME, File(f))
+        self.assertEqual(name, '0b/17/%s.pdf' % TEST_PDF_SHA256)
+        self.assertTrue(self.storage.is_blob(name))
+        self.assertTrue(self.storage.exists(name))
+
+    def test_long_file_name(self):
+        #the name doesn't depend on the uploaded file name, so it always fits in the column
+        long_name = 'Smith_Jonathan_PhD_Dissertation_Final_Version_%s.PDF' % ('x' * 200)
+        name = self.storage.save(long_name, SimpleUploadedFile(long_name, b'content'))
+        self.assertEqual(len(name), 74)
+        self.assertTrue(name.endswith('.pdf'))
+        self.assertTrue(len(name) <= Thesis._meta.get_field('document').max_length)
+
+    def test_deduplicate(self):
+        name = self.storage.save('a.pdf', SimpleUploadedFile('a.pdf', b'same content'))
+        self.assertEqual(self.storage.save('b.pdf', SimpleUploadedFile('b.pdf', b'same content')), name)
+        other_name = self.storage.save('a.pdf', SimpleUploadedFile('a.pdf', b'other content'))
+        self.assertNotEqual(other_name, name)
+        #no trace of the first uploader's file name
+        self.assertNotIn('a.pdf', name)
+
+    def test_temporary_file_moved(self):
+        upload = TemporaryUploadedFile('big.pdf', 'application/pdf', 0, None)
+        upload.write(b'big content')
+        upload.seek(0)
+        temp_path = upload.temporary_file_path()
+        name = self.storage.save('big.pdf', upload)
+        upload.close()
+        self.assertFalse(os.path.exists(temp_path))
+        with self.storage.open(name, 'rb') as f:
+            self.assertEqual(f.read(), b'big content')
+        #no temp files left behind
+        file_names = os.listdir(os.path.dirname(self.storage.path(name)))
+        self.assertEqual([n for n in file_names if n.startswith('.upload-')], [])
+
+    def test_release(self):
+        name = self.storage.save('a.pdf', SimpleUploadedFile('a.pdf', b'content'))
+        self.assertFalse(self.storage.release(name, count_references=lambda: 1))
+        self.assertTrue(self.storage.exists(name))
+        self.assertTrue(self.storage.release(name, count_references=lambda: 0))
+        self.assertFalse(self.storage.exists(name))
+        #files saved before this storage have other names, and are never released
+        self.assertFalse(self.storage.release('old.pdf', count_references=lambda: 0))
+
+    def test_release_recently_reused(self):
+        name = self.storage.save('a.pdf', SimpleUploadedFile('a.pdf', b'content'))
+        #another upload of the same content, whose thesis isn't committed yet
+        self.storage.save('b.pdf', SimpleUploadedFile('b.pdf', b'content'))
+        self.assertFalse(self.storage.release(name, count_references=lambda: 0))
+        self.assertTrue(self.storage.exists(name))
+        with override_settings(THESIS_BLOB_REUSE_GRACE_SECONDS=0):
+            self.assertTrue(self.storage.release(name, count_references=lambda: 0))
+        self.assertFalse(self.storage.exists(name))
+
+    def test_release_counts_under_lock(self):
+        name = self.storage.save('a.pdf', SimpleUploadedFile('a.pdf', b'content'))
+        saved = []
+
+        def _count_references():
+            #an upload of the same content has to wait for the release to finish
+            thread = threading.Thread(target=lambda: saved.append(self.storage.save('b.pdf', SimpleUploadedFile('b.pdf', b'content'))))
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+            self._thread = thread
+            return 0
+
+        self.assertTrue(self.storage.release(name, count_references=_count_references))
+        self._thread.join()
+        #and then writes the blob again, instead of pointing at the deleted one
+        self.assertEqual(saved, [name])
+        self.assertTrue(self.storage.exists(name))
+
+
+class TestThesisDocumentStorage(TestCase, CandidateCreator):
+
+    def test_identical_uploads_share_a_blob(self):
+        self._create_candidate()
+        other_candidate = self._create_additional_candidate()
+        add_file_to_thesis(self.candidate.thesis)
+        add_file_to_thesis(other_candidate.thesis)
+        self.assertEqual(self.candidate.thesis.document.name, other_candidate.thesis.document.name)
+        self.assertIn(TEST_PDF_SHA256, self.candidate.thesis.document.name)
+        self.assertEqual(self.candidate.thesis.current_file_name, TEST_PDF_FILENAME)
+
+    def test_current_file_name_not_shared(self):
+        #the second upload of the same content keeps its own file name
+        self._create_candidate()
+        other_candidate = self._create_additional_candidate()
+        self.candidate.thesis.update_thesis_file(SimpleUploadedFile('first.pdf', b'same content'))
+        other_candidate.thesis.update_thesis_file(SimpleUploadedFile('second.pdf', b'same content'))
+        self.assertEqual(self.candidate.thesis.document.name, other_candidate.thesis.document.name)
+        self.assertEqual(Thesis.objects.get(id=other_candidate.thesis.id).current_file_name, 'second.pdf')
+
+    @override_settings(THESIS_BLOB_REUSE_GRACE_SECONDS=0)
+    def test_replaced_document_released(self):
+        self._create_candidate()
+        other_candidate = self._create_additional_candidate()
+        thesis = self.candidate.thesis
+        thesis.update_thesis_file(SimpleUploadedFile('first.pdf', b'first version'))
+        first_path = thesis.document.path
+        other_candidate.thesis.update_thesis_file(SimpleUploadedFile('copy.pdf', b'first version'))
+        #still used by the other thesis
+        with self.captureOnCommitCallbacks(execute=True):
+            thesis.update_thesis_file(SimpleUploadedFile('second.pdf', b'second version'))
+        self.assertTrue(os.path.exists(first_path))
+        with self.captureOnCommitCallbacks(execute=True):
+            other_candidate.thesis.update_thesis_file(SimpleUploadedFile('second.pdf', b'second version'))
+        self.assertFalse(os.path.exists(first_path))
+        self.assertEqual(Thesis.objects.get(id=thesis.id).document.name, other_candidate.thesis.document.name)
+        self.assertTrue(os.path.exists(thesis.document.path))
@@ -1,7 +1,17 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import hashlib
+from io import StringIO
 import json
 import os
+import tempfile
+import threading
+import time
+import urllib.parse
+from unittest.mock import patch
 from django.contrib.auth.models import User, Permission
 from django.core.files import File
+from django.core.management import call_command
 from django.urls import reverse
 from django.conf import settings
 from django.http import HttpRequest
@@ -12,8 +22,9 @@ from django.utils.encoding import force_bytes
 import responses
 from tests import responses_data
 from tests.test_models import TEST_PDF_FILENAME, LAST_NAME, FIRST_NAME, CURRENT_YEAR, add_file_to_thesis, add_metadata_to_thesis
-from etd_app.models import Person, Candidate, CommitteeMember, Department, Degree, Thesis, Keyword
-from etd_app.views import get_shib_info_from_request, _get_previously_used, _get_fast_results, candidate_metadata
+from etd_app.models import Person, Candidate, ChunkedUpload, CommitteeMember, Department, Degree, FastCacheCounter, Thesis, Keyword
+from etd_app.views import get_shib_info_from_request, _get_previously_used, _get_fast_results, _submit_fast_lookup, candidate_metadata
+from etd_app import fast_cache
 from etd_app.widgets import ID_VAL_SEPARATOR
 
 
@@ -506,7 +517,7 @@ class TestCandidateUpload(TestCase, CandidateCreator):
         self.assertEqual(len(Thesis.objects.all()), 1)
         self.assertEqual(Candidate.objects.all()[0].thesis.original_file_name, TEST_PDF_FILENAME)
         self.assertRedirects(response, reverse('candidate_home', kwargs={'candidate_id': self.candidate.id}))
-        full_path = os.path.join(settings.MEDIA_ROOT, Candidate.objects.all()[0].thesis.current_file_name)
+        full_path = Candidate.objects.all()[0].thesis.document.path
         self.assertTrue(os.path.exists(full_path), '%s doesn\'t exist' % full_path)
 
     def test_upload_bad_file(self):
@@ -536,6 +547,159 @@ class TestCandidateUpload(TestCase, CandidateCreator):
             thesis = Candidate.objects.all()[0].thesis
             self.assertEqual(thesis.original_file_name, 'test2.pdf')
             self.assertEqual(thesis.checksum, '2ce252ec827258837e53b2b0bfb94141ba951f2e')
+            self.assertEqual(thesis.checksum_sha256, '467cac6f851fdd084290b6a3936241bdfe833db3e236627b878f20e60e2d6124')
+            self.assertEqual(thesis.checksum_md5, '7218080aacc418682c5efe00a4084d63')
+
+
+    def test_upload_hashed_while_streaming(self):
+        self._create_candidate()
+        url = reverse('candidate_upload', kwargs={'candidate_id': self.candidate.id})
+        auth_client = get_auth_client()
+        #small files are kept in memory, bigger ones go to a temp file - both get hashed by the upload handlers
+        for max_memory_size in [settings.FILE_UPLOAD_MAX_MEMORY_SIZE, 10]:
+            with self.subTest(max_memory_size=max_memory_size):
+                with self.settings(FILE_UPLOAD_MAX_MEMORY_SIZE=max_memory_size):
+                    with patch('etd_app.models.calculate_file_digests', side_effect=AssertionError('file re-read')):
+                        with open(os.path.join(self.cur_dir, 'test_files', 'test2.pdf'), 'rb') as f:
+                            response = auth_client.post(url, {'thesis_file': f})
+                self.assertEqual(response.status_code, 302)
+                thesis = Thesis.objects.get(candidate=self.candidate)
+                self.assertEqual(thesis.checksum, '2ce252ec827258837e53b2b0bfb94141ba951f2e')
+                self.assertEqual(thesis.checksum_sha256, '467cac6f851fdd084290b6a3936241bdfe833db3e236627b878f20e60e2d6124')
+                self.assertEqual(thesis.checksum_md5, '7218080aacc418682c5efe00a4084d63')
+
+    def test_upload_csrf(self):
+        self._create_candidate()
+        url = reverse('candidate_upload', kwargs={'candidate_id': self.candidate.id})
+        user = User.objects.create_user('tjones@brown.edu', 'pw')
+        csrf_client = Client(enforce_csrf_checks=True)
+        csrf_client.force_login(user)
+        with open(os.path.join(self.cur_dir, 'test_files', 'test2.pdf'), 'rb') as f:
+            response = csrf_client.post(url, {'thesis_file': f})
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Thesis.objects.get(candidate=self.candidate).document)
+
+
+class TestCandidateChunkedUpload(TestCase, CandidateCreator):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        settings_override = self.settings(CHUNKED_UPLOAD_DIR=self.tmp_dir.name, CHUNKED_UPLOAD_CHUNK_SIZE=1000)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(self.tmp_dir.cleanup)
+        self._create_candidate()
+        self.auth_client = get_auth_client()
+        with open(os.path.join(self.cur_dir, 'test_files', 'test2.pdf'), 'rb') as f:
+            self.pdf_data = f.read()
+        self.start_url = reverse('candidate_upload_chunked_start', kwargs={'candidate_id': self.candidate.id})
+
+    def _start(self, **params):
+        data = {'file_name': 'test2.pdf', 'size': len(self.pdf_data)}
+        data.update(params)
+        return self.auth_client.post(self.start_url, data)
+
+    def _url(self, name, upload_id, **kwargs):
+        return reverse(name, kwargs=dict(candidate_id=self.candidate.id, upload_id=upload_id, **kwargs))
+
+    def _commit(self, upload_id, sha256=None):
+        if sha256 is None:
+            sha256 = hashlib.sha256(self.pdf_data).hexdigest()
+        return self.auth_client.post(self._url('candidate_upload_chunked_commit', upload_id), {'sha256': sha256})
+
+    def _put_chunk(self, upload_id, number, data=None):
+        if data is None:
+            data = self.pdf_data[number*1000:(number+1)*1000]
+        return self.auth_client.put(self._url('candidate_upload_chunk', upload_id, chunk_number=number),
+                data=data, content_type='application/octet-stream')
+
+    def test_upload_resume_and_commit(self):
+        response = self._start()
+        self.assertEqual(response.status_code, 201)
+        status = response.json()
+        upload_id = status['upload_id']
+        num_chunks = status['num_chunks']
+        self.assertEqual(num_chunks, (len(self.pdf_data) + 999) // 1000)
+        self.assertEqual(status['received_chunks'], [])
+        #send half the chunks, in any order, with one sent twice
+        first_half = list(reversed(range(num_chunks // 2)))
+        for number in first_half + [0]:
+            self.assertEqual(self._put_chunk(upload_id, number).status_code, 200)
+        #commit fails until every chunk is there
+        response = self._commit(upload_id)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('missing chunks', response.json()['error'])
+        #resume: ask what's been received, and send the rest
+        response = self.auth_client.get(self._url('candidate_upload_chunked_status', upload_id))
+        self.assertEqual(response.json()['received_chunks'], sorted(first_half))
+        for number in range(num_chunks // 2, num_chunks):
+            self._put_chunk(upload_id, number)
+        response = self._commit(upload_id)
+        self.assertEqual(response.json(), {'redirect': reverse('candidate_home', kwargs={'candidate_id': self.candidate.id})})
+        thesis = Thesis.objects.get(candidate=self.candidate)
+        self.assertEqual(thesis.original_file_name, 'test2.pdf')
+        self.assertEqual(thesis.checksum, '2ce252ec827258837e53b2b0bfb94141ba951f2e')
+        self.assertEqual(thesis.checksum_sha256, '467cac6f851fdd084290b6a3936241bdfe833db3e236627b878f20e60e2d6124')
+        with thesis.document.open('rb') as f:
+            self.assertEqual(f.read(), self.pdf_data)
+        self.assertFalse(ChunkedUpload.objects.exists())
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+
+    def test_checksum_mismatch(self):
+        upload_id = self._start().json()['upload_id']
+        for number in range((len(self.pdf_data) + 999) // 1000):
+            self._put_chunk(upload_id, number)
+        response = self._commit(upload_id, sha256='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('checksum mismatch', response.json()['error'])
+        self.assertFalse(Thesis.objects.get(candidate=self.candidate).document)
+        #the chunks are no good, so the next try starts over
+        self.assertFalse(ChunkedUpload.objects.exists())
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
+        #a sha256 sent at the start is checked too
+        upload_id = self._start(sha256='0' * 64).json()['upload_id']
+        for number in range((len(self.pdf_data) + 999) // 1000):
+            self._put_chunk(upload_id, number)
+        self.assertIn('checksum mismatch', self._commit(upload_id).json()['error'])
+
+    def test_invalid_chunks(self):
+        upload_id = self._start().json()['upload_id']
+        response = self._put_chunk(upload_id, 0, data=b'too short')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._put_chunk(upload_id, 1000).status_code, 400)
+        self.assertEqual(ChunkedUpload.objects.get().get_received_chunks(), [])
+
+    def test_invalid_start(self):
+        self.assertEqual(self._start(file_name='test.txt').status_code, 400)
+        self.assertEqual(self._start(size='').status_code, 400)
+        self.assertEqual(self._start(sha256='not a sha256').status_code, 400)
+        self.assertFalse(ChunkedUpload.objects.exists())
+
+    def test_commit_requires_sha256(self):
+        upload_id = self._start().json()['upload_id']
+        for number in range((len(self.pdf_data) + 999) // 1000):
+            self._put_chunk(upload_id, number)
+        for sha256 in ['', 'not a sha256']:
+            response = self._commit(upload_id, sha256=sha256)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('missing or invalid sha256', response.json()['error'])
+        self.assertFalse(Thesis.objects.get(candidate=self.candidate).document)
+        #nothing wrong with the chunks - it can still be committed
+        self.assertEqual(self._commit(upload_id).status_code, 200)
+
+    def test_other_users_upload(self):
+        upload_id = self._start().json()['upload_id']
+        other_client = get_auth_client(username='msmith@brown.edu')
+        response = other_client.get(self._url('candidate_upload_chunked_status', upload_id))
+        self.assertEqual(response.status_code, 403)
+
+    def test_delete_expired(self):
+        upload_id = self._start().json()['upload_id']
+        self._put_chunk(upload_id, 0)
+        ChunkedUpload.objects.update(created=timezone.now() - timedelta(days=settings.CHUNKED_UPLOAD_MAX_AGE_DAYS + 1))
+        call_command('delete_expired_chunked_uploads', stdout=StringIO())
+        self.assertFalse(ChunkedUpload.objects.exists())
+        self.assertEqual(os.listdir(self.tmp_dir.name), [])
 
 
 class TestCandidateMetadata(TestCase, CandidateCreator):
@@ -770,6 +934,63 @@ class TestStaffReview(TestCase, CandidateCreator):
         self.assertEqual(response.status_code, 200)
         #tests passing in the sort_by param, but not really sure how to completely verify result
 
+    def _create_candidates_to_page_through(self):
+        self._create_candidate()
+        add_file_to_thesis(self.candidate.thesis)
+        add_metadata_to_thesis(self.candidate.thesis)
+        self.candidate.committee_members.add(self.committee_member)
+        self.candidate.thesis.submit()
+        for i, last_name in enumerate(['smith', 'adams', 'smith', 'zhang', 'adams', 'brown']):
+            person = self._create_person(netid=f'user{i}@brown.edu', email=f'user{i}@brown.edu', last_name=last_name)
+            department, created = Department.objects.get_or_create(name=f'Department {i % 3}')
+            candidate = Candidate.objects.create(person=person, year=CURRENT_YEAR, department=department, degree=self.degree)
+            candidate.thesis.title = f'title {i % 2}'
+            if i % 2:
+                candidate.thesis.status = Thesis.STATUS_CHOICES.pending
+                candidate.thesis.date_submitted = timezone.now() - timezone.timedelta(days=i % 3)
+            candidate.thesis.save()
+
+    def test_view_candidates_paginated(self):
+        self._create_candidates_to_page_through()
+        staff_client = get_staff_client()
+        url = reverse('review_candidates', kwargs={'status': 'all'})
+        for sort_by in ['', 'title', 'date_registered', 'date_submitted', 'department', 'status']:
+            order_by_field = Candidate._get_order_by_field(sort_by)
+            sort_values = dict(Candidate.objects.values_list('id', order_by_field))
+            #empty values first, then by value, then by id
+            expected_ids = sorted(sort_values, key=lambda id_: (sort_values[id_] is not None, sort_values[id_] or '', id_))
+            seen_ids = []
+            params = {'sort_by': sort_by}
+            with self.settings(STAFF_CANDIDATES_PAGE_SIZE=2):
+                while True:
+                    response = staff_client.get(url, params)
+                    self.assertEqual(response.status_code, 200)
+                    page = response.context['page']
+                    self.assertTrue(len(page) <= 2)
+                    seen_ids.extend([c.id for c in page])
+                    if not page.has_next:
+                        break
+                    self.assertContains(response, 'Next page')
+                    params = {'sort_by': sort_by, 'after': page.next_cursor}
+            self.assertEqual(seen_ids, expected_ids, sort_by)
+
+    def test_view_candidates_query_count(self):
+        #the number of queries shouldn't grow with the number of candidates on the page
+        self._create_candidates_to_page_through()
+        staff_client = get_staff_client()
+        url = reverse('review_candidates', kwargs={'status': 'all'})
+        staff_client.get(url)
+        with self.assertNumQueries(5):
+            response = staff_client.get(url)
+        self.assertEqual(len(response.context['page']), 7)
+
+    def test_view_candidates_bad_cursor(self):
+        self._create_candidate()
+        staff_client = get_staff_client()
+        response = staff_client.get(reverse('review_candidates', kwargs={'status': 'all'}), {'after': 'bad-cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '%s, %s' % (LAST_NAME, FIRST_NAME))
+
 
 class TestStaffApproveThesis(TestCase, CandidateCreator):
 
@@ -873,6 +1094,79 @@ class TestViewInfo(TestCase, CandidateCreator):
         response = auth_client.get(reverse('view_file', kwargs={'candidate_id': self.candidate.id}))
         self.assertEqual(response.status_code, 200)
 
+    def test_view_file_conditional(self):
+        self._create_candidate()
+        add_file_to_thesis(self.candidate.thesis)
+        auth_client = get_auth_client()
+        url = reverse('view_file', kwargs={'candidate_id': self.candidate.id})
+        response = auth_client.get(url)
+        etag = '"b1938fc5549d1b5b42c0b695baa76d5df5f81ac3"'
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('private', response['Cache-Control'])
+        response = auth_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        response = auth_client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        response = auth_client.get(url, HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+        #the permission check still comes first
+        response = get_auth_client(username='wrong_user@brown.edu').get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 403)
+
+    def test_view_file_range(self):
+        self._create_candidate()
+        add_file_to_thesis(self.candidate.thesis)
+        auth_client = get_auth_client()
+        url = reverse('view_file', kwargs={'candidate_id': self.candidate.id})
+        with open(os.path.join(self.cur_dir, 'test_files', TEST_PDF_FILENAME), 'rb') as f:
+            pdf_data = f.read()
+        size = len(pdf_data)
+        response = auth_client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/%s' % size)
+        self.assertEqual(response['Content-Length'], '10')
+        self.assertEqual(b''.join(response.streaming_content), pdf_data[10:20])
+        response = auth_client.get(url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), pdf_data[-5:])
+        response = auth_client.get(url, HTTP_RANGE='bytes=%s-' % (size - 3))
+        self.assertEqual(response['Content-Range'], 'bytes %s-%s/%s' % (size - 3, size - 1, size))
+        response = auth_client.get(url, HTTP_RANGE='bytes=%s-' % size)
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */%s' % size)
+        #multiple ranges aren't supported - send the whole file
+        response = auth_client.get(url, HTTP_RANGE='bytes=0-1,5-6')
+        self.assertEqual(response.status_code, 200)
+        #If-Range with an old etag gets the whole (new) file
+        response = auth_client.get(url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), pdf_data)
+        response = auth_client.get(url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=response['ETag'])
+        self.assertEqual(response.status_code, 206)
+
+    def test_view_file_web_server_delivery(self):
+        self._create_candidate()
+        add_file_to_thesis(self.candidate.thesis)
+        document = Thesis.objects.get(candidate=self.candidate).document
+        url = reverse('view_file', kwargs={'candidate_id': self.candidate.id})
+        with self.settings(THESIS_FILE_DELIVERY='x-sendfile'):
+            response = get_auth_client().get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['X-Sendfile'], urllib.parse.quote(document.path))
+            self.assertEqual(response.content, b'')
+            self.assertEqual(response['Content-Type'], 'application/pdf')
+            self.assertTrue(response.has_header('Content-Disposition'))
+            self.assertEqual(response['ETag'], '"b1938fc5549d1b5b42c0b695baa76d5df5f81ac3"')
+            #permissions are still checked by django
+            response = get_auth_client(username='wrong_user@brown.edu').get(url)
+            self.assertEqual(response.status_code, 403)
+            self.assertFalse(response.has_header('X-Sendfile'))
+        with self.settings(THESIS_FILE_DELIVERY='x-accel-redirect', THESIS_FILE_ACCEL_REDIRECT_PREFIX='/protected/'):
+            response = get_staff_client().get(url)
+            self.assertEqual(response['X-Accel-Redirect'], '/protected/%s' % urllib.parse.quote(document.name))
+            self.assertFalse(response.has_header('X-Sendfile'))
+
     def test_view_file_no_file(self):
         self._create_candidate()
         auth_client = get_auth_client()
@@ -946,6 +1240,56 @@ class TestAutocompleteKeywords(TestCase):
         self.assertEqual(fast_results[0]['children'][0]['id'], '')
         self.assertEqual(fast_results[0]['children'][0]['text'], 'Error retrieving FAST results.')
 
+    @responses.activate
+    def test_fast_results_cached(self):
+        #the counts are kept per process until they're flushed - start from zero
+        fast_cache.reset_stats()
+        responses.add(responses.GET,  'http://fast.oclc.org/searchfast/fastsuggest',
+                 body=json.dumps(responses_data.FAST_PYTHON_DATA),
+                 status=200,
+                 content_type='application/json'
+             )
+        fast_results = _get_fast_results('python')
+        #same term, after normalizing case & whitespace
+        self.assertEqual(_get_fast_results(' Python '), fast_results)
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(fast_cache.get_stats()['hits'], 1)
+        self.assertEqual(fast_cache.get_stats()['misses'], 1)
+        #different index is a different entry
+        _get_fast_results('python', index='suggest50')
+        self.assertEqual(len(responses.calls), 2)
+        #old entries are re-fetched, even if they've been used recently
+        with self.settings(FAST_CACHE_TTL=0):
+            _get_fast_results('python')
+        self.assertEqual(len(responses.calls), 3)
+        out = StringIO()
+        call_command('fast_cache_stats', '--reset', stdout=out)
+        self.assertIn('hits: 1\nmisses: 3\nhit ratio: 25.0%', out.getvalue())
+        self.assertEqual(fast_cache.get_stats()['hits'], 0)
+
+    def test_fast_cache_writes(self):
+        fast_cache.reset_stats()
+        fast_cache.set_results('python', 'suggestall', [])
+        with patch('etd_app.cache_backends.LruDatabaseCache.touch') as touch:
+            with self.settings(FAST_CACHE_STATS_FLUSH_COUNT=3, FAST_CACHE_STATS_FLUSH_SECONDS=600):
+                #just set, so hits don't need to touch it
+                fast_cache.get_results('python', 'suggestall')
+                fast_cache.get_results('python', 'suggestall')
+                touch.assert_not_called()
+                #the counts aren't written on every lookup
+                self.assertFalse(FastCacheCounter.objects.exists())
+                with self.settings(FAST_CACHE_TOUCH_INTERVAL=0):
+                    fast_cache.get_results('python', 'suggestall')
+                touch.assert_called_once()
+                self.assertEqual(FastCacheCounter.get_counts(['hits', 'misses']), {'hits': 3, 'misses': 0})
+
+    @responses.activate
+    def test_fast_errors_not_cached(self):
+        from requests.exceptions import Timeout
+        responses.add(responses.GET,  'http://fast.oclc.org/searchfast/fastsuggest', body=Timeout())
+        _get_fast_results('python')
+        self.assertIsNone(fast_cache.get_results('python', 'suggestall'))
+
     def test_fast_error(self):
         with self.settings(FAST_LOOKUP_BASE_URL='http://localhost/fast'):
             fast_results = _get_fast_results('python')
@@ -954,6 +1298,63 @@ class TestAutocompleteKeywords(TestCase):
             self.assertEqual(fast_results[0]['children'][0]['text'], 'Error retrieving FAST results.')
 
 
+    def _slow(self, seconds, result):
+        def slow(*args, **kwargs):
+            time.sleep(seconds)
+            return result
+        return slow
+
+    def test_autocomplete_lookups_concurrent(self):
+        fast_results = [{'text': 'FAST results', 'children': [{'id': 'fst1', 'text': 'Python'}]}]
+        previously_used = [{'text': 'Previously Used', 'children': [{'id': 1, 'text': 'python'}]}]
+        auth_client = get_auth_client()
+        with patch('etd_app.views._fetch_fast_results', side_effect=self._slow(0.3, fast_results)):
+            with patch('etd_app.views._get_previously_used', side_effect=self._slow(0.3, list(previously_used))):
+                started = time.monotonic()
+                response = auth_client.get('%s?term=python' % reverse('autocomplete_keywords'))
+                self.assertLess(time.monotonic() - started, 0.55)
+        self.assertEqual(response.json(), {'err': 'nil', 'results': previously_used + fast_results})
+        #the FAST results were cached, so next time there's no lookup
+        with patch('etd_app.views._fetch_fast_results') as fetch:
+            response = auth_client.get('%s?term=python' % reverse('autocomplete_keywords'))
+            fetch.assert_not_called()
+        self.assertEqual(response.json()['results'], fast_results)
+
+    def test_autocomplete_latency_budget(self):
+        k = Keyword.objects.create(text='python')
+        auth_client = get_auth_client()
+        with self.settings(AUTOCOMPLETE_LATENCY_BUDGET=0.1):
+            with patch('etd_app.views._fetch_fast_results', side_effect=self._slow(1, [])):
+                started = time.monotonic()
+                #(a term no other test uses, since this lookup is still running after the test)
+                response = auth_client.get('%s?term=pyth' % reverse('autocomplete_keywords'))
+                self.assertLess(time.monotonic() - started, 0.8)
+        results = response.json()['results']
+        self.assertEqual(results[0]['children'][0]['text'], k.text)
+        self.assertEqual(results[1]['children'][0]['text'], 'Error retrieving FAST results.')
+        self.assertIsNone(fast_cache.get_results('pyth', 'suggestall'))
+
+    def test_fast_lookups_coalesced(self):
+        fast_results = [{'text': 'FAST results', 'children': [{'id': 'fst1', 'text': 'Python'}]}]
+        release = threading.Event()
+        def blocked_fetch(term, index):
+            release.wait(5)
+            return fast_results
+        with patch('etd_app.views._fetch_fast_results', side_effect=blocked_fetch) as fetch:
+            futures = [_submit_fast_lookup(term, 'suggestall') for term in ['python', 'Python', ' python ']]
+            other_index = _submit_fast_lookup('python', 'suggest50')
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                threaded = list(pool.map(lambda i: _submit_fast_lookup('python', 'suggestall'), range(4)))
+            release.set()
+            self.assertEqual(len(set(futures + threaded)), 1)
+            self.assertIsNot(other_index, futures[0])
+            self.assertEqual(futures[0].result(timeout=5), fast_results)
+            other_index.result(timeout=5)
+            self.assertEqual(fetch.call_count, 2)
+            #once it's done, the next lookup is a new request
+            _submit_fast_lookup('python', 'suggestall').result(timeout=5)
+            self.assertEqual(fetch.call_count, 3)
+
     def test_autocomplete_keywords(self):
         k = Keyword.objects.create(text='tëst')
         auth_client = get_auth_client()